@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import math
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
+
+from app.ai.rate_limiter import approx_tokens, arun_limited, get_rate_limiter, run_limited
+from app.core.config import get_settings
+from app.core.text import word_tokens
+
+
+class EmbeddingProvider(ABC):
+    model: str
+    dimensions: int
+
+    @abstractmethod
+    def embed_with_usage(
+        self,
+        texts: list[str],
+        estimated_tokens: int | None = None,
+        max_retries: int = 0,
+    ) -> tuple[list[list[float]], int]:
+        """Embebe un batch de textos en una sola llamada, conservando el orden; retorna (vectores, prompt_tokens)."""
+        ...
+
+    def embed(self, texts: list[str], estimated_tokens: int | None = None, max_retries: int = 0) -> list[list[float]]:
+        vectors, _ = self.embed_with_usage(texts, estimated_tokens=estimated_tokens, max_retries=max_retries)
+        return vectors
+
+    async def aembed_with_usage(
+        self,
+        texts: list[str],
+        estimated_tokens: int | None = None,
+        max_retries: int = 0,
+    ) -> tuple[list[list[float]], int]:
+        """Por defecto corre la version sync en un hilo; los proveedores con cliente async la sobreescriben."""
+        return await asyncio.to_thread(self.embed_with_usage, texts, estimated_tokens, max_retries)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    def __init__(
+        self,
+        client: OpenAI,
+        model: str,
+        dimensions: int,
+        async_client: AsyncOpenAI | None = None,
+    ) -> None:
+        self.model = model
+        self.dimensions = dimensions
+        # Los reintentos los maneja run_limited para que los 429 respeten el cooldown compartido.
+        self._client = client.with_options(max_retries=0)
+        self._async_client = async_client.with_options(max_retries=0) if async_client is not None else None
+
+    def _parse_response(self, response: Any) -> tuple[list[list[float]], int]:
+        ordered = sorted(response.data, key=lambda item: item.index)
+        vectors = [item.embedding for item in ordered]
+        for vector in vectors:
+            if len(vector) != self.dimensions:
+                raise ValueError(
+                    f"Embedding dimension mismatch: esperado={self.dimensions}, recibido={len(vector)}"
+                )
+        usage = getattr(response, "usage", None)
+        prompt_tokens = int(getattr(usage, "prompt_tokens", 0) or 0) if usage is not None else 0
+        return vectors, prompt_tokens
+
+    def embed_with_usage(
+        self,
+        texts: list[str],
+        estimated_tokens: int | None = None,
+        max_retries: int = 0,
+    ) -> tuple[list[list[float]], int]:
+        response = run_limited(
+            get_rate_limiter(self.model),
+            lambda: self._client.embeddings.with_raw_response.create(
+                model=self.model,
+                input=texts,
+                dimensions=self.dimensions,
+            ),
+            estimated_tokens=estimated_tokens or approx_tokens(*texts),
+            max_retries=max_retries,
+        )
+        return self._parse_response(response)
+
+    async def aembed_with_usage(
+        self,
+        texts: list[str],
+        estimated_tokens: int | None = None,
+        max_retries: int = 0,
+    ) -> tuple[list[list[float]], int]:
+        if self._async_client is None:
+            return await super().aembed_with_usage(texts, estimated_tokens, max_retries)
+        async_client = self._async_client
+        response = await arun_limited(
+            get_rate_limiter(self.model),
+            lambda: async_client.embeddings.with_raw_response.create(
+                model=self.model,
+                input=texts,
+                dimensions=self.dimensions,
+            ),
+            estimated_tokens=estimated_tokens or approx_tokens(*texts),
+            max_retries=max_retries,
+        )
+        return self._parse_response(response)
+
+
+def _stable_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Backend local y determinista para pruebas de carga sin red ni costo.
+    Unigramas y bigramas de palabras se proyectan con hashing a `n_features`
+    buckets y luego a `dimensions` con una proyeccion gaussiana cuya fila por
+    bucket se genera con semilla fija, sin materializar la matriz completa.
+    """
+
+    def __init__(self, dimensions: int, n_features: int = 1 << 20, seed: int = 13) -> None:
+        self.model = f"hashing-v1-s{seed}"
+        self.dimensions = dimensions
+        self.n_features = n_features
+        self.seed = seed
+        self._row = lru_cache(maxsize=4096)(self._projection_row)
+
+    def _projection_row(self, bucket: int) -> np.ndarray:
+        rng = np.random.default_rng([self.seed, bucket])
+        return rng.standard_normal(self.dimensions, dtype=np.float32)
+
+    def _features(self, text: str) -> dict[int, float]:
+        tokens = word_tokens(text)
+        grams = tokens + [f"{left} {right}" for left, right in zip(tokens, tokens[1:])]
+        counts: Counter[int] = Counter()
+        for gram in grams:
+            hashed = _stable_hash(gram)
+            sign = 1 if hashed & 1 else -1
+            counts[(hashed >> 1) % self.n_features] += sign
+        return {bucket: math.copysign(1.0 + math.log(abs(count)), count) for bucket, count in counts.items() if count}
+
+    def embed_with_usage(
+        self,
+        texts: list[str],
+        estimated_tokens: int | None = None,
+        max_retries: int = 0,
+    ) -> tuple[list[list[float]], int]:
+        vectors: list[list[float]] = []
+        tokens = 0
+        for text in texts:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for bucket, weight in self._features(text).items():
+                vector += np.float32(weight) * self._row(bucket)
+            norm = float(np.linalg.norm(vector))
+            if norm == 0.0:
+                vector = self._row(0).copy()
+                norm = float(np.linalg.norm(vector))
+            vectors.append((vector / norm).tolist())
+            tokens += len(word_tokens(text))
+        return vectors, tokens
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> OpenAI:
+    settings = get_settings()
+    if not settings.openai_api_key:
+        raise ValueError("OPENAI_API_KEY no configurada")
+    return OpenAI(api_key=settings.openai_api_key)
+
+
+def create_embedding_provider(
+    openai_client: OpenAI | None = None,
+    async_openai_client: AsyncOpenAI | None = None,
+) -> EmbeddingProvider:
+    settings = get_settings()
+    provider = settings.embedding_provider
+    if provider == "openai":
+        return OpenAIEmbeddingProvider(
+            client=openai_client or get_openai_client(),
+            model=settings.embedding_model,
+            dimensions=settings.embedding_dimensions,
+            async_client=async_openai_client,
+        )
+    if provider == "hashing":
+        return HashingEmbeddingProvider(dimensions=settings.embedding_dimensions)
+    raise ValueError(f"RAG_EMBED_PROVIDER no soportado: '{provider}' (usa 'openai' o 'hashing')")
+
+
+def active_embedding_model() -> str:
+    """Id del modelo del backend configurado (`RAG_EMBED_PROVIDER`), sin crear clientes."""
+    settings = get_settings()
+    if settings.embedding_provider == "hashing":
+        return HashingEmbeddingProvider(dimensions=settings.embedding_dimensions).model
+    return settings.embedding_model
+
+
+@lru_cache(maxsize=1)
+def get_embedding_provider() -> EmbeddingProvider:
+    return create_embedding_provider()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import sqlite3
+import threading
+from array import array
+from functools import lru_cache
+from pathlib import Path
+
+from app.core.config import get_settings
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.embedding-store")
+
+_SQLITE_MAX_PARAMS = 500
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack_vector(vector: list[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack_vector(blob: bytes) -> list[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingStore:
+    """
+    Store persistente de embeddings direccionado por contenido.
+    Un archivo SQLite por (modelo, dimensiones); la llave es sha256 del texto y
+    el vector se guarda como float32 empaquetado.
+    """
+
+    def __init__(self, root: Path, model: str, dimensions: int) -> None:
+        root.mkdir(parents=True, exist_ok=True)
+        safe_model = re.sub(r"[^A-Za-z0-9._-]", "_", model)
+        self.path = root / f"{safe_model}-{dimensions}.sqlite3"
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (text_hash TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        expected_bytes = self.dimensions * 4
+        with self._lock:
+            for idx in range(0, len(hashes), _SQLITE_MAX_PARAMS):
+                batch = hashes[idx: idx + _SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE text_hash IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for text_hash, blob in rows:
+                    if len(blob) != expected_bytes:
+                        continue
+                    found[text_hash] = _unpack_vector(blob)
+        return found
+
+    def put_many(self, vectors: dict[str, list[float]]) -> None:
+        if not vectors:
+            return
+        rows = [(text_hash, _pack_vector(vector)) for text_hash, vector in vectors.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (text_hash, vector) VALUES (?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return int(row[0]) if row else 0
+
+
+@lru_cache(maxsize=8)
+def _open_store(root: str, model: str, dimensions: int) -> EmbeddingStore:
+    store = EmbeddingStore(Path(root), model, dimensions)
+    logger.info("embedding_store_ready path=%s entries=%d", store.path, store.count())
+    return store
+
+
+def get_embedding_store(model: str, dimensions: int) -> EmbeddingStore | None:
+    settings = get_settings()
+    if not settings.embedding_cache_enabled:
+        return None
+    return _open_store(settings.embedding_cache_dir, model, dimensions)
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
-import random
-import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Iterable
+from typing import Callable, Iterable
 
 import tiktoken
-from openai import OpenAI
 
+from app.ai.embedding_provider import EmbeddingProvider, get_embedding_provider
+from app.ai.embedding_store import get_embedding_store, hash_text
+from app.ai.rate_limiter import approx_tokens
 from app.core.config import get_settings
 from app.core.logger import get_logger
 
@@ -15,78 +16,166 @@ from app.core.logger import get_logger
 logger = get_logger("ms-ia-orquestacion.embeddings")
 
 
-@lru_cache(maxsize=1)
-def get_openai_client() -> OpenAI:
-    settings = get_settings()
-    if not settings.openai_api_key:
-        raise ValueError("OPENAI_API_KEY no configurada")
-    return OpenAI(api_key=settings.openai_api_key)
+@lru_cache(maxsize=8)
+def _get_encoding(model_name: str) -> tiktoken.Encoding | None:
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except Exception:
+        pass
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        # Sin red ni cache local de tiktoken se usa la estimacion por caracteres.
+        logger.warning("tiktoken_unavailable model=%s reason=%s", model_name, exc)
+        return None
 
 
 def estimate_tokens(texts: Iterable[str], model: str | None = None) -> int:
     settings = get_settings()
-    model_name = model or settings.embedding_model
-    try:
-        encoding = tiktoken.encoding_for_model(model_name)
-    except Exception:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = _get_encoding(model or settings.embedding_model)
 
     total = 0
     for text in texts:
-        total += len(encoding.encode(text))
+        total += len(encoding.encode(text, disallowed_special=())) if encoding is not None else approx_tokens(text)
     return total
 
 
-def _chunks(items: list[str], size: int) -> Iterable[list[str]]:
-    for idx in range(0, len(items), size):
-        yield items[idx: idx + size]
-
-
-def embed_texts(texts: list[str], batch_size: int | None = None, max_retries: int | None = None) -> list[list[float]]:
+def _prepare_inputs(texts: list[str], max_input_tokens: int, model: str) -> tuple[list[str], list[int]]:
+    """
+    Cuenta tokens por texto y trunca (a los primeros `max_input_tokens` tokens)
+    los textos que exceden el limite de entrada del modelo.
+    """
+    encoding = _get_encoding(model)
+    inputs: list[str] = []
+    token_counts: list[int] = []
+    for text in texts:
+        if encoding is None:
+            text = text[: max_input_tokens * 4]
+            inputs.append(text)
+            token_counts.append(approx_tokens(text))
+            continue
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) > max_input_tokens:
+            logger.warning("embedding_input_truncated tokens=%d max_tokens=%d", len(tokens), max_input_tokens)
+            tokens = tokens[:max_input_tokens]
+            text = encoding.decode(tokens)
+        inputs.append(text)
+        token_counts.append(len(tokens))
+    return inputs, token_counts
+
+
+def _pack_batches(token_counts: list[int], max_items: int, max_tokens: int) -> list[list[int]]:
+    """Agrupa indices en batches que respetan un maximo de items y un presupuesto de tokens."""
+    batches: list[list[int]] = []
+    current: list[int] = []
+    current_tokens = 0
+    for idx, count in enumerate(token_counts):
+        if current and (len(current) >= max_items or current_tokens + count > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(idx)
+        current_tokens += count
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch(provider: EmbeddingProvider, batch: list[str], token_count: int, retries: int) -> list[list[float]]:
+    try:
+        return provider.embed(batch, estimated_tokens=token_count, max_retries=retries)
+    except ValueError:
+        raise
+    except Exception as exc:
+        raise RuntimeError(f"Error embedding batch tras {retries} reintentos: {exc}") from exc
+
+
+def _embed_uncached(
+    provider: EmbeddingProvider,
+    texts: list[str],
+    batch_size: int,
+    retries: int,
+    concurrency: int,
+    on_batch: Callable[[list[str], list[list[float]]], None] | None = None,
+) -> list[list[float]]:
+    settings = get_settings()
+    max_input_tokens = min(settings.embedding_max_input_tokens, settings.embedding_batch_max_tokens)
+    inputs, token_counts = _prepare_inputs(texts, max_input_tokens, provider.model)
+    batches = _pack_batches(token_counts, max_items=batch_size, max_tokens=settings.embedding_batch_max_tokens)
+    results: list[list[list[float]]] = [[] for _ in batches]
+
+    def _run(idx: int) -> None:
+        indices = batches[idx]
+        vectors = _embed_batch(provider, [inputs[i] for i in indices], sum(token_counts[i] for i in indices), retries)
+        if on_batch is not None:
+            on_batch([texts[i] for i in indices], vectors)
+        results[idx] = vectors
+
+    logger.info(
+        "embedding_batches texts=%d batches=%d tokens=%d max_batch_tokens=%d",
+        len(texts),
+        len(batches),
+        sum(token_counts),
+        settings.embedding_batch_max_tokens,
+    )
+
+    workers = max(1, min(concurrency, len(batches)))
+    if workers == 1:
+        for idx in range(len(batches)):
+            _run(idx)
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+            futures = [executor.submit(_run, idx) for idx in range(len(batches))]
+            for future in futures:
+                future.result()
+
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+
+def embed_texts(
+    texts: list[str],
+    batch_size: int | None = None,
+    max_retries: int | None = None,
+    concurrency: int | None = None,
+) -> list[list[float]]:
     settings = get_settings()
-    client = get_openai_client()
     if not texts:
         return []
 
     requested_batch_size = batch_size or settings.embedding_batch_size
     retries = max_retries if max_retries is not None else settings.embedding_max_retries
-    embedded: list[list[float]] = []
-
-    for batch in _chunks(texts, requested_batch_size):
-        attempt = 0
-        while True:
-            attempt += 1
-            try:
-                response = client.embeddings.create(
-                    model=settings.embedding_model,
-                    input=batch,
-                    dimensions=settings.embedding_dimensions,
-                )
-
-                ordered = sorted(response.data, key=lambda x: x.index)
-                vectors = [item.embedding for item in ordered]
-
-                for vector in vectors:
-                    if len(vector) != settings.embedding_dimensions:
-                        raise ValueError(
-                            f"Embedding dimension mismatch: esperado={settings.embedding_dimensions}, recibido={len(vector)}"
-                        )
-
-                embedded.extend(vectors)
-                break
-
-            except Exception as exc:
-                if attempt > retries:
-                    raise RuntimeError(f"Error embedding batch tras {retries} reintentos: {exc}") from exc
-
-                wait_s = min(8.0, (2 ** (attempt - 1)) + random.uniform(0.1, 0.7))
-                logger.warning(
-                    "embedding_batch_retry attempt=%d/%d wait=%.2fs reason=%s",
-                    attempt,
-                    retries,
-                    wait_s,
-                    exc,
-                )
-                time.sleep(wait_s)
-
-    return embedded
+    workers = concurrency or settings.embedding_concurrency
+    provider = get_embedding_provider()
+    store = get_embedding_store(provider.model, provider.dimensions)
+
+    hashes = [hash_text(text) for text in texts]
+    unique: dict[str, str] = {}
+    for text_hash, text in zip(hashes, texts):
+        unique.setdefault(text_hash, text)
+
+    resolved = store.get_many(list(unique)) if store is not None else {}
+    missing = [text_hash for text_hash in unique if text_hash not in resolved]
+
+    if missing:
+        def _persist(batch: list[str], vectors: list[list[float]]) -> None:
+            if store is not None:
+                store.put_many({hash_text(text): vector for text, vector in zip(batch, vectors)})
+
+        vectors = _embed_uncached(
+            provider,
+            [unique[text_hash] for text_hash in missing],
+            batch_size=requested_batch_size,
+            retries=retries,
+            concurrency=workers,
+            on_batch=_persist,
+        )
+        resolved.update(zip(missing, vectors))
+
+    logger.info(
+        "embed_texts requested=%d unique=%d cache_hits=%d embedded=%d",
+        len(texts),
+        len(unique),
+        len(unique) - len(missing),
+        len(missing),
+    )
+    return [resolved[text_hash] for text_hash in hashes]
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+from app.ai.embedding_provider import EmbeddingProvider
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.query-batcher")
+
+
+class _MicroBatcherBase:
+    def __init__(self, provider: EmbeddingProvider, window_ms: float, max_batch: int, max_retries: int) -> None:
+        self.provider = provider
+        self.window_s = max(0.0, window_ms / 1000.0)
+        self.max_batch = max(1, max_batch)
+        self.max_retries = max_retries
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._inputs = 0
+
+    def _fan_out(
+        self,
+        texts: list[str],
+        unique: list[str],
+        vectors: list[list[float]],
+        prompt_tokens: int,
+    ) -> list[tuple[list[float], int]]:
+        """(vector, tokens) por texto del batch; los tokens se reparten segun el largo y entre textos repetidos."""
+        by_text = dict(zip(unique, vectors))
+        waiters = Counter(texts)
+        total_chars = sum(len(text) for text in unique) or 1
+        results = [
+            (by_text[text], round(prompt_tokens * len(text) / total_chars / waiters[text]))
+            for text in texts
+        ]
+        with self._stats_lock:
+            self._requests += len(texts)
+            self._batches += 1
+            self._inputs += len(unique)
+        if len(texts) > 1:
+            logger.info("query_embed_batch requests=%d inputs=%d", len(texts), len(unique))
+        return results
+
+    def stats(self) -> dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "requests": self._requests,
+                "batches": self._batches,
+                "inputs": self._inputs,
+                "avgBatchSize": round(self._requests / self._batches, 2) if self._batches else 0.0,
+                "windowMs": round(self.window_s * 1000, 2),
+                "maxBatch": self.max_batch,
+            }
+
+
+class EmbeddingMicroBatcher(_MicroBatcherBase):
+    """
+    Agrupa embeddings de preguntas que llegan en paralelo desde distintos requests.
+    El primer texto abre una ventana de `window_ms`; todo lo que llegue en ella (hasta
+    `max_batch`) sale en un solo `embeddings.create` y cada resultado vuelve a su Future
+    como (vector, tokens); los tokens del batch se reparten segun el largo de cada texto.
+    Camino sync: los batches salen por un pool de `max_in_flight` hilos.
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        window_ms: float,
+        max_batch: int,
+        max_retries: int,
+        max_in_flight: int = 4,
+    ) -> None:
+        super().__init__(provider, window_ms, max_batch, max_retries)
+        self._queue: queue.Queue[tuple[str, Future[tuple[list[float], int]]]] = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix="embed-batch")
+        self._worker: threading.Thread | None = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._collect_loop, name="embed-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, text: str) -> Future[tuple[list[float], int]]:
+        self._ensure_worker()
+        future: Future[tuple[list[float], int]] = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> tuple[list[float], int]:
+        return self.submit(text).result()
+
+    def _collect_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch: list[tuple[str, Future[tuple[list[float], int]]]]) -> None:
+        texts = [text for text, _ in batch]
+        unique = list(dict.fromkeys(texts))
+        try:
+            vectors, prompt_tokens = self.provider.embed_with_usage(unique, max_retries=self.max_retries)
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        for (_, future), result in zip(batch, self._fan_out(texts, unique, vectors, prompt_tokens)):
+            future.set_result(result)
+
+
+class AsyncEmbeddingMicroBatcher(_MicroBatcherBase):
+    """
+    Misma ventana que `EmbeddingMicroBatcher`, pero en el event loop: el batch sale con
+    `aembed_with_usage` (cliente async), sin hilos ni tope de batches en vuelo; la
+    concurrencia hacia OpenAI la limita el rate limiter.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, window_ms: float, max_batch: int, max_retries: int) -> None:
+        super().__init__(provider, window_ms, max_batch, max_retries)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: list[tuple[str, asyncio.Future[tuple[list[float], int]]]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def embed(self, text: str) -> tuple[list[float], int]:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Un loop nuevo (ej. otro asyncio.run en scripts): lo pendiente del anterior ya no se puede resolver.
+            self._loop, self._pending, self._flush_handle = loop, [], None
+        future: asyncio.Future[tuple[list[float], int]] = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_s, self._flush_pending)
+        return await future
+
+    def _flush_pending(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch or self._loop is None:
+            return
+        task = self._loop.create_task(self._flush(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch: list[tuple[str, asyncio.Future[tuple[list[float], int]]]]) -> None:
+        texts = [text for text, _ in batch]
+        unique = list(dict.fromkeys(texts))
+        try:
+            vectors, prompt_tokens = await self.provider.aembed_with_usage(unique, max_retries=self.max_retries)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), result in zip(batch, self._fan_out(texts, unique, vectors, prompt_tokens)):
+            # Un request cancelado (cliente desconectado) no recibe resultado; el resto del batch si.
+            if not future.done():
+                future.set_result(result)
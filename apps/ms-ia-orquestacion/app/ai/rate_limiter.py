@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Mapping
+
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from app.core.config import get_settings
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.rate-limiter")
+
+_WINDOW_S = 60.0
+_SLOT_POLL_S = 0.02
+_DEFAULT_COOLDOWN_S = 1.0
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def approx_tokens(*texts: str) -> int:
+    """Estimacion barata (~4 caracteres por token) para reservar presupuesto TPM."""
+    return max(1, sum(len(text) for text in texts) // 4)
+
+
+def _parse_duration_s(raw: str | None) -> float | None:
+    """Parsea duraciones estilo OpenAI ('20ms', '1s', '6m0s') o segundos planos."""
+    if not raw:
+        return None
+    value = raw.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    factors = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(amount) * factors[unit] for amount, unit in parts)
+
+
+def _parse_int(raw: str | None) -> int | None:
+    if raw is None:
+        return None
+    try:
+        return int(float(raw))
+    except ValueError:
+        return None
+
+
+def _retry_after_s(headers: Mapping[str, str] | None) -> float | None:
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    return _parse_duration_s(headers.get("retry-after"))
+
+
+class AdaptiveRateLimiter:
+    """
+    Limitador del lado cliente para un modelo de OpenAI.
+    Controla requests/min y tokens/min en una ventana deslizante de 60s, respeta
+    Retry-After y los headers x-ratelimit-remaining-*, y ajusta la concurrencia
+    con AIMD: +1 slot por ventana de exitos, mitad de slots ante cada 429.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rpm_limit: int,
+        tpm_limit: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.name = name
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.decrease_factor = decrease_factor
+
+        self._lock = threading.Lock()
+        self._concurrency = float(self.max_concurrency)
+        self._in_flight = 0
+        self._events: deque[tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._cooldown_until = 0.0
+        self._remaining_requests: int | None = None
+        self._remaining_tokens: int | None = None
+        self._requests_reset_at = 0.0
+        self._tokens_reset_at = 0.0
+        self._throttled = 0
+        self._rate_limited = 0
+
+    def _prune(self, now: float) -> None:
+        while self._events and now - self._events[0][0] >= _WINDOW_S:
+            _, tokens = self._events.popleft()
+            self._window_tokens -= tokens
+
+    def _try_reserve(self, tokens: int) -> float:
+        """Reserva un slot y presupuesto; retorna 0.0 si lo obtuvo o los segundos a esperar."""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if now < self._cooldown_until:
+                return self._cooldown_until - now
+            if self._remaining_requests is not None and now >= self._requests_reset_at:
+                self._remaining_requests = None
+            if self._remaining_tokens is not None and now >= self._tokens_reset_at:
+                self._remaining_tokens = None
+            if self._remaining_requests is not None and self._remaining_requests <= 0:
+                return self._requests_reset_at - now
+            if self._remaining_tokens is not None and self._remaining_tokens < tokens:
+                return self._tokens_reset_at - now
+            if self._in_flight >= int(self._concurrency):
+                return _SLOT_POLL_S
+            if self.rpm_limit > 0 and len(self._events) >= self.rpm_limit:
+                return self._events[0][0] + _WINDOW_S - now
+            if self.tpm_limit > 0 and self._events and self._window_tokens + tokens > self.tpm_limit:
+                return self._events[0][0] + _WINDOW_S - now
+
+            self._in_flight += 1
+            self._events.append((now, tokens))
+            self._window_tokens += tokens
+            if self._remaining_requests is not None:
+                self._remaining_requests -= 1
+            if self._remaining_tokens is not None:
+                self._remaining_tokens -= tokens
+            return 0.0
+
+    def acquire(self, tokens: int = 0) -> None:
+        throttled = False
+        while True:
+            wait_s = self._try_reserve(tokens)
+            if wait_s <= 0:
+                break
+            throttled = True
+            time.sleep(min(wait_s, 1.0))
+        if throttled:
+            with self._lock:
+                self._throttled += 1
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        throttled = False
+        while True:
+            wait_s = self._try_reserve(tokens)
+            if wait_s <= 0:
+                break
+            throttled = True
+            await asyncio.sleep(min(wait_s, 1.0))
+        if throttled:
+            with self._lock:
+                self._throttled += 1
+
+    def release(self, headers: Mapping[str, str] | None = None, rate_limited: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if rate_limited:
+                self._rate_limited += 1
+                self._concurrency = max(float(self.min_concurrency), self._concurrency * self.decrease_factor)
+                cooldown_s = _retry_after_s(headers) or _DEFAULT_COOLDOWN_S
+                self._cooldown_until = max(self._cooldown_until, now + cooldown_s)
+            else:
+                self._concurrency = min(float(self.max_concurrency), self._concurrency + 1.0 / max(self._concurrency, 1.0))
+
+            if headers:
+                remaining_requests = _parse_int(headers.get("x-ratelimit-remaining-requests"))
+                remaining_tokens = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+                if remaining_requests is not None:
+                    self._remaining_requests = remaining_requests
+                    self._requests_reset_at = now + (_parse_duration_s(headers.get("x-ratelimit-reset-requests")) or 0.0)
+                if remaining_tokens is not None:
+                    self._remaining_tokens = remaining_tokens
+                    self._tokens_reset_at = now + (_parse_duration_s(headers.get("x-ratelimit-reset-tokens")) or 0.0)
+
+        if rate_limited:
+            logger.warning(
+                "openai_rate_limited limiter=%s concurrency=%.2f cooldown_s=%.2f",
+                self.name,
+                self._concurrency,
+                max(0.0, self._cooldown_until - now),
+            )
+
+    def snapshot(self) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            return {
+                "concurrency": round(self._concurrency, 2),
+                "inFlight": self._in_flight,
+                "requestsLastMinute": len(self._events),
+                "tokensLastMinute": self._window_tokens,
+                "remainingRequests": self._remaining_requests,
+                "remainingTokens": self._remaining_tokens,
+                "cooldownS": round(max(0.0, self._cooldown_until - now), 3),
+                "throttled": self._throttled,
+                "rateLimited": self._rate_limited,
+            }
+
+
+def _backoff_s(attempt: int) -> float:
+    return min(8.0, (2 ** (attempt - 1)) + random.uniform(0.1, 0.7))
+
+
+def run_limited(
+    limiter: AdaptiveRateLimiter,
+    call: Callable[[], Any],
+    estimated_tokens: int,
+    max_retries: int,
+) -> Any:
+    """
+    Ejecuta `call` (que debe retornar un `with_raw_response` del SDK) bajo el limitador.
+    Los 429 se reintentan tras el cooldown compartido; errores transitorios con backoff.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        limiter.acquire(estimated_tokens)
+        try:
+            raw = call()
+        except RateLimitError as exc:
+            limiter.release(headers=exc.response.headers, rate_limited=True)
+            if attempt > max_retries:
+                raise
+            continue
+        except (APIConnectionError, InternalServerError) as exc:
+            limiter.release()
+            if attempt > max_retries:
+                raise
+            wait_s = _backoff_s(attempt)
+            logger.warning("openai_call_retry limiter=%s attempt=%d wait=%.2fs reason=%s", limiter.name, attempt, wait_s, exc)
+            time.sleep(wait_s)
+            continue
+        except Exception:
+            limiter.release()
+            raise
+
+        limiter.release(headers=raw.headers)
+        return raw.parse()
+
+
+async def arun_limited(
+    limiter: AdaptiveRateLimiter,
+    call: Callable[[], Awaitable[Any]],
+    estimated_tokens: int,
+    max_retries: int,
+) -> Any:
+    attempt = 0
+    while True:
+        attempt += 1
+        await limiter.acquire_async(estimated_tokens)
+        try:
+            raw = await call()
+        except RateLimitError as exc:
+            limiter.release(headers=exc.response.headers, rate_limited=True)
+            if attempt > max_retries:
+                raise
+            continue
+        except (APIConnectionError, InternalServerError) as exc:
+            limiter.release()
+            if attempt > max_retries:
+                raise
+            wait_s = _backoff_s(attempt)
+            logger.warning("openai_call_retry limiter=%s attempt=%d wait=%.2fs reason=%s", limiter.name, attempt, wait_s, exc)
+            await asyncio.sleep(wait_s)
+            continue
+        except Exception:
+            limiter.release()
+            raise
+
+        limiter.release(headers=raw.headers)
+        return raw.parse()
+
+
+_limiters: dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> AdaptiveRateLimiter:
+    """Un limitador por modelo: OpenAI aplica los limites RPM/TPM por modelo."""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            settings = get_settings()
+            limiter = AdaptiveRateLimiter(
+                name=model,
+                rpm_limit=settings.openai_rpm_limit,
+                tpm_limit=settings.openai_tpm_limit,
+                max_concurrency=settings.openai_max_concurrency,
+                min_concurrency=settings.openai_min_concurrency,
+            )
+            _limiters[model] = limiter
+        return limiter
+
+
+def get_rate_limiter_summary() -> dict[str, Any]:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Any
+
+
+# USD por 1M tokens: (input, output, input cacheado).
+_PRICES_PER_MTOK: dict[str, tuple[float, float, float]] = {
+    "text-embedding-3-small": (0.02, 0.0, 0.02),
+    "text-embedding-3-large": (0.13, 0.0, 0.13),
+    "text-embedding-ada-002": (0.10, 0.0, 0.10),
+    "gpt-4.1": (2.00, 8.00, 0.50),
+    "gpt-4.1-mini": (0.40, 1.60, 0.10),
+    "gpt-4.1-nano": (0.10, 0.40, 0.025),
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    "gpt-5": (1.25, 10.00, 0.125),
+    "gpt-5-mini": (0.25, 2.00, 0.025),
+    "gpt-5-nano": (0.05, 0.40, 0.005),
+}
+
+
+def estimate_cost_usd(model: str, prompt_tokens: int, completion_tokens: int = 0, cached_tokens: int = 0) -> float:
+    prices = _PRICES_PER_MTOK.get(model)
+    if prices is None:
+        # Modelos con sufijo de fecha (ej. gpt-4.1-mini-2025-04-14): se toma el prefijo mas largo conocido.
+        matches = [name for name in _PRICES_PER_MTOK if model.startswith(f"{name}-")]
+        if not matches:
+            return 0.0
+        prices = _PRICES_PER_MTOK[max(matches, key=len)]
+    input_price, output_price, cached_price = prices
+    uncached = max(0, prompt_tokens - cached_tokens)
+    cost = (uncached * input_price) + (cached_tokens * cached_price) + (completion_tokens * output_price)
+    return round(cost / 1_000_000, 8)
+
+
+@dataclass
+class StageUsage:
+    model: str = ""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency_ms: float = 0.0
+
+    @property
+    def cost_usd(self) -> float:
+        return estimate_cost_usd(self.model, self.prompt_tokens, self.completion_tokens, self.cached_tokens)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "model": self.model or None,
+            "calls": self.calls,
+            "promptTokens": self.prompt_tokens,
+            "completionTokens": self.completion_tokens,
+            "cachedTokens": self.cached_tokens,
+            "latencyMs": round(self.latency_ms, 2),
+            "estimatedCostUsd": self.cost_usd,
+        }
+
+
+class UsageLedger:
+    """Tokens, costo y latencia por etapa (embed, retrieval, rerank, generate) de un request."""
+
+    def __init__(self, correlation_id: str | None, source: str | None, tenant_id: str | None) -> None:
+        self.correlation_id = correlation_id
+        self.source = source
+        self.tenant_id = tenant_id
+        self.stages: dict[str, StageUsage] = {}
+
+    def _stage(self, stage: str) -> StageUsage:
+        return self.stages.setdefault(stage, StageUsage())
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cached_tokens: int = 0,
+    ) -> None:
+        entry = self._stage(stage)
+        entry.model = model
+        entry.calls += 1
+        entry.prompt_tokens += prompt_tokens
+        entry.completion_tokens += completion_tokens
+        entry.cached_tokens += cached_tokens
+
+    def record_completion(self, stage: str, model: str, usage: Any) -> None:
+        """Registra el `usage` de una respuesta de chat.completions del SDK de OpenAI."""
+        if usage is None:
+            self.record(stage, model)
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.record(
+            stage,
+            model,
+            prompt_tokens=int(getattr(usage, "prompt_tokens", 0) or 0),
+            completion_tokens=int(getattr(usage, "completion_tokens", 0) or 0),
+            cached_tokens=int(getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+        )
+
+    def record_latency(self, latency_ms: dict[str, float]) -> None:
+        for stage, value in latency_ms.items():
+            if stage == "total" or (not value and stage not in self.stages):
+                continue
+            self._stage(stage).latency_ms += float(value or 0.0)
+
+    def to_dict(self) -> dict[str, Any]:
+        stages = {name: usage.to_dict() for name, usage in self.stages.items()}
+        return {
+            "correlationId": self.correlation_id,
+            "source": self.source,
+            "tenantId": self.tenant_id,
+            "stages": stages,
+            "totals": {
+                "promptTokens": sum(item.prompt_tokens for item in self.stages.values()),
+                "completionTokens": sum(item.completion_tokens for item in self.stages.values()),
+                "cachedTokens": sum(item.cached_tokens for item in self.stages.values()),
+                "estimatedCostUsd": round(sum(item.cost_usd for item in self.stages.values()), 8),
+            },
+        }
+
+
+class UsageAggregator:
+    """Acumulado en memoria (por proceso) de los ledgers, agrupado por tenant, source, etapa y modelo."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows: dict[tuple[str, str, str, str], dict[str, float]] = {}
+        self._requests = 0
+
+    def add(self, ledger: UsageLedger) -> None:
+        tenant = ledger.tenant_id or ""
+        source = ledger.source or ""
+        with self._lock:
+            self._requests += 1
+            for stage, usage in ledger.stages.items():
+                key = (tenant, source, stage, usage.model)
+                row = self._rows.setdefault(
+                    key,
+                    {
+                        "requests": 0,
+                        "calls": 0,
+                        "promptTokens": 0,
+                        "completionTokens": 0,
+                        "cachedTokens": 0,
+                        "latencyMs": 0.0,
+                        "estimatedCostUsd": 0.0,
+                    },
+                )
+                row["requests"] += 1
+                row["calls"] += usage.calls
+                row["promptTokens"] += usage.prompt_tokens
+                row["completionTokens"] += usage.completion_tokens
+                row["cachedTokens"] += usage.cached_tokens
+                row["latencyMs"] += usage.latency_ms
+                row["estimatedCostUsd"] += usage.cost_usd
+
+    def summary(
+        self,
+        tenant_id: str | None = None,
+        source: str | None = None,
+        stage: str | None = None,
+    ) -> dict[str, Any]:
+        with self._lock:
+            items = list(self._rows.items())
+            requests = self._requests
+
+        rows: list[dict[str, Any]] = []
+        for (row_tenant, row_source, row_stage, model), values in items:
+            if tenant_id is not None and row_tenant != tenant_id:
+                continue
+            if source is not None and row_source != source:
+                continue
+            if stage is not None and row_stage != stage:
+                continue
+            count = int(values["requests"])
+            rows.append(
+                {
+                    "tenantId": row_tenant or None,
+                    "source": row_source or None,
+                    "stage": row_stage,
+                    "model": model or None,
+                    "requests": count,
+                    "calls": int(values["calls"]),
+                    "promptTokens": int(values["promptTokens"]),
+                    "completionTokens": int(values["completionTokens"]),
+                    "cachedTokens": int(values["cachedTokens"]),
+                    "avgLatencyMs": round(values["latencyMs"] / count, 2) if count else 0.0,
+                    "estimatedCostUsd": round(values["estimatedCostUsd"], 6),
+                }
+            )
+
+        rows.sort(key=lambda row: (row["tenantId"] or "", row["source"] or "", row["stage"]))
+        return {
+            "requests": requests,
+            "estimatedCostUsd": round(sum(row["estimatedCostUsd"] for row in rows), 6),
+            "rows": rows,
+        }
+
+
+_aggregator = UsageAggregator()
+
+
+def get_usage_aggregator() -> UsageAggregator:
+    return _aggregator
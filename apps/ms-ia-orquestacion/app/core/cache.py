@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, TypeVar
+
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Cache LRU en proceso con expiracion por TTL y contadores de hit/miss."""
+
+    def __init__(self, maxsize: int, ttl_s: float) -> None:
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def _lookup(self, key: Hashable) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl_s > 0 and time.monotonic() - entry[0] > self.ttl_s):
+            if entry is not None:
+                del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key: Hashable) -> V | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def peek(self, key: Hashable) -> V | None:
+        """Como `get` (TTL y orden LRU incluidos) pero sin tocar los contadores de hit/miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key: Hashable, value: V) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxSize": self.maxsize,
+                "ttlS": self.ttl_s,
+            }
@@ -46,16 +46,42 @@ def _get_float(name: str, default: float) -> float:
     return float(raw)
 
 
+def _get_mapping(name: str) -> dict[str, str]:
+    """`clave=valor` separados por coma, ej. `tenant_a=rag_tenant_a,tenant_b=rag_tenant_b`."""
+    mapping: dict[str, str] = {}
+    for item in os.getenv(name, "").split(","):
+        key, sep, value = item.partition("=")
+        if sep and key.strip() and value.strip():
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+def _get_list(name: str) -> list[str]:
+    """Valores separados por coma, sin vacios ni repetidos."""
+    return list(dict.fromkeys(item.strip() for item in os.getenv(name, "").split(",") if item.strip()))
+
+
 @dataclass(frozen=True)
 class Settings:
     env_path: str
     node_env: str
     openai_api_key: str
     openai_model: str
+    openai_max_retries: int
+    openai_rpm_limit: int
+    openai_tpm_limit: int
+    openai_max_concurrency: int
+    openai_min_concurrency: int
+    embedding_provider: str
     embedding_model: str
     embedding_dimensions: int
     embedding_batch_size: int
     embedding_max_retries: int
+    embedding_concurrency: int
+    embedding_batch_max_tokens: int
+    embedding_max_input_tokens: int
+    embedding_cache_enabled: bool
+    embedding_cache_dir: str
 
     mongodb_uri: str
     mongodb_db: str
@@ -66,9 +92,52 @@ class Settings:
     mongo_socket_timeout_ms: int
 
     qdrant_url: str
+    qdrant_replica_urls: list[str]
+    qdrant_lb_policy: str
+    qdrant_eject_failures: int
+    qdrant_health_interval_s: float
+    qdrant_hedge_after_ms: float
+    qdrant_path: str
+    qdrant_bootstrap_path: str
+    qdrant_path_lock_timeout_s: float
     qdrant_api_key: str
     qdrant_collection: str
+    qdrant_tenant_collections: dict[str, str]
     qdrant_timeout_s: int
+    qdrant_prefer_grpc: bool
+    qdrant_grpc_port: int
+    qdrant_grpc_compression: str
+    qdrant_pool_size: int
+    qdrant_keepalive_connections: int
+    qdrant_keepalive_s: float
+    qdrant_storage_profile: str
+    qdrant_layout_migration: str
+    qdrant_on_disk_vectors: bool
+    qdrant_quantization_oversampling: float
+    qdrant_quantization_rescore: bool
+    qdrant_hnsw_m: int
+    qdrant_hnsw_ef_construct: int
+    qdrant_full_scan_threshold_kb: int
+    qdrant_indexing_threshold_kb: int
+    rag_hnsw_ef: int
+    rag_exact_search: bool
+    rag_exact_max_points: int
+    matryoshka_dim: int
+    matryoshka_prefetch_multiplier: int
+    hybrid_enabled: bool
+    two_phase_retrieval: bool
+    hot_tier_enabled: bool
+    hot_tier_dir: str
+    hot_tier_dtype: str
+    hot_tier_reload_s: float
+    hybrid_prefetch_multiplier: int
+    sparse_avgdl: float
+    multi_query_count: int
+    multi_query_mode: str
+    multi_query_model: str
+    rag_version_group_size: int
+    rag_version_legacy_fallback: bool
+    rag_citation_fast_path: bool
 
     chunk_size: int
     chunk_overlap: int
@@ -80,9 +149,20 @@ class Settings:
     rag_final_k: int
     rag_score_threshold: float
     rag_rerank_mode: str
+    rag_mmr_lambda: float
     rag_filter_source: str | None
     rag_filter_version: str | None
+    rag_tenant_include_shared: bool
     rag_temperature: float
+    query_cache_size: int
+    query_cache_ttl_s: float
+    retrieval_cache_size: int
+    retrieval_cache_ttl_s: float
+    retrieval_generation_dir: str
+    retrieval_generation_refresh_s: float
+    query_batch_window_ms: float
+    query_batch_max_size: int
+    query_batch_max_in_flight: int
 
 
 @lru_cache(maxsize=1)
@@ -93,10 +173,21 @@ def get_settings() -> Settings:
         node_env=os.getenv("NODE_ENV", "development"),
         openai_api_key=os.getenv("OPENAI_API_KEY", ""),
         openai_model=os.getenv("OPENAI_MODEL", "gpt-4.1-mini"),
+        openai_max_retries=_get_int("RAG_OPENAI_MAX_RETRIES", 2),
+        openai_rpm_limit=_get_int("RAG_OPENAI_RPM_LIMIT", 0),
+        openai_tpm_limit=_get_int("RAG_OPENAI_TPM_LIMIT", 0),
+        openai_max_concurrency=_get_int("RAG_OPENAI_MAX_CONCURRENCY", 32),
+        openai_min_concurrency=_get_int("RAG_OPENAI_MIN_CONCURRENCY", 1),
+        embedding_provider=os.getenv("RAG_EMBED_PROVIDER", "openai").strip().lower(),
         embedding_model=os.getenv("RAG_EMBED_MODEL", "text-embedding-3-small"),
         embedding_dimensions=_get_int("RAG_EMBED_DIM", 1536),
         embedding_batch_size=_get_int("RAG_EMBED_BATCH_SIZE", 64),
         embedding_max_retries=_get_int("RAG_EMBED_MAX_RETRIES", 4),
+        embedding_concurrency=_get_int("RAG_EMBED_CONCURRENCY", 4),
+        embedding_batch_max_tokens=_get_int("RAG_EMBED_BATCH_MAX_TOKENS", 250_000),
+        embedding_max_input_tokens=_get_int("RAG_EMBED_MAX_INPUT_TOKENS", 8191),
+        embedding_cache_enabled=_get_bool("RAG_EMBED_CACHE_ENABLED", True),
+        embedding_cache_dir=os.getenv("RAG_EMBED_CACHE_DIR", str(SERVICE_ROOT / ".cache" / "embeddings")),
         mongodb_uri=os.getenv("MONGODB_URI", ""),
         mongodb_db=os.getenv("MONGODB_DB", "sofia"),
         mongodb_collection=os.getenv("MONGODB_COLLECTION", "rag_documents"),
@@ -105,9 +196,52 @@ def get_settings() -> Settings:
         mongo_connect_timeout_ms=_get_int("MONGO_CONNECT_TIMEOUT_MS", 5000),
         mongo_socket_timeout_ms=_get_int("MONGO_SOCKET_TIMEOUT_MS", 20000),
         qdrant_url=os.getenv("QDRANT_URL", "http://localhost:6333"),
+        qdrant_replica_urls=_get_list("QDRANT_REPLICA_URLS"),
+        qdrant_lb_policy=os.getenv("QDRANT_LB_POLICY", "ewma").strip().lower(),
+        qdrant_eject_failures=_get_int("QDRANT_EJECT_FAILURES", 2),
+        qdrant_health_interval_s=_get_float("QDRANT_HEALTH_INTERVAL_S", 5.0),
+        qdrant_hedge_after_ms=_get_float("QDRANT_HEDGE_AFTER_MS", 0.0),
+        qdrant_path=os.getenv("QDRANT_PATH", "").strip(),
+        qdrant_bootstrap_path=os.getenv("QDRANT_BOOTSTRAP_PATH", "").strip(),
+        qdrant_path_lock_timeout_s=_get_float("QDRANT_PATH_LOCK_TIMEOUT_S", 30.0),
         qdrant_api_key=os.getenv("QDRANT_API_KEY", ""),
         qdrant_collection=os.getenv("QDRANT_COLLECTION", "rag_documents"),
+        qdrant_tenant_collections=_get_mapping("QDRANT_TENANT_COLLECTIONS"),
         qdrant_timeout_s=_get_int("QDRANT_TIMEOUT_S", 20),
+        qdrant_prefer_grpc=_get_bool("QDRANT_PREFER_GRPC", False),
+        qdrant_grpc_port=_get_int("QDRANT_GRPC_PORT", 6334),
+        qdrant_grpc_compression=os.getenv("QDRANT_GRPC_COMPRESSION", "none").strip().lower(),
+        qdrant_pool_size=_get_int("QDRANT_POOL_SIZE", 0),
+        qdrant_keepalive_connections=_get_int("QDRANT_KEEPALIVE_CONNECTIONS", 20),
+        qdrant_keepalive_s=_get_float("QDRANT_KEEPALIVE_S", 30.0),
+        qdrant_storage_profile=os.getenv("QDRANT_STORAGE_PROFILE", "default").strip().lower(),
+        qdrant_layout_migration=os.getenv("QDRANT_LAYOUT_MIGRATION", "error").strip().lower(),
+        qdrant_on_disk_vectors=_get_bool("QDRANT_ON_DISK_VECTORS", False),
+        qdrant_quantization_oversampling=_get_float("QDRANT_QUANTIZATION_OVERSAMPLING", 2.0),
+        qdrant_quantization_rescore=_get_bool("QDRANT_QUANTIZATION_RESCORE", True),
+        qdrant_hnsw_m=_get_int("QDRANT_HNSW_M", 16),
+        qdrant_hnsw_ef_construct=_get_int("QDRANT_HNSW_EF_CONSTRUCT", 100),
+        qdrant_full_scan_threshold_kb=_get_int("QDRANT_FULL_SCAN_THRESHOLD_KB", 10_000),
+        qdrant_indexing_threshold_kb=_get_int("QDRANT_INDEXING_THRESHOLD_KB", 20_000),
+        rag_hnsw_ef=_get_int("RAG_HNSW_EF", 0),
+        rag_exact_search=_get_bool("RAG_EXACT_SEARCH", False),
+        rag_exact_max_points=_get_int("RAG_EXACT_MAX_POINTS", 0),
+        matryoshka_dim=_get_int("RAG_MATRYOSHKA_DIM", 0),
+        matryoshka_prefetch_multiplier=_get_int("RAG_MATRYOSHKA_PREFETCH_MULTIPLIER", 4),
+        hybrid_enabled=_get_bool("RAG_HYBRID_ENABLED", False),
+        two_phase_retrieval=_get_bool("RAG_TWO_PHASE_RETRIEVAL", True),
+        hot_tier_enabled=_get_bool("RAG_HOT_TIER_ENABLED", False),
+        hot_tier_dir=os.getenv("RAG_HOT_TIER_DIR", str(SERVICE_ROOT / ".cache" / "hot_tier")),
+        hot_tier_dtype=os.getenv("RAG_HOT_TIER_DTYPE", "float16").strip().lower(),
+        hot_tier_reload_s=_get_float("RAG_HOT_TIER_RELOAD_S", 2.0),
+        hybrid_prefetch_multiplier=_get_int("RAG_HYBRID_PREFETCH_MULTIPLIER", 3),
+        sparse_avgdl=_get_float("RAG_SPARSE_AVGDL", 120.0),
+        multi_query_count=_get_int("RAG_MULTI_QUERY_COUNT", 0),
+        multi_query_mode=os.getenv("RAG_MULTI_QUERY_MODE", "rules").strip().lower(),
+        multi_query_model=os.getenv("RAG_MULTI_QUERY_MODEL", "").strip(),
+        rag_version_group_size=_get_int("RAG_VERSION_GROUP_SIZE", 0),
+        rag_version_legacy_fallback=_get_bool("RAG_VERSION_LEGACY_FALLBACK", True),
+        rag_citation_fast_path=_get_bool("RAG_CITATION_FAST_PATH", False),
         chunk_size=_get_int("RAG_INGEST_CHUNK_SIZE", 1000),
         chunk_overlap=_get_int("RAG_INGEST_CHUNK_OVERLAP", 150),
         min_chunk_size=_get_int("RAG_INGEST_MIN_CHUNK_SIZE", 300),
@@ -118,7 +252,21 @@ def get_settings() -> Settings:
         rag_final_k=_get_int("RAG_FINAL_K", 5),
         rag_score_threshold=_get_float("RAG_SCORE_THRESHOLD", 0.72),
         rag_rerank_mode=os.getenv("RAG_RERANK_MODE", "cosine").strip().lower(),
+        rag_mmr_lambda=_get_float("RAG_MMR_LAMBDA", 1.0),
         rag_filter_source=(os.getenv("RAG_FILTER_SOURCE", "").strip() or None),
         rag_filter_version=(os.getenv("RAG_FILTER_VERSION", "").strip() or None),
+        rag_tenant_include_shared=_get_bool("RAG_TENANT_INCLUDE_SHARED", True),
         rag_temperature=_get_float("RAG_TEMPERATURE", 0.3),
+        query_cache_size=_get_int("RAG_QUERY_CACHE_SIZE", 2048),
+        query_cache_ttl_s=_get_float("RAG_QUERY_CACHE_TTL_S", 3600.0),
+        retrieval_cache_size=_get_int("RAG_RETRIEVAL_CACHE_SIZE", 1024),
+        retrieval_cache_ttl_s=_get_float("RAG_RETRIEVAL_CACHE_TTL_S", 3600.0),
+        retrieval_generation_dir=os.getenv(
+            "RAG_RETRIEVAL_GENERATION_DIR",
+            str(SERVICE_ROOT / ".cache" / "generations"),
+        ),
+        retrieval_generation_refresh_s=_get_float("RAG_RETRIEVAL_GENERATION_REFRESH_S", 1.0),
+        query_batch_window_ms=_get_float("RAG_QUERY_BATCH_WINDOW_MS", 5.0),
+        query_batch_max_size=_get_int("RAG_QUERY_BATCH_MAX_SIZE", 32),
+        query_batch_max_in_flight=_get_int("RAG_QUERY_BATCH_MAX_IN_FLIGHT", 4),
     )
@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def fold_accents(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
+
+
+def word_tokens(text: str) -> list[str]:
+    """Tokens de palabra en minuscula y sin tildes ('Liquidación' -> 'liquidacion')."""
+    return _WORD_RE.findall(fold_accents(text).lower())
+
+
+def canonical_query(text: str) -> str:
+    """Forma canonica de una pregunta para llaves de cache: sin tildes, minuscula, espacios colapsados."""
+    folded = " ".join(fold_accents(text).lower().split())
+    return folded.strip(" ¿?¡!.,;:")
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from qdrant_client import QdrantClient
+
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.qdrant.embedded")
+
+# Archivos del modo local de qdrant-client: `.lock` lo toma el cliente abierto (portalocker, exclusivo).
+_LOCK_FILE = ".lock"
+_META_FILE = "meta.json"
+_COLLECTIONS_DIR = "collection"
+
+
+def _read_meta(root: Path) -> dict[str, Any]:
+    try:
+        return json.loads((root / _META_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {"collections": {}, "aliases": {}}
+
+
+def _write_meta(root: Path, meta: dict[str, Any]) -> None:
+    tmp_path = root / f".{_META_FILE}.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp_path, root / _META_FILE)
+
+
+def _storage_busy_error(path: str | Path) -> RuntimeError:
+    return RuntimeError(
+        f"QDRANT_PATH '{path}' esta abierto por otro proceso. El modo embebido admite un solo proceso "
+        "(uvicorn --workers 1); para ingestar con el servicio corriendo usa POST /v1/ai/rag-ingest."
+    )
+
+
+def bootstrap_embedded_storage(
+    path: str | Path,
+    bootstrap_path: str | Path,
+    collection_names: list[str],
+    lock_timeout_s: float,
+) -> list[str]:
+    """
+    Copia a `path` las colecciones de un storage local prearmado (`bootstrap_path`) que todavia no existen.
+    Toma el mismo `.lock` que el cliente local: si otro proceso tiene el storage abierto, espera a que lo suelte
+    (o falla al vencer `lock_timeout_s`) en vez de copiar debajo de un cliente vivo.
+    """
+    import portalocker  # como en qdrant-client: importarlo al cargar el modulo falla en sistemas de archivos de solo lectura
+
+    root, source = Path(path), Path(bootstrap_path)
+    source_meta = _read_meta(source)
+    if not source_meta["collections"]:
+        logger.warning("qdrant_embedded_bootstrap_empty source=%s", source)
+        return []
+
+    current = _read_meta(root)["collections"]
+    if all(name in current or name not in source_meta["collections"] for name in collection_names):
+        return []
+
+    root.mkdir(parents=True, exist_ok=True)
+    copied: list[str] = []
+    lock = portalocker.Lock(
+        str(root / _LOCK_FILE),
+        mode="a",
+        timeout=lock_timeout_s,
+        flags=portalocker.LockFlags.EXCLUSIVE | portalocker.LockFlags.NON_BLOCKING,
+    )
+    try:
+        lock.acquire()
+    except portalocker.exceptions.LockException as exc:
+        raise _storage_busy_error(root) from exc
+    try:
+        meta = _read_meta(root)
+        for name in collection_names:
+            if name in meta["collections"]:
+                continue
+            if name not in source_meta["collections"]:
+                logger.warning("qdrant_embedded_bootstrap_missing collection=%s source=%s", name, source)
+                continue
+            target_dir = root / _COLLECTIONS_DIR / name
+            tmp_dir = root / _COLLECTIONS_DIR / f".{name}.bootstrap"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            shutil.rmtree(target_dir, ignore_errors=True)
+            shutil.copytree(source / _COLLECTIONS_DIR / name, tmp_dir)
+            os.replace(tmp_dir, target_dir)
+            meta["collections"][name] = source_meta["collections"][name]
+            copied.append(name)
+        if copied:
+            # meta.json al final: si la copia se corta, la coleccion no figura y el proximo arranque la vuelve a copiar.
+            _write_meta(root, meta)
+    finally:
+        lock.release()
+    logger.info("qdrant_embedded_bootstrap path=%s source=%s copied=%s", root, source, copied)
+    return copied
+
+
+def open_embedded_client(path: str | Path, lock_timeout_s: float) -> QdrantClient:
+    """`QdrantClient(path=...)`; si otro proceso tiene el storage (ej. el deploy anterior), reintenta hasta el timeout."""
+    deadline = time.monotonic() + lock_timeout_s
+    while True:
+        try:
+            # Las llamadas se serializan en LockedQdrantClient, asi que la conexion sqlite puede cambiar de hilo.
+            return QdrantClient(path=str(path), force_disable_check_same_thread=True)
+        except RuntimeError as exc:
+            if "already accessed" not in str(exc):
+                raise
+            if time.monotonic() >= deadline:
+                raise _storage_busy_error(path) from exc
+            time.sleep(0.2)
+
+
+class LockedQdrantClient:
+    """Serializa las llamadas a un cliente local: el modo embebido no es seguro entre hilos."""
+
+    def __init__(self, client: QdrantClient) -> None:
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        return call
+
+
+class EmbeddedAsyncQdrantClient:
+    """
+    Interfaz de AsyncQdrantClient sobre el mismo cliente embebido: un `AsyncQdrantClient(path=...)` aparte
+    pediria el lock del storage por segunda vez. Cada llamada corre en un hilo para no bloquear el event loop.
+    """
+
+    def __init__(self, client: LockedQdrantClient) -> None:
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return call
@@ -1,23 +1,50 @@
 from __future__ import annotations
 
+import atexit
+import math
 from functools import lru_cache
 from typing import Any
 
-from qdrant_client import QdrantClient, models
+import grpc
+import httpx
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 
 from app.core.config import get_settings
 from app.core.logger import get_logger
+from app.db.embedded import (
+    EmbeddedAsyncQdrantClient,
+    LockedQdrantClient,
+    bootstrap_embedded_storage,
+    open_embedded_client,
+)
+from app.db.replicas import AsyncReplicatedQdrantClient, Replica, ReplicaPool, ReplicatedQdrantClient
 
 
 logger = get_logger("ms-ia-orquestacion.qdrant")
 
+FULL_VECTOR_NAME = "full"
+SHORT_VECTOR_NAME = "short"
+SPARSE_VECTOR_NAME = "bm25"
+TENANT_FIELD = "tenantId"
+# docId + chunkIndex (+ tenant): agrupa las versiones del mismo chunk para `query_points_groups`.
+CHUNK_KEY_FIELD = "chunkKey"
+# Citas normalizadas del chunk ("art:64", "art:64:cst", "ley:1010") para el atajo de citas.
+LEGAL_REFS_FIELD = "legalRefs"
+# `rag_service.ingest` guarda el texto en chunkText; `ingest_pdf`, en text.
+CHUNK_TEXT_FIELDS = ("chunkText", "text")
 
-def _ensure_payload_index(client: QdrantClient, collection_name: str, field_name: str) -> None:
+
+def _ensure_payload_index(
+    client: QdrantClient,
+    collection_name: str,
+    field_name: str,
+    field_schema: Any = models.PayloadSchemaType.KEYWORD,
+) -> None:
     try:
         client.create_payload_index(
             collection_name=collection_name,
             field_name=field_name,
-            field_schema=models.PayloadSchemaType.KEYWORD,
+            field_schema=field_schema,
             wait=True,
         )
         logger.info("qdrant_payload_index_ready collection=%s field=%s", collection_name, field_name)
@@ -32,88 +59,579 @@ def _ensure_payload_index(client: QdrantClient, collection_name: str, field_name
 def get_qdrant_runtime_summary() -> dict[str, Any]:
     settings = get_settings()
     return {
-        "url": settings.qdrant_url,
+        "mode": "embedded" if settings.qdrant_path else "server",
+        "url": settings.qdrant_url if not settings.qdrant_path else None,
+        "replicaUrls": settings.qdrant_replica_urls if not settings.qdrant_path else [],
+        "lbPolicy": settings.qdrant_lb_policy if settings.qdrant_replica_urls else None,
+        "hedgeAfterMs": settings.qdrant_hedge_after_ms or None,
+        "path": settings.qdrant_path or None,
+        "bootstrapPath": settings.qdrant_bootstrap_path or None,
         "collection": settings.qdrant_collection,
         "apiKeyConfigured": bool(settings.qdrant_api_key),
         "timeoutSeconds": settings.qdrant_timeout_s,
+        "transport": "grpc" if settings.qdrant_prefer_grpc else "rest",
+        "grpcCompression": settings.qdrant_grpc_compression if settings.qdrant_prefer_grpc else None,
+        "poolSize": settings.qdrant_pool_size or None,
+        "storageProfile": settings.qdrant_storage_profile,
+        "onDiskVectors": settings.qdrant_on_disk_vectors,
+        "hybrid": settings.hybrid_enabled,
+        "tenantCollections": settings.qdrant_tenant_collections,
+        "tenantIncludeShared": settings.rag_tenant_include_shared,
+        "hnsw": {
+            "m": settings.qdrant_hnsw_m,
+            "efConstruct": settings.qdrant_hnsw_ef_construct,
+            "ef": settings.rag_hnsw_ef or None,
+            "exactMaxPoints": settings.rag_exact_max_points,
+        },
     }
 
 
-@lru_cache(maxsize=1)
-def get_qdrant_client() -> QdrantClient:
+def _grpc_compression(name: str) -> grpc.Compression | None:
+    if name in {"", "none"}:
+        return None
+    if name == "gzip":
+        return grpc.Compression.Gzip
+    raise ValueError(f"QDRANT_GRPC_COMPRESSION no soportada: '{name}' (usa 'none' o 'gzip')")
+
+
+def qdrant_client_options(prefer_grpc: bool | None = None, url: str | None = None) -> dict[str, Any]:
+    """
+    Argumentos comunes de QdrantClient/AsyncQdrantClient. Con gRPC los vectores viajan como
+    floats binarios en protobuf en vez de JSON; `pool_size` fija los canales gRPC (y las
+    conexiones REST que el cliente sigue usando para algunas operaciones). `url` elige una
+    replica distinta de QDRANT_URL.
+    """
     settings = get_settings()
-    if not settings.qdrant_url:
+    url = url or settings.qdrant_url
+    if not url:
         raise ValueError("QDRANT_URL no configurada")
 
-    client = QdrantClient(
-        url=settings.qdrant_url,
-        api_key=settings.qdrant_api_key or None,
-        timeout=settings.qdrant_timeout_s,
+    options: dict[str, Any] = {
+        "url": url,
+        "api_key": settings.qdrant_api_key or None,
+        "timeout": settings.qdrant_timeout_s,
+    }
+    keepalive_ms = int(settings.qdrant_keepalive_s * 1000)
+    use_grpc = settings.qdrant_prefer_grpc if prefer_grpc is None else prefer_grpc
+    if use_grpc:
+        options.update(
+            {
+                "prefer_grpc": True,
+                "grpc_port": settings.qdrant_grpc_port,
+                "grpc_options": {
+                    "grpc.keepalive_time_ms": keepalive_ms,
+                    "grpc.keepalive_timeout_ms": min(keepalive_ms, 10_000),
+                    "grpc.keepalive_permit_without_calls": 1,
+                    "grpc.http2.max_pings_without_data": 0,
+                    "grpc.max_receive_message_length": 64 * 1024 * 1024,
+                },
+                "grpc_compression": _grpc_compression(settings.qdrant_grpc_compression),
+            }
+        )
+        if settings.qdrant_pool_size > 0:
+            options["pool_size"] = settings.qdrant_pool_size
+    else:
+        options["limits"] = httpx.Limits(
+            max_connections=settings.qdrant_pool_size or None,
+            max_keepalive_connections=settings.qdrant_keepalive_connections,
+            keepalive_expiry=settings.qdrant_keepalive_s,
+        )
+    return options
+
+
+@lru_cache(maxsize=1)
+def _get_embedded_client() -> LockedQdrantClient:
+    """Storage local en QDRANT_PATH, compartido por el cliente sync y el async del proceso."""
+    settings = get_settings()
+    if settings.qdrant_bootstrap_path:
+        bootstrap_embedded_storage(
+            settings.qdrant_path,
+            settings.qdrant_bootstrap_path,
+            list(dict.fromkeys([settings.qdrant_collection, *settings.qdrant_tenant_collections.values()])),
+            lock_timeout_s=settings.qdrant_path_lock_timeout_s,
+        )
+    client = LockedQdrantClient(open_embedded_client(settings.qdrant_path, settings.qdrant_path_lock_timeout_s))
+    # Cierra antes del teardown del interprete: libera el `.lock` para el siguiente proceso sin ruido en stderr.
+    atexit.register(client.close)
+    logger.info(
+        "qdrant_client_ready mode=embedded path=%s collection=%s",
+        settings.qdrant_path,
+        settings.qdrant_collection,
+    )
+    return client
+
+
+def _readyz_ping() -> Any:
+    """`/readyz` por REST (sin API key): un nodo que reinicia no esta listo hasta cargar sus colecciones."""
+    http = httpx.Client(timeout=min(2.0, float(get_settings().qdrant_timeout_s)))
+
+    def ping(replica: Replica) -> None:
+        http.get(f"{replica.url.rstrip('/')}/readyz").raise_for_status()
+
+    return ping
+
+
+@lru_cache(maxsize=1)
+def get_replica_pool() -> ReplicaPool | None:
+    """Pool de QDRANT_URL (primario) + QDRANT_REPLICA_URLS; None con un solo endpoint o en modo embebido."""
+    settings = get_settings()
+    if settings.qdrant_path or not settings.qdrant_replica_urls:
+        return None
+    urls = list(dict.fromkeys([settings.qdrant_url, *settings.qdrant_replica_urls]))
+    pool = ReplicaPool(
+        [
+            Replica(
+                url=url,
+                client=QdrantClient(**qdrant_client_options(url=url)),
+                async_factory=lambda url=url: AsyncQdrantClient(**qdrant_client_options(url=url)),
+            )
+            for url in urls
+        ],
+        policy=settings.qdrant_lb_policy,
+        eject_failures=settings.qdrant_eject_failures,
+        hedge_after_ms=settings.qdrant_hedge_after_ms,
+        ping=_readyz_ping(),
+    )
+    healthy = pool.check_health()
+    if healthy == 0:
+        raise RuntimeError(f"Ninguna replica de Qdrant responde: {urls}")
+    pool.start_health_checks(settings.qdrant_health_interval_s)
+    logger.info(
+        "qdrant_replica_pool_ready urls=%s healthy=%d policy=%s hedge_after_ms=%s",
+        urls,
+        healthy,
+        settings.qdrant_lb_policy,
+        settings.qdrant_hedge_after_ms,
     )
+    return pool
+
+
+@lru_cache(maxsize=1)
+def get_qdrant_client() -> QdrantClient:
+    settings = get_settings()
+    if settings.qdrant_path:
+        return _get_embedded_client()
+    pool = get_replica_pool()
+    if pool is not None:
+        return ReplicatedQdrantClient(pool)
+    client = QdrantClient(**qdrant_client_options())
     client.get_collections()
-    logger.info("qdrant_client_ready url=%s collection=%s", settings.qdrant_url, settings.qdrant_collection)
+    logger.info(
+        "qdrant_client_ready url=%s collection=%s transport=%s",
+        settings.qdrant_url,
+        settings.qdrant_collection,
+        "grpc" if settings.qdrant_prefer_grpc else "rest",
+    )
     return client
 
 
-def ensure_rag_collection() -> None:
+@lru_cache(maxsize=1)
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    """Cliente async para el camino de serving; comparte configuracion con el cliente sync."""
+    if get_settings().qdrant_path:
+        return EmbeddedAsyncQdrantClient(_get_embedded_client())
+    pool = get_replica_pool()
+    if pool is not None:
+        return AsyncReplicatedQdrantClient(pool)
+    return AsyncQdrantClient(**qdrant_client_options())
+
+
+def truncate_embedding(embedding: list[float], dimensions: int) -> list[float]:
+    """Trunca un embedding Matryoshka (text-embedding-3) y lo re-normaliza a norma 1."""
+    head = embedding[:dimensions]
+    norm = math.sqrt(sum(value * value for value in head))
+    if norm == 0:
+        return head
+    return [value / norm for value in head]
+
+
+def dense_vector_name() -> str | None:
+    """Nombre del vector denso completo; None cuando la coleccion usa un vector sin nombre."""
+    return FULL_VECTOR_NAME if get_settings().matryoshka_dim > 0 else None
+
+
+def _vectors_config() -> models.VectorParams | dict[str, models.VectorParams]:
     settings = get_settings()
-    client = get_qdrant_client()
-    collections = client.get_collections().collections
-    exists = any(item.name == settings.qdrant_collection for item in collections)
-    if exists:
-        collection_info = client.get_collection(settings.qdrant_collection)
-        vectors_cfg = collection_info.config.params.vectors
-        current_dim: int | None = None
+    full = models.VectorParams(
+        size=settings.embedding_dimensions,
+        distance=models.Distance.COSINE,
+        on_disk=settings.qdrant_on_disk_vectors,
+    )
+    if settings.matryoshka_dim <= 0:
+        return full
+    return {
+        FULL_VECTOR_NAME: full,
+        SHORT_VECTOR_NAME: models.VectorParams(size=settings.matryoshka_dim, distance=models.Distance.COSINE),
+    }
 
-        if isinstance(vectors_cfg, dict):
-            first_cfg = next(iter(vectors_cfg.values()), None)
-            current_dim = int(first_cfg.size) if first_cfg is not None else None
-        else:
-            current_dim = int(vectors_cfg.size)
-
-        if current_dim != settings.embedding_dimensions:
-            logger.warning(
-                "qdrant_collection_dim_mismatch collection=%s current_dim=%s target_dim=%d recreating=true",
-                settings.qdrant_collection,
-                current_dim,
-                settings.embedding_dimensions,
-            )
-            client.recreate_collection(
-                collection_name=settings.qdrant_collection,
-                vectors_config=models.VectorParams(
-                    size=settings.embedding_dimensions,
-                    distance=models.Distance.COSINE,
+
+def _sparse_vectors_config() -> dict[str, models.SparseVectorParams] | None:
+    if not get_settings().hybrid_enabled:
+        return None
+    return {SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)}
+
+
+def _ensure_sparse_vectors(client: QdrantClient, collection_name: str, collection_info: Any) -> None:
+    target = _sparse_vectors_config()
+    current = collection_info.config.params.sparse_vectors or {}
+    if target is None or SPARSE_VECTOR_NAME in current:
+        return
+    client.update_collection(collection_name=collection_name, sparse_vectors_config=target)
+    logger.warning(
+        "qdrant_sparse_vectors_added collection=%s name=%s reingest_required=true",
+        collection_name,
+        SPARSE_VECTOR_NAME,
+    )
+
+
+def _quantization_config() -> models.ScalarQuantization | models.BinaryQuantization | None:
+    profile = get_settings().qdrant_storage_profile
+    if profile == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if profile == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    if profile in {"", "default"}:
+        return None
+    raise ValueError(f"QDRANT_STORAGE_PROFILE no soportado: '{profile}' (usa 'default', 'scalar' o 'binary')")
+
+
+def _quantization_kind(config: Any) -> str:
+    if isinstance(config, models.ScalarQuantization):
+        return "scalar"
+    if isinstance(config, models.BinaryQuantization):
+        return "binary"
+    return "default"
+
+
+def build_search_params(hnsw_ef: int = 0, exact: bool = False) -> models.SearchParams | None:
+    """
+    Parametros de busqueda por request: `hnsw_ef` (0 = default del indice), busqueda exacta y,
+    segun el perfil de almacenamiento, rescore/oversampling con cuantizacion.
+    """
+    settings = get_settings()
+    quantization = None
+    if _quantization_config() is not None:
+        quantization = models.QuantizationSearchParams(
+            ignore=False,
+            rescore=settings.qdrant_quantization_rescore,
+            oversampling=settings.qdrant_quantization_oversampling,
+        )
+    if quantization is None and hnsw_ef <= 0 and not exact:
+        return None
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef if hnsw_ef > 0 else None,
+        exact=exact,
+        quantization=quantization,
+    )
+
+
+def _hnsw_config() -> models.HnswConfigDiff:
+    settings = get_settings()
+    return models.HnswConfigDiff(
+        m=settings.qdrant_hnsw_m,
+        ef_construct=settings.qdrant_hnsw_ef_construct,
+        full_scan_threshold=settings.qdrant_full_scan_threshold_kb,
+    )
+
+
+def _optimizers_config() -> models.OptimizersConfigDiff:
+    return models.OptimizersConfigDiff(indexing_threshold=get_settings().qdrant_indexing_threshold_kb)
+
+
+def _migrate_index_profile(client: QdrantClient, collection_name: str, collection_info: Any) -> None:
+    """Aplica m/ef_construct/umbrales si cambiaron; Qdrant reconstruye el HNSW en segundo plano."""
+    target_hnsw = _hnsw_config()
+    target_optimizers = _optimizers_config()
+    current_hnsw = collection_info.config.hnsw_config
+    current_optimizers = collection_info.config.optimizer_config
+    current = (
+        current_hnsw.m,
+        current_hnsw.ef_construct,
+        current_hnsw.full_scan_threshold,
+        current_optimizers.indexing_threshold,
+    )
+    target = (
+        target_hnsw.m,
+        target_hnsw.ef_construct,
+        target_hnsw.full_scan_threshold,
+        target_optimizers.indexing_threshold,
+    )
+    if current == target:
+        return
+
+    client.update_collection(
+        collection_name=collection_name,
+        hnsw_config=target_hnsw,
+        optimizers_config=target_optimizers,
+    )
+    logger.info(
+        "qdrant_index_profile_migrated collection=%s m_ef_fullscan_indexing=%s->%s",
+        collection_name,
+        current,
+        target,
+    )
+
+
+def _migrate_storage_profile(client: QdrantClient, collection_name: str, collection_info: Any) -> None:
+    settings = get_settings()
+    target_quantization = _quantization_config()
+    current_kind = _quantization_kind(collection_info.config.quantization_config)
+    target_kind = _quantization_kind(target_quantization)
+
+    vectors_cfg = collection_info.config.params.vectors
+    full_name = dense_vector_name() or ""
+    full_cfg = vectors_cfg.get(full_name) if isinstance(vectors_cfg, dict) else vectors_cfg
+    current_on_disk = bool(getattr(full_cfg, "on_disk", False))
+
+    if current_kind == target_kind and current_on_disk == settings.qdrant_on_disk_vectors:
+        return
+
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={full_name: models.VectorParamsDiff(on_disk=settings.qdrant_on_disk_vectors)},
+        quantization_config=target_quantization or models.Disabled.DISABLED,
+    )
+    logger.info(
+        "qdrant_storage_profile_migrated collection=%s quantization=%s->%s on_disk=%s->%s",
+        collection_name,
+        current_kind,
+        target_kind,
+        current_on_disk,
+        settings.qdrant_on_disk_vectors,
+    )
+
+
+def _vector_layout(vectors_cfg: Any) -> dict[str, int]:
+    if isinstance(vectors_cfg, dict):
+        return {name: int(cfg.size) for name, cfg in vectors_cfg.items()}
+    return {"": int(vectors_cfg.size)}
+
+
+def collection_for_tenant(tenant_id: str | None) -> str:
+    """Coleccion dedicada del tenant (`QDRANT_TENANT_COLLECTIONS`) o la compartida."""
+    settings = get_settings()
+    if tenant_id and tenant_id in settings.qdrant_tenant_collections:
+        return settings.qdrant_tenant_collections[tenant_id]
+    return settings.qdrant_collection
+
+
+def is_dedicated_collection(collection_name: str) -> bool:
+    return collection_name != get_settings().qdrant_collection
+
+
+def tenant_scope_condition(tenant_id: str | None) -> models.Condition:
+    """Alcance estricto para escrituras: los chunks del tenant, o los compartidos (sin tenantId) si no hay tenant."""
+    if tenant_id:
+        return models.FieldCondition(key=TENANT_FIELD, match=models.MatchValue(value=tenant_id))
+    return models.IsEmptyCondition(is_empty=models.PayloadField(key=TENANT_FIELD))
+
+
+def chunk_group_key(doc_id: str, chunk_index: int, tenant_id: str | None = None) -> str:
+    """Misma clave para todas las versiones de un chunk; con tenant no se mezcla con el chunk compartido."""
+    base = f"{doc_id}:{chunk_index}"
+    return f"{tenant_id}|{base}" if tenant_id else base
+
+
+def _ensure_payload_indexes(client: QdrantClient, collection_name: str) -> None:
+    _ensure_payload_index(client, collection_name, "source")
+    _ensure_payload_index(client, collection_name, "version")
+    _ensure_payload_index(client, collection_name, "docId")
+    _ensure_payload_index(client, collection_name, CHUNK_KEY_FIELD)
+    _ensure_payload_index(client, collection_name, LEGAL_REFS_FIELD)
+    if get_settings().rag_citation_fast_path:
+        # Respaldo por frase ("articulo 64") para chunks ingeridos antes de legalRefs.
+        for field_name in CHUNK_TEXT_FIELDS:
+            _ensure_payload_index(
+                client,
+                collection_name,
+                field_name,
+                models.TextIndexParams(
+                    type=models.TextIndexType.TEXT,
+                    tokenizer=models.TokenizerType.WORD,
+                    lowercase=True,
+                    ascii_folding=True,
+                    phrase_matching=True,
                 ),
             )
-            logger.info(
-                "qdrant_collection_recreated name=%s dim=%d",
-                settings.qdrant_collection,
-                settings.embedding_dimensions,
-            )
+    # is_tenant: Qdrant agrupa los vectores por tenant en disco y la busqueda filtrada no recorre a los demas.
+    _ensure_payload_index(
+        client,
+        collection_name,
+        TENANT_FIELD,
+        models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+    )
 
-        _ensure_payload_index(client, settings.qdrant_collection, "source")
-        _ensure_payload_index(client, settings.qdrant_collection, "version")
-        return
 
+def _create_collection(client: QdrantClient, collection_name: str) -> None:
     client.create_collection(
-        collection_name=settings.qdrant_collection,
-        vectors_config=models.VectorParams(
-            size=settings.embedding_dimensions,
-            distance=models.Distance.COSINE,
-        ),
+        collection_name=collection_name,
+        vectors_config=_vectors_config(),
+        sparse_vectors_config=_sparse_vectors_config(),
+        quantization_config=_quantization_config(),
+        hnsw_config=_hnsw_config(),
+        optimizers_config=_optimizers_config(),
+    )
+
+
+def _migrated_point_vector(vector: Any) -> list[float] | dict[str, Any]:
+    """Vectores del layout actual a partir del embedding completo guardado (el corto se deriva, sin re-embeber)."""
+    settings = get_settings()
+    named = vector if isinstance(vector, dict) else {"": vector}
+    embedding = named.get(FULL_VECTOR_NAME, named.get(""))
+    if embedding is None or len(embedding) != settings.embedding_dimensions:
+        raise RuntimeError("punto sin vector denso completo de RAG_EMBED_DIM valores")
+    vectors: dict[str, Any]
+    if settings.matryoshka_dim <= 0:
+        vectors = {"": embedding}
+    else:
+        vectors = {
+            FULL_VECTOR_NAME: embedding,
+            SHORT_VECTOR_NAME: truncate_embedding(embedding, settings.matryoshka_dim),
+        }
+    if settings.hybrid_enabled and named.get(SPARSE_VECTOR_NAME) is not None:
+        vectors[SPARSE_VECTOR_NAME] = named[SPARSE_VECTOR_NAME]
+    if list(vectors) == [""]:
+        return embedding
+    return vectors
+
+
+def _copy_points(client: QdrantClient, source: str, target: str, batch_size: int = 256) -> int:
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[
+                    models.PointStruct(id=point.id, vector=_migrated_point_vector(point.vector), payload=point.payload)
+                    for point in points
+                ],
+                wait=True,
+            )
+            copied += len(points)
+        if offset is None:
+            return copied
+
+
+def _migrate_vector_layout(client: QdrantClient, collection_name: str) -> None:
+    """
+    Pasa los puntos al layout actual via una coleccion temporal: el vector `short` se deriva del `full`
+    guardado, asi que no hace falta re-embeber. Solo sirve si `RAG_EMBED_DIM` no cambio.
+    """
+    staging = f"{collection_name}__layout_migration"
+    if client.collection_exists(staging):
+        client.delete_collection(staging)
+    _create_collection(client, staging)
+    expected = client.count(collection_name, exact=True).count
+    copied = _copy_points(client, collection_name, staging)
+    if copied != expected:
+        raise RuntimeError(
+            f"Migracion de layout de '{collection_name}' incompleta: {copied} de {expected} puntos copiados; "
+            "la coleccion original no se toco"
+        )
+    client.delete_collection(collection_name)
+    _create_collection(client, collection_name)
+    _copy_points(client, staging, collection_name)
+    client.delete_collection(staging)
+    logger.warning("qdrant_collection_layout_migrated collection=%s points=%d", collection_name, copied)
+
+
+def _resolve_layout_mismatch(
+    client: QdrantClient,
+    collection_name: str,
+    current_layout: dict[str, int],
+    target_layout: dict[str, int],
+) -> None:
+    mode = get_settings().qdrant_layout_migration
+    logger.warning(
+        "qdrant_collection_layout_mismatch collection=%s current=%s target=%s mode=%s",
+        collection_name,
+        current_layout,
+        target_layout,
+        mode,
     )
+    if mode == "migrate":
+        try:
+            _migrate_vector_layout(client, collection_name)
+        except RuntimeError as exc:
+            raise RuntimeError(
+                f"No se pudo migrar el layout de vectores de '{collection_name}': {exc}. "
+                "Si cambio RAG_EMBED_DIM usa QDRANT_LAYOUT_MIGRATION=recreate y re-ingesta."
+            ) from exc
+        return
+    if mode == "recreate":
+        client.delete_collection(collection_name)
+        _create_collection(client, collection_name)
+        logger.warning(
+            "qdrant_collection_recreated name=%s vectors=%s reingest_required=true",
+            collection_name,
+            target_layout,
+        )
+        return
+    if mode != "error":
+        raise ValueError(f"QDRANT_LAYOUT_MIGRATION no soportado: '{mode}' (usa 'error', 'migrate' o 'recreate')")
+    raise RuntimeError(
+        f"La coleccion Qdrant '{collection_name}' tiene vectores {current_layout} y la configuracion espera "
+        f"{target_layout} (RAG_EMBED_DIM / RAG_MATRYOSHKA_DIM). No se borra nada automaticamente: usa "
+        "QDRANT_LAYOUT_MIGRATION=migrate para derivar el nuevo layout de los vectores guardados, "
+        "o QDRANT_LAYOUT_MIGRATION=recreate para vaciarla y re-ingestar."
+    )
+
+
+def _ensure_collection(client: QdrantClient, collection_name: str) -> None:
+    settings = get_settings()
+    collections = client.get_collections().collections
+    exists = any(item.name == collection_name for item in collections)
+    target_layout = _vector_layout(_vectors_config())
+    if exists:
+        collection_info = client.get_collection(collection_name)
+        current_layout = _vector_layout(collection_info.config.params.vectors)
+
+        if current_layout != target_layout:
+            _resolve_layout_mismatch(client, collection_name, current_layout, target_layout)
+        else:
+            _migrate_storage_profile(client, collection_name, collection_info)
+            _ensure_sparse_vectors(client, collection_name, collection_info)
+            _migrate_index_profile(client, collection_name, collection_info)
+
+        _ensure_payload_indexes(client, collection_name)
+        return
+
+    _create_collection(client, collection_name)
     logger.info(
-        "qdrant_collection_created name=%s dim=%d",
-        settings.qdrant_collection,
-        settings.embedding_dimensions,
+        "qdrant_collection_created name=%s vectors=%s storage_profile=%s on_disk=%s hybrid=%s",
+        collection_name,
+        target_layout,
+        settings.qdrant_storage_profile,
+        settings.qdrant_on_disk_vectors,
+        settings.hybrid_enabled,
     )
-    _ensure_payload_index(client, settings.qdrant_collection, "source")
-    _ensure_payload_index(client, settings.qdrant_collection, "version")
+    _ensure_payload_indexes(client, collection_name)
+
+
+def ensure_rag_collection() -> None:
+    """Coleccion compartida y las dedicadas de `QDRANT_TENANT_COLLECTIONS`, con el mismo layout e indices."""
+    settings = get_settings()
+    client = get_qdrant_client()
+    for collection_name in dict.fromkeys([settings.qdrant_collection, *settings.qdrant_tenant_collections.values()]):
+        _ensure_collection(client, collection_name)
 
 
 def qdrant_ping() -> dict[str, Any]:
     try:
         get_qdrant_client().get_collections()
+        pool = get_replica_pool()
+        if pool is not None:
+            return {"ok": True, "replicas": pool.stats()}
         return {"ok": True}
     except Exception as exc:  # pragma: no cover
         return {"ok": False, "error": str(exc)}
@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any
+
+import grpc
+import httpx
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+from app.core.logger import get_logger
+
+
+logger = get_logger("ms-ia-orquestacion.qdrant.replicas")
+
+# Lecturas idempotentes: se reparten entre replicas, se reintentan en otra y se pueden duplicar (hedge).
+READ_METHODS = frozenset(
+    {
+        "query_points",
+        "query_points_groups",
+        "query_batch_points",
+        "scroll",
+        "count",
+        "retrieve",
+        "search",
+        "search_batch",
+        "recommend",
+        "facet",
+    }
+)
+LB_POLICIES = ("ewma", "least_outstanding")
+_EWMA_ALPHA = 0.3
+_FAILOVER_GRPC_CODES = {grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED}
+
+
+def is_node_failure(exc: BaseException) -> bool:
+    """Errores del nodo (caido, timeout, 5xx) y no de la consulta: justifican reintentar en otra replica."""
+    if isinstance(exc, (httpx.TransportError, ResponseHandlingException, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(exc, UnexpectedResponse):
+        return exc.status_code is not None and exc.status_code >= 500
+    if isinstance(exc, grpc.RpcError):
+        code = getattr(exc, "code", None)
+        return callable(code) and code() in _FAILOVER_GRPC_CODES
+    return False
+
+
+@dataclass(eq=False)
+class Replica:
+    url: str
+    client: Any
+    async_factory: Callable[[], Any] | None = None
+    outstanding: int = 0
+    ewma_ms: float = 0.0
+    failures: int = 0
+    healthy: bool = True
+    requests: int = 0
+    errors: int = 0
+    _async_client: Any = None
+
+    @property
+    def async_client(self) -> Any:
+        if self._async_client is None:
+            if self.async_factory is None:
+                raise RuntimeError(f"Replica Qdrant '{self.url}' sin cliente async")
+            self._async_client = self.async_factory()
+        return self._async_client
+
+
+class ReplicaPool:
+    """
+    Endpoints de un mismo cluster Qdrant; el primero es el primario (escrituras y metadatos).
+    Cada lectura va a la replica sana de menor costo: latencia EWMA por pedidos en vuelo (`ewma`)
+    o menos pedidos en vuelo (`least_outstanding`). Una replica sale de la rotacion tras
+    `eject_failures` errores seguidos de nodo o un ping fallido, y vuelve con el primer ping ok.
+    Con `hedge_after_ms > 0`, una lectura que tarda mas que eso se repite en otra replica y gana la primera.
+    """
+
+    def __init__(
+        self,
+        replicas: list[Replica],
+        policy: str = "ewma",
+        eject_failures: int = 2,
+        hedge_after_ms: float = 0.0,
+        ping: Callable[[Replica], None] | None = None,
+    ) -> None:
+        if not replicas:
+            raise ValueError("ReplicaPool requiere al menos un endpoint")
+        if policy not in LB_POLICIES:
+            raise ValueError(f"QDRANT_LB_POLICY no soportada: '{policy}' (usa 'ewma' o 'least_outstanding')")
+        self.replicas = replicas
+        self.primary = replicas[0]
+        self.policy = policy
+        self.eject_failures = max(1, eject_failures)
+        self._hedge_s = max(0.0, hedge_after_ms) / 1000
+        self._ping = ping or (lambda replica: replica.client.get_collections())
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        if self._hedge_s > 0 and len(replicas) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=4 * len(replicas), thread_name_prefix="qdrant-hedge")
+        self.hedged = 0
+        self.failovers = 0
+
+    def _cost(self, replica: Replica) -> tuple[float, float]:
+        if self.policy == "least_outstanding":
+            return (replica.outstanding, replica.ewma_ms)
+        # Sin muestras el costo es 0: cada replica nueva (o restaurada) recibe trafico y se mide enseguida.
+        return (replica.ewma_ms * (replica.outstanding + 1), replica.outstanding)
+
+    def pick(self, exclude: list[Replica] | None = None) -> Replica | None:
+        excluded = exclude or []
+        with self._lock:
+            candidates = [replica for replica in self.replicas if replica.healthy and replica not in excluded]
+            if not candidates:
+                # Todas expulsadas: intentar igual antes que fallar sin consultar.
+                candidates = [replica for replica in self.replicas if replica not in excluded]
+            if not candidates:
+                return None
+            best = min(candidates, key=lambda replica: (self._cost(replica), random.random()))
+            best.outstanding += 1
+            return best
+
+    def release(self, replica: Replica, elapsed_s: float, error: BaseException | None = None) -> None:
+        with self._lock:
+            replica.outstanding -= 1
+            if error is None:
+                sample_ms = elapsed_s * 1000
+                replica.ewma_ms = (
+                    sample_ms if replica.ewma_ms == 0 else (1 - _EWMA_ALPHA) * replica.ewma_ms + _EWMA_ALPHA * sample_ms
+                )
+                replica.requests += 1
+                replica.failures = 0
+                return
+            if not is_node_failure(error):
+                return
+            replica.requests += 1
+            replica.errors += 1
+            replica.failures += 1
+            if replica.healthy and replica.failures >= self.eject_failures:
+                self._eject(replica, error)
+
+    def _eject(self, replica: Replica, error: BaseException) -> None:
+        replica.healthy = False
+        logger.warning("qdrant_replica_ejected url=%s failures=%d error=%s", replica.url, replica.failures, error)
+
+    def check_health(self) -> int:
+        """Ping a cada replica; devuelve cuantas quedaron sanas."""
+        for replica in self.replicas:
+            try:
+                self._ping(replica)
+            except Exception as exc:
+                with self._lock:
+                    replica.failures += 1
+                    if replica.healthy:
+                        self._eject(replica, exc)
+                continue
+            with self._lock:
+                if not replica.healthy:
+                    # Vuelve sin historial: la latencia de antes del reinicio ya no representa al nodo.
+                    replica.ewma_ms = 0.0
+                    logger.info("qdrant_replica_restored url=%s", replica.url)
+                replica.healthy = True
+                replica.failures = 0
+        return sum(1 for replica in self.replicas if replica.healthy)
+
+    def start_health_checks(self, interval_s: float) -> None:
+        if interval_s <= 0 or len(self.replicas) < 2:
+            return
+
+        def loop() -> None:
+            while True:
+                time.sleep(interval_s)
+                try:
+                    self.check_health()
+                except Exception as exc:  # pragma: no cover
+                    logger.warning("qdrant_health_check_failed error=%s", exc)
+
+        threading.Thread(target=loop, name="qdrant-health", daemon=True).start()
+
+    def _invoke(self, replica: Replica, method: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = getattr(replica.client, method)(*args, **kwargs)
+        except BaseException as exc:
+            self.release(replica, time.perf_counter() - started, exc)
+            raise
+        self.release(replica, time.perf_counter() - started)
+        return result
+
+    def _invoke_hedged(
+        self,
+        replica: Replica,
+        method: str,
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        tried: list[Replica],
+    ) -> Any:
+        assert self._executor is not None
+        first = self._executor.submit(self._invoke, replica, method, args, kwargs)
+        done, _ = wait({first}, timeout=self._hedge_s)
+        if done:
+            return first.result()
+        backup = self.pick(exclude=tried)
+        if backup is None:
+            return first.result()
+        tried.append(backup)
+        self.hedged += 1
+        pending = {first, self._executor.submit(self._invoke, backup, method, args, kwargs)}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # La perdedora termina en su hilo y registra su latencia real (penaliza a la replica lenta).
+                    return future.result()
+                error = future.exception()
+        assert error is not None
+        raise error
+
+    def call(self, method: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        tried: list[Replica] = []
+        last_error: BaseException | None = None
+        while len(tried) < len(self.replicas):
+            replica = self.pick(exclude=tried)
+            if replica is None:
+                break
+            tried.append(replica)
+            try:
+                if self._executor is not None:
+                    return self._invoke_hedged(replica, method, args, kwargs, tried)
+                return self._invoke(replica, method, args, kwargs)
+            except Exception as exc:
+                if not is_node_failure(exc):
+                    raise
+                last_error = exc
+                self.failovers += 1
+                logger.warning("qdrant_replica_failover url=%s method=%s error=%s", replica.url, method, exc)
+        assert last_error is not None
+        raise last_error
+
+    async def _ainvoke(self, replica: Replica, method: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await getattr(replica.async_client, method)(*args, **kwargs)
+        except BaseException as exc:
+            self.release(replica, time.perf_counter() - started, exc)
+            raise
+        self.release(replica, time.perf_counter() - started)
+        return result
+
+    async def _ainvoke_hedged(
+        self,
+        replica: Replica,
+        method: str,
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        tried: list[Replica],
+    ) -> Any:
+        pending = {asyncio.ensure_future(self._ainvoke(replica, method, args, kwargs))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_s)
+            if done:
+                return done.pop().result()
+            backup = self.pick(exclude=tried)
+            if backup is not None:
+                tried.append(backup)
+                self.hedged += 1
+                pending.add(asyncio.ensure_future(self._ainvoke(backup, method, args, kwargs)))
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            assert error is not None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acall(self, method: str, args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
+        tried: list[Replica] = []
+        last_error: BaseException | None = None
+        while len(tried) < len(self.replicas):
+            replica = self.pick(exclude=tried)
+            if replica is None:
+                break
+            tried.append(replica)
+            try:
+                if self._hedge_s > 0 and len(self.replicas) > 1:
+                    return await self._ainvoke_hedged(replica, method, args, kwargs, tried)
+                return await self._ainvoke(replica, method, args, kwargs)
+            except Exception as exc:
+                if not is_node_failure(exc):
+                    raise
+                last_error = exc
+                self.failovers += 1
+                logger.warning("qdrant_replica_failover url=%s method=%s error=%s", replica.url, method, exc)
+        assert last_error is not None
+        raise last_error
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "hedged": self.hedged,
+                "failovers": self.failovers,
+                "replicas": [
+                    {
+                        "url": replica.url,
+                        "primary": replica is self.primary,
+                        "healthy": replica.healthy,
+                        "outstanding": replica.outstanding,
+                        "ewmaMs": round(replica.ewma_ms, 2),
+                        "requests": replica.requests,
+                        "errors": replica.errors,
+                    }
+                    for replica in self.replicas
+                ],
+            }
+
+
+class ReplicatedQdrantClient:
+    """Interfaz de QdrantClient: lecturas por el pool de replicas, escrituras y admin al primario."""
+
+    def __init__(self, pool: ReplicaPool) -> None:
+        self._pool = pool
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in READ_METHODS:
+            return getattr(self._pool.primary.client, name)
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            return self._pool.call(name, args, kwargs)
+
+        return call
+
+
+class AsyncReplicatedQdrantClient:
+    """Interfaz de AsyncQdrantClient sobre el mismo pool (comparte salud y latencias con el cliente sync)."""
+
+    def __init__(self, pool: ReplicaPool) -> None:
+        self._pool = pool
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in READ_METHODS:
+            return getattr(self._pool.primary.async_client, name)
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self._pool.acall(name, args, kwargs)
+
+        return call
@@ -12,11 +12,24 @@ from typing import Any
 from qdrant_client import models
 
 from app.ai.embeddings import embed_texts, estimate_tokens
+from app.ai.usage_ledger import estimate_cost_usd
 from app.core.config import get_settings
 from app.core.logger import get_logger
-from app.db.qdrant import ensure_rag_collection, get_qdrant_client
+from app.db.qdrant import (
+    CHUNK_KEY_FIELD,
+    LEGAL_REFS_FIELD,
+    TENANT_FIELD,
+    chunk_group_key,
+    collection_for_tenant,
+    ensure_rag_collection,
+    get_qdrant_client,
+    tenant_scope_condition,
+)
 from app.ingest.chunking import Chunk, chunk_text
 from app.ingest.pdf_loader import flatten_pages, load_pdf_pages
+from app.rag.legal_refs import legal_ref_keys
+from app.rag.point_vectors import build_point_vector
+from app.rag.retrieval_cache import bump_collection_generation
 
 
 logger = get_logger("ms-ia-orquestacion.ingest")
@@ -33,8 +46,10 @@ class IngestOptions:
     overlap: int
     min_chunk_size: int
     batch_size: int
+    concurrency: int
     dry_run: bool
     replace_source: bool
+    tenant_id: str | None = None
 
 
 @dataclass
@@ -53,13 +68,19 @@ class IngestReport:
     estimatedEmbeddingCostUsd: float
     durationMs: int
     sourceDocsDeleted: int
+    embedDurationMs: int
+    chunksPerSecond: float
+    tokensPerSecond: float
+    tenantId: str | None = None
 
     def to_dict(self) -> dict[str, Any]:
         return asdict(self)
 
 
-def _hash_chunk(doc_id: str, chunk: Chunk) -> str:
-    base = f"{doc_id}|{chunk.chunk_index}|{chunk.normalized_text}".encode("utf-8")
+def _hash_chunk(doc_id: str, chunk: Chunk, tenant_id: str | None = None) -> str:
+    # Con tenant, el mismo docId en dos consultorios no pisa el punto del otro.
+    prefix = f"{tenant_id}|" if tenant_id else ""
+    base = f"{prefix}{doc_id}|{chunk.chunk_index}|{chunk.normalized_text}".encode("utf-8")
     return hashlib.sha256(base).hexdigest()
 
 
@@ -67,9 +88,8 @@ def _point_id_from_hash(text_hash: str) -> str:
     return str(uuid.uuid5(uuid.NAMESPACE_URL, text_hash))
 
 
-def _estimate_embedding_cost_usd(token_count: int) -> float:
-    # text-embedding-3-small ~ $0.02 / 1M tokens
-    return round((token_count / 1_000_000) * 0.02, 6)
+def _estimate_embedding_cost_usd(token_count: int, model: str) -> float:
+    return round(estimate_cost_usd(model, token_count), 6)
 
 
 def _build_default_doc_name(file_path: str) -> str:
@@ -81,7 +101,7 @@ def _prepare_docs(options: IngestOptions, chunks: list[Chunk], embeddings: list[
     docs: list[dict[str, Any]] = []
 
     for chunk, embedding in zip(chunks, embeddings):
-        text_hash = _hash_chunk(options.doc_id, chunk)
+        text_hash = _hash_chunk(options.doc_id, chunk, options.tenant_id)
         docs.append(
             {
                 "docId": options.doc_id,
@@ -106,15 +126,12 @@ class PDFIngestService:
         self.settings = get_settings()
         self.client = get_qdrant_client()
 
-    def _count_source_points(self, source: str) -> int:
+    def _count_source_points(self, collection_name: str, source_filter: models.Filter) -> int:
         total = 0
         offset: str | int | None = None
-        source_filter = models.Filter(
-            must=[models.FieldCondition(key="source", match=models.MatchValue(value=source))]
-        )
         while True:
             points, next_offset = self.client.scroll(
-                collection_name=self.settings.qdrant_collection,
+                collection_name=collection_name,
                 scroll_filter=source_filter,
                 with_payload=False,
                 with_vectors=False,
@@ -142,7 +159,7 @@ class PDFIngestService:
         )
 
         estimated_tokens = estimate_tokens([chunk.text for chunk in chunks], model=self.settings.embedding_model)
-        estimated_cost = _estimate_embedding_cost_usd(estimated_tokens)
+        estimated_cost = _estimate_embedding_cost_usd(estimated_tokens, self.settings.embedding_model)
 
         logger.info(
             "ingest_pdf start file=%s pages=%d chunks=%d dry_run=%s",
@@ -158,6 +175,7 @@ class PDFIngestService:
                 filePath=options.file_path,
                 docId=options.doc_id,
                 docName=options.doc_name,
+                tenantId=options.tenant_id,
                 source=options.source,
                 version=options.version,
                 totalPages=len(pages),
@@ -169,6 +187,9 @@ class PDFIngestService:
                 estimatedEmbeddingCostUsd=estimated_cost,
                 durationMs=duration_ms,
                 sourceDocsDeleted=0,
+                embedDurationMs=0,
+                chunksPerSecond=0.0,
+                tokensPerSecond=0.0,
             )
 
         inserted = 0
@@ -176,25 +197,39 @@ class PDFIngestService:
         skipped = 0
         source_docs_deleted = 0
 
+        embed_started = time.perf_counter()
+        embeddings = embed_texts(
+            [chunk.text for chunk in chunks],
+            batch_size=options.batch_size,
+            concurrency=options.concurrency,
+        )
+        embed_s = time.perf_counter() - embed_started
+        collection_name = collection_for_tenant(options.tenant_id)
+
         if options.replace_source:
-            source_docs_deleted = self._count_source_points(options.source)
             source_filter = models.Filter(
-                must=[models.FieldCondition(key="source", match=models.MatchValue(value=options.source))]
+                must=[
+                    models.FieldCondition(key="source", match=models.MatchValue(value=options.source)),
+                    tenant_scope_condition(options.tenant_id),
+                ]
             )
+            source_docs_deleted = self._count_source_points(collection_name, source_filter)
             self.client.delete(
-                collection_name=self.settings.qdrant_collection,
+                collection_name=collection_name,
                 points_selector=models.FilterSelector(filter=source_filter),
             )
+            bump_collection_generation(collection_name)
             logger.info(
-                "ingest_pdf replace_source=true source=%s deleted=%d",
+                "ingest_pdf replace_source=true source=%s tenant=%s deleted=%d",
                 options.source,
+                options.tenant_id,
                 source_docs_deleted,
             )
 
         for start_idx in range(0, len(chunks), options.batch_size):
             batch_chunks = chunks[start_idx: start_idx + options.batch_size]
-            embeddings = embed_texts([chunk.text for chunk in batch_chunks], batch_size=options.batch_size)
-            docs = _prepare_docs(options, batch_chunks, embeddings)
+            batch_embeddings = embeddings[start_idx: start_idx + options.batch_size]
+            docs = _prepare_docs(options, batch_chunks, batch_embeddings)
 
             points: list[models.PointStruct] = []
             for doc in docs:
@@ -202,23 +237,28 @@ class PDFIngestService:
                 points.append(
                     models.PointStruct(
                         id=point_id,
-                        vector=doc["embedding"],
+                        vector=build_point_vector(doc["embedding"], doc["text"]),
                         payload={
                             "docId": doc["docId"],
                             "docName": doc["docName"],
                             "source": doc["source"],
                             "version": doc["version"],
                             "chunkIndex": doc["chunkIndex"],
+                            CHUNK_KEY_FIELD: chunk_group_key(doc["docId"], doc["chunkIndex"], options.tenant_id),
                             "pageStart": doc["pageStart"],
                             "pageEnd": doc["pageEnd"],
                             "text": doc["text"],
                             "textHash": doc["textHash"],
+                            LEGAL_REFS_FIELD: legal_ref_keys(doc["text"]),
+                            TENANT_FIELD: options.tenant_id,
                             "updatedAt": doc["updatedAt"].isoformat() if isinstance(doc["updatedAt"], datetime) else str(doc["updatedAt"]),
                         },
                     )
                 )
 
-            self.client.upsert(collection_name=self.settings.qdrant_collection, points=points)
+            self.client.upsert(collection_name=collection_name, points=points)
+            # Por lote: si la ingesta corta a mitad, el cache no sigue sirviendo el estado anterior.
+            bump_collection_generation(collection_name)
             inserted += len(points)
 
         duration_ms = int((time.perf_counter() - started) * 1000)
@@ -226,6 +266,7 @@ class PDFIngestService:
             filePath=options.file_path,
             docId=options.doc_id,
             docName=options.doc_name,
+            tenantId=options.tenant_id,
             source=options.source,
             version=options.version,
             totalPages=len(pages),
@@ -237,6 +278,9 @@ class PDFIngestService:
             estimatedEmbeddingCostUsd=estimated_cost,
             durationMs=duration_ms,
             sourceDocsDeleted=source_docs_deleted,
+            embedDurationMs=int(embed_s * 1000),
+            chunksPerSecond=round(len(chunks) / embed_s, 2) if embed_s > 0 else 0.0,
+            tokensPerSecond=round(estimated_tokens / embed_s, 2) if embed_s > 0 else 0.0,
         )
         logger.info("ingest_pdf end report=%s", json.dumps(report.to_dict(), ensure_ascii=True))
         return report
@@ -252,6 +296,8 @@ def build_ingest_options(
     dry_run: bool,
     version: str | None,
     replace_source: bool,
+    concurrency: int | None = None,
+    tenant_id: str | None = None,
 ) -> IngestOptions:
     settings = get_settings()
     path = Path(file_path)
@@ -266,6 +312,8 @@ def build_ingest_options(
         overlap=overlap or settings.chunk_overlap,
         min_chunk_size=settings.min_chunk_size,
         batch_size=batch_size or settings.embedding_batch_size,
+        concurrency=concurrency or settings.embedding_concurrency,
         dry_run=dry_run,
         replace_source=replace_source,
+        tenant_id=tenant_id or None,
     )
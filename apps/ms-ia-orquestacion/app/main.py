@@ -108,7 +108,7 @@ def startup_debug_summary() -> None:
         os.getenv("RAG_RERANK_ENABLED", "true"),
         os.getenv("RAG_RERANK_TOP_K", os.getenv("RAG_RERANK_K", "5")),
         os.getenv("RAG_OPENAI_TEMPERATURE", os.getenv("RAG_TEMPERATURE", "0.3")),
-        _safe_qdrant_target(os.getenv("QDRANT_URL", "")),
+        _safe_qdrant_target(os.getenv("QDRANT_PATH", "") or os.getenv("QDRANT_URL", "")),
     )
 
 
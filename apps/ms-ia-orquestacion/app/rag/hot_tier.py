@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from app.ai.embedding_provider import active_embedding_model
+from app.core.config import get_settings
+from app.core.logger import get_logger
+from app.db.qdrant import TENANT_FIELD, dense_vector_name
+from app.rag.retrieval_cache import CollectionGenerations, get_collection_generations
+from app.rag.retriever import ChunkCandidate, extract_dense_vector, points_to_candidates
+
+
+logger = get_logger("ms-ia-orquestacion.rag.hot-tier")
+
+FILTER_FIELDS = ("source", "version", "docId", TENANT_FIELD)
+_CURRENT_FILE = "CURRENT"
+_MANIFEST_FILE = "manifest.json"
+_KEEP_BUNDLES = 2
+_DTYPES = {"float16": np.float16, "float32": np.float32}
+
+
+def _write_atomic(path: Path, content: str) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def export_hot_tier(
+    client: QdrantClient,
+    collection_name: str,
+    root_dir: str | Path,
+    dtype: str = "float16",
+    page_size: int = 512,
+    generations: CollectionGenerations | None = None,
+) -> dict[str, Any]:
+    """
+    Exporta la coleccion a un bundle nuevo en `root_dir/<bundle>/`:
+    `vectors.bin` (matriz normalizada, memmap), `payloads.bin` + `offsets.npy` (payload JSON por punto),
+    `ids.json`, `fields.json` (columnas de filtro) y `manifest.json`. Al final apunta `CURRENT` al bundle
+    con un rename atomico, asi los procesos que sirven recargan sin ver un bundle a medio escribir.
+    El manifest guarda la generacion de la coleccion leida antes de exportar: una ingesta posterior lo deja viejo.
+    """
+    if dtype not in _DTYPES:
+        raise ValueError(f"RAG_HOT_TIER_DTYPE no soportado: '{dtype}' (usa 'float16' o 'float32')")
+
+    generation = (generations or get_collection_generations()).current(collection_name)
+
+    vector_name = dense_vector_name()
+    ids: list[str] = []
+    vectors: list[list[float]] = []
+    payloads: list[dict[str, Any]] = []
+    offset: Any = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=page_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=[vector_name] if vector_name else True,
+        )
+        for point in points:
+            vector = extract_dense_vector(point.vector)
+            if vector is None:
+                continue
+            ids.append(str(point.id))
+            vectors.append(vector)
+            payloads.append(dict(point.payload or {}))
+        if offset is None:
+            break
+    if not vectors:
+        raise RuntimeError(f"Coleccion Qdrant '{collection_name}' vacia: no hay nada que exportar al hot tier")
+
+    root = Path(root_dir)
+    bundle_name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    bundle_dir = root / bundle_name
+    bundle_dir.mkdir(parents=True, exist_ok=False)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+    mapped = np.memmap(bundle_dir / "vectors.bin", dtype=_DTYPES[dtype], mode="w+", shape=matrix.shape)
+    mapped[:] = matrix
+    mapped.flush()
+    del mapped
+
+    offsets = [0]
+    with (bundle_dir / "payloads.bin").open("wb") as handle:
+        for payload in payloads:
+            encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            handle.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    np.save(bundle_dir / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+
+    (bundle_dir / "ids.json").write_text(json.dumps(ids), encoding="utf-8")
+    fields = {field: [payload.get(field) for payload in payloads] for field in FILTER_FIELDS}
+    (bundle_dir / "fields.json").write_text(json.dumps(fields, ensure_ascii=False), encoding="utf-8")
+
+    manifest = {
+        "bundle": bundle_name,
+        "collection": collection_name,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "dtype": dtype,
+        "embeddingProvider": get_settings().embedding_provider,
+        "embeddingModel": active_embedding_model(),
+        "generation": generation,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+    }
+    (bundle_dir / _MANIFEST_FILE).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    _write_atomic(root / _CURRENT_FILE, bundle_name)
+
+    # Bundles viejos: se conserva el anterior para procesos que aun lo tengan mapeado.
+    bundles = sorted(path for path in root.iterdir() if path.is_dir() and (path / _MANIFEST_FILE).exists())
+    for stale in bundles[:-_KEEP_BUNDLES]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+    logger.info(
+        "hot_tier_exported collection=%s bundle=%s count=%d dim=%d dtype=%s generation=%d",
+        collection_name,
+        bundle_name,
+        manifest["count"],
+        manifest["dim"],
+        dtype,
+        generation,
+    )
+    return manifest
+
+
+class HotTierIndex:
+    """Busqueda exacta por coseno sobre un bundle exportado, con filtros por source/version/docId/tenantId."""
+
+    def __init__(self, bundle_dir: Path) -> None:
+        self.bundle_dir = bundle_dir
+        self.manifest = json.loads((bundle_dir / _MANIFEST_FILE).read_text(encoding="utf-8"))
+        count, dim = int(self.manifest["count"]), int(self.manifest["dim"])
+        self.vectors = np.memmap(
+            bundle_dir / "vectors.bin",
+            dtype=_DTYPES[self.manifest["dtype"]],
+            mode="r",
+            shape=(count, dim),
+        )
+        self.offsets = np.load(bundle_dir / "offsets.npy")
+        self.payloads = np.memmap(bundle_dir / "payloads.bin", dtype=np.uint8, mode="r")
+        self.ids: list[str] = json.loads((bundle_dir / "ids.json").read_text(encoding="utf-8"))
+        fields = json.loads((bundle_dir / "fields.json").read_text(encoding="utf-8"))
+        self._columns = {name: np.asarray(values, dtype=object) for name, values in fields.items()}
+
+    @property
+    def dim(self) -> int:
+        return int(self.manifest["dim"])
+
+    @property
+    def collection(self) -> str:
+        return str(self.manifest["collection"])
+
+    @property
+    def generation(self) -> int:
+        # Bundles exportados antes de guardar la generacion: cualquier ingesta registrada los deja viejos.
+        return int(self.manifest.get("generation") or 0)
+
+    def supports(self, filters: dict[str, Any] | None) -> bool:
+        return all(key in self._columns for key in (filters or {}))
+
+    def _mask(self, filters: dict[str, Any] | None) -> np.ndarray | None:
+        mask: np.ndarray | None = None
+        for key, value in (filters or {}).items():
+            if value is None:
+                continue
+            column_mask = self._columns[key] == value
+            if key == TENANT_FIELD and get_settings().rag_tenant_include_shared:
+                # Mismo criterio que el filtro de Qdrant: tambien los chunks compartidos (sin tenantId).
+                column_mask = column_mask | np.equal(self._columns[key], None)
+            mask = column_mask if mask is None else mask & column_mask
+        return mask
+
+    def _payload(self, row: int) -> dict[str, Any]:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self.payloads[start:end].tobytes().decode("utf-8"))
+
+    def search(
+        self,
+        query_embedding: list[float],
+        topk: int,
+        filters: dict[str, Any] | None,
+        include_embedding: bool,
+    ) -> list[ChunkCandidate]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0 or topk <= 0:
+            return []
+        query /= norm
+
+        scores = self.vectors @ query.astype(self.vectors.dtype, copy=False)
+        scores = scores.astype(np.float32, copy=False)
+        mask = self._mask(filters)
+        rows = np.arange(len(scores))
+        if mask is not None:
+            rows = rows[mask]
+            scores = scores[mask]
+        if len(scores) == 0:
+            return []
+
+        k = min(topk, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        points = [
+            models.ScoredPoint(
+                id=self.ids[int(rows[idx])],
+                version=0,
+                score=float(scores[idx]),
+                payload=self._payload(int(rows[idx])),
+                vector=self.vectors[int(rows[idx])].astype(np.float32).tolist() if include_embedding else None,
+            )
+            for idx in top
+        ]
+        return points_to_candidates(points, include_embedding)
+
+
+class HotTierStore:
+    """
+    Mantiene el bundle activo y lo cambia de forma atomica cuando `CURRENT` apunta a uno nuevo.
+    Un bundle de otro modelo/dimension se ignora; uno exportado antes de la ultima ingesta de su coleccion
+    (generacion menor) no se usa hasta que se exporte otro, y el retrieval vuelve a Qdrant.
+    """
+
+    def __init__(
+        self,
+        root_dir: str | Path,
+        reload_s: float,
+        expected_dim: int,
+        expected_model: str | None = None,
+        generations: CollectionGenerations | None = None,
+    ) -> None:
+        self.root = Path(root_dir)
+        self.reload_s = reload_s
+        self.expected_dim = expected_dim
+        self.expected_model = expected_model
+        self._generations = generations
+        self._index: HotTierIndex | None = None
+        self._bundle: str | None = None
+        self._stale_bundle: str | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _read_current(self) -> str | None:
+        try:
+            return (self.root / _CURRENT_FILE).read_text(encoding="utf-8").strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_s:
+            return
+        with self._lock:
+            if now - self._checked_at < self.reload_s:
+                return
+            self._checked_at = now
+            bundle = self._read_current()
+            if bundle is None or bundle == self._bundle:
+                return
+            try:
+                index = HotTierIndex(self.root / bundle)
+            except (OSError, ValueError, KeyError) as exc:
+                logger.warning("hot_tier_load_failed bundle=%s error=%s", bundle, exc)
+                return
+            model = index.manifest.get("embeddingModel")
+            if index.dim != self.expected_dim or (self.expected_model is not None and model != self.expected_model):
+                logger.warning(
+                    "hot_tier_embedding_mismatch bundle=%s dim=%d model=%s expected_dim=%d expected_model=%s; "
+                    "ignorando bundle",
+                    bundle,
+                    index.dim,
+                    model,
+                    self.expected_dim,
+                    self.expected_model,
+                )
+                self._bundle = bundle
+                self._index = None
+                return
+            self._index, self._bundle = index, bundle
+            logger.info("hot_tier_loaded bundle=%s count=%d", bundle, index.manifest["count"])
+
+    def _is_stale(self, index: HotTierIndex) -> bool:
+        if self._generations is None:
+            return False
+        current = self._generations.current(index.collection)
+        if index.generation >= current:
+            return False
+        if self._stale_bundle != self._bundle:
+            self._stale_bundle = self._bundle
+            logger.warning(
+                "hot_tier_stale bundle=%s generation=%d collection_generation=%d; usando Qdrant hasta re-exportar",
+                self._bundle,
+                index.generation,
+                current,
+            )
+        return True
+
+    def get(self) -> HotTierIndex | None:
+        self._maybe_reload()
+        index = self._index
+        if index is None or self._is_stale(index):
+            return None
+        return index
+
+    def stats(self) -> dict[str, Any]:
+        index = self._index
+        return {
+            "bundle": self._bundle,
+            "count": index.manifest["count"] if index is not None else 0,
+            "dtype": index.manifest["dtype"] if index is not None else None,
+            "generation": index.generation if index is not None else None,
+            "stale": index is not None and self._is_stale(index),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_hot_tier() -> HotTierStore | None:
+    settings = get_settings()
+    if not settings.hot_tier_enabled:
+        return None
+    return HotTierStore(
+        root_dir=settings.hot_tier_dir,
+        reload_s=settings.hot_tier_reload_s,
+        expected_dim=settings.embedding_dimensions,
+        expected_model=active_embedding_model(),
+        generations=get_collection_generations(),
+    )
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+from app.core.text import fold_accents, word_tokens
+from app.rag.sparse import STOPWORDS
+
+
+# Nombre o sigla del codigo -> clave normalizada. "C.P." queda fuera: se usa tanto para la Constitucion como el Codigo Penal.
+_CODES = {
+    "codigo sustantivo del trabajo": "cst",
+    "c.s.t.": "cst",
+    "c.s.t": "cst",
+    "cst": "cst",
+    "codigo general del proceso": "cgp",
+    "c.g.p.": "cgp",
+    "c.g.p": "cgp",
+    "cgp": "cgp",
+    "codigo civil": "cc",
+    "c.c.": "cc",
+    "c.c": "cc",
+    "cc": "cc",
+    "codigo penal": "cp",
+    "codigo de la infancia y la adolescencia": "cia",
+    "constitucion politica": "cn",
+    "constitucion": "cn",
+}
+_CODE_PATTERN = "|".join(re.escape(name) for name in sorted(_CODES, key=len, reverse=True))
+_NUMBER = r"\d+(?:\.\d+)*"
+
+_ARTICLE_RE = re.compile(
+    rf"\b(?:articulos?|arts?)\.?\s*(?:n[o°.]\s*)?(?P<numbers>{_NUMBER}(?:\s*(?:,|y|e)\s*{_NUMBER})*)"
+    rf"(?:\s*(?:,\s*)?(?:del|de la|de)?\s*(?P<code>{_CODE_PATTERN})(?!\w))?"
+)
+_LAW_RE = re.compile(
+    r"\b(?P<kind>ley|decreto)(?:\s+ley)?\s+(?:n[o°.]\s*)?(?P<number>\d{1,2}\.\d{3}|\d+)(?:\s+de\s+\d{4})?"
+)
+
+# Palabras que acompanan a una cita sin cambiar lo que se pide ("¿que dice el articulo 64?").
+_CITATION_FILLER = frozenset(
+    """
+    dice dicen establece establecen consagra senala regula contenido texto completo numero explica explicame
+    muestra muestrame leer lee ver cita transcribe
+    """.split()
+)
+
+
+@dataclass(frozen=True)
+class LegalRef:
+    kind: str
+    number: str
+    code: str | None = None
+
+    @property
+    def key(self) -> str:
+        return ":".join(part for part in (self.kind, self.number, self.code) if part)
+
+    @property
+    def match_keys(self) -> list[str]:
+        """Con codigo tambien sirve la clave generica: el texto del propio codigo no repite su sigla."""
+        if self.code is None:
+            return [self.key]
+        return [self.key, f"{self.kind}:{self.number}"]
+
+    @property
+    def phrases(self) -> list[str]:
+        if self.kind == "art":
+            return [f"articulo {self.number}", f"art {self.number}"]
+        return [f"{self.kind} {self.number}"]
+
+
+def _matches(folded: str) -> list[tuple[LegalRef, tuple[int, int]]]:
+    found: list[tuple[LegalRef, tuple[int, int]]] = []
+    for match in _ARTICLE_RE.finditer(folded):
+        code = _CODES.get(match.group("code")) if match.group("code") else None
+        for number in re.findall(_NUMBER, match.group("numbers")):
+            found.append((LegalRef("art", number.lstrip("0") or "0", code), match.span()))
+    for match in _LAW_RE.finditer(folded):
+        number = match.group("number").replace(".", "").lstrip("0") or "0"
+        found.append((LegalRef(match.group("kind"), number), match.span()))
+    return found
+
+
+def extract_legal_refs(text: str) -> list[LegalRef]:
+    """Citas de articulos, leyes y decretos en el texto, sin repetir y en orden de aparicion."""
+    refs: list[LegalRef] = []
+    for ref, _ in _matches(fold_accents(text).lower()):
+        if ref not in refs:
+            refs.append(ref)
+    return refs
+
+
+def legal_ref_keys(text: str) -> list[str]:
+    """Claves para el payload `legalRefs` de un chunk: cada cita con codigo tambien guarda la generica."""
+    keys = {key for ref in extract_legal_refs(text) for key in ref.match_keys}
+    return sorted(keys)
+
+
+def is_citation_only(query: str) -> bool:
+    """La pregunta solo pide una o mas normas ("Art. 249 CST", "¿que dice la ley 1010?"), sin otro contenido."""
+    folded = fold_accents(query).lower()
+    matches = _matches(folded)
+    if not matches:
+        return False
+    residual = folded
+    for start, end in sorted({span for _, span in matches}, reverse=True):
+        residual = residual[:start] + " " + residual[end:]
+    return all(token in STOPWORDS or token in _CITATION_FILLER for token in word_tokens(residual))
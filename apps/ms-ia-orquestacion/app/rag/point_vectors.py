@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import Any
+
+from app.core.config import get_settings
+from app.db.qdrant import FULL_VECTOR_NAME, SHORT_VECTOR_NAME, SPARSE_VECTOR_NAME, truncate_embedding
+from app.rag.sparse import sparse_document_vector
+
+
+def build_point_vector(embedding: list[float], text: str | None = None) -> list[float] | dict[str, Any]:
+    """Vectores de un punto; con `RAG_HYBRID_ENABLED` agrega el vector disperso BM25 del texto del chunk."""
+    settings = get_settings()
+    vectors: dict[str, Any]
+    if settings.matryoshka_dim <= 0:
+        vectors = {"": embedding}
+    else:
+        vectors = {
+            FULL_VECTOR_NAME: embedding,
+            SHORT_VECTOR_NAME: truncate_embedding(embedding, settings.matryoshka_dim),
+        }
+
+    sparse = sparse_document_vector(text, settings.sparse_avgdl) if settings.hybrid_enabled and text else None
+    if sparse is not None:
+        vectors[SPARSE_VECTOR_NAME] = sparse
+    if list(vectors) == [""]:
+        return embedding
+    return vectors
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import json
+
+from openai import AsyncOpenAI, OpenAI
+
+from app.ai.rate_limiter import approx_tokens, arun_limited, get_rate_limiter, run_limited
+from app.ai.usage_ledger import UsageLedger
+from app.core.logger import get_logger
+from app.core.text import canonical_query, word_tokens
+from app.rag.sparse import STOPWORDS
+
+
+logger = get_logger("ms-ia-orquestacion.rag.query-expansion")
+
+# Verbos de la pregunta que no aportan al contenido buscado ("¿que debo hacer si...?").
+_QUESTION_TERMS = frozenset(
+    """
+    puedo podria debo deberia hacer hago saber quiero necesito tengo tendria corresponde corresponden
+    cuanto cuanta cuantos cuantas pasa sucede significa hay favor ayuda ayudame
+    """.split()
+)
+
+# Vocabulario de la consulta (como pregunta la gente) -> vocabulario de los documentos (como lo dice la norma).
+_SYNONYMS = {
+    "despido": "terminacion del contrato de trabajo",
+    "despidieron": "terminacion del contrato de trabajo sin justa causa",
+    "echaron": "despido sin justa causa",
+    "liquidacion": "prestaciones sociales cesantias prima de servicios",
+    "vacaciones": "descanso remunerado",
+    "sueldo": "salario",
+    "salario": "remuneracion",
+    "alimentos": "cuota alimentaria",
+    "divorcio": "cesacion de efectos civiles del matrimonio",
+    "arriendo": "contrato de arrendamiento",
+    "inquilino": "arrendatario",
+    "herencia": "sucesion",
+    "sucesion": "herencia",
+    "pension": "seguridad social pensiones",
+    "tutela": "accion de tutela derechos fundamentales",
+    "embargo": "medida cautelar",
+    "deuda": "obligacion",
+    "custodia": "cuidado personal de los hijos",
+    "incapacidad": "incapacidad medica",
+    "cesantias": "auxilio de cesantias",
+    "indemnizacion": "indemnizacion por despido sin justa causa",
+    "demanda": "proceso judicial",
+}
+
+
+def _keywords(query: str) -> list[str]:
+    return [token for token in word_tokens(query) if token not in STOPWORDS and token not in _QUESTION_TERMS]
+
+
+def _dedupe(query: str, variants: list[str], count: int) -> list[str]:
+    """Descarta vacias, repetidas y las que son la misma pregunta original (en forma canonica)."""
+    seen = {canonical_query(query)}
+    selected: list[str] = []
+    for variant in variants:
+        key = canonical_query(variant)
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        selected.append(variant.strip())
+        if len(selected) >= count:
+            break
+    return selected
+
+
+def rule_variants(query: str, count: int) -> list[str]:
+    """
+    Reformulaciones sin llamada al modelo: la pregunta con el vocabulario de los documentos,
+    la misma con los sinonimos agregados y solo las palabras clave.
+    """
+    if count <= 0:
+        return []
+    keywords = _keywords(query)
+    if not keywords:
+        return []
+    replaced = [_SYNONYMS.get(token, token) for token in keywords]
+    expanded = keywords + [_SYNONYMS[token] for token in keywords if token in _SYNONYMS]
+    return _dedupe(query, [" ".join(replaced), " ".join(expanded), " ".join(keywords)], count)
+
+
+def _build_expansion_messages(query: str, count: int) -> list[dict[str, str]]:
+    system_prompt = (
+        "Reformulas preguntas de usuarios para buscar en documentos juridicos colombianos. "
+        f"Escribe {count} variantes breves de la pregunta con el vocabulario de las normas, sin responderla. "
+        "Responde SOLO JSON valido: {\"variantes\": [\"...\"]}."
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": query},
+    ]
+
+
+def _parse_variants(query: str, raw: str, count: int) -> list[str]:
+    parsed = json.loads(raw.strip().strip("`").replace("json", "", 1).strip())
+    variants = parsed.get("variantes", []) if isinstance(parsed, dict) else parsed
+    return _dedupe(query, [str(item) for item in variants if isinstance(item, str)], count)
+
+
+def llm_variants(
+    client: OpenAI,
+    query: str,
+    count: int,
+    model: str,
+    ledger: UsageLedger | None = None,
+) -> list[str]:
+    messages = _build_expansion_messages(query, count)
+    limited_client = client.with_options(timeout=10, max_retries=0)
+    completion = run_limited(
+        get_rate_limiter(model),
+        lambda: limited_client.chat.completions.with_raw_response.create(model=model, messages=messages),
+        estimated_tokens=approx_tokens(*(message["content"] for message in messages)),
+        max_retries=1,
+    )
+    if ledger is not None:
+        ledger.record_completion("expand", model, completion.usage)
+    return _parse_variants(query, completion.choices[0].message.content or "{}", count)
+
+
+async def allm_variants(
+    client: AsyncOpenAI,
+    query: str,
+    count: int,
+    model: str,
+    ledger: UsageLedger | None = None,
+) -> list[str]:
+    messages = _build_expansion_messages(query, count)
+    limited_client = client.with_options(timeout=10, max_retries=0)
+    completion = await arun_limited(
+        get_rate_limiter(model),
+        lambda: limited_client.chat.completions.with_raw_response.create(model=model, messages=messages),
+        estimated_tokens=approx_tokens(*(message["content"] for message in messages)),
+        max_retries=1,
+    )
+    if ledger is not None:
+        ledger.record_completion("expand", model, completion.usage)
+    return _parse_variants(query, completion.choices[0].message.content or "{}", count)
+
+
+def expand_query(
+    mode: str,
+    query: str,
+    count: int,
+    openai_client: OpenAI | None,
+    model: str,
+    ledger: UsageLedger | None = None,
+) -> list[str]:
+    """Variantes de la pregunta; si el modelo falla o no devuelve nada, quedan las de reglas."""
+    if (mode or "rules").lower() == "llm" and openai_client is not None:
+        try:
+            variants = llm_variants(openai_client, query, count, model=model, ledger=ledger)
+            if variants:
+                return variants
+        except Exception as exc:
+            logger.warning("query_expansion_llm_failed model=%s error=%s; usando reglas", model, exc)
+    return rule_variants(query, count)
+
+
+async def aexpand_query(
+    mode: str,
+    query: str,
+    count: int,
+    openai_client: AsyncOpenAI | None,
+    model: str,
+    ledger: UsageLedger | None = None,
+) -> list[str]:
+    if (mode or "rules").lower() == "llm" and openai_client is not None:
+        try:
+            variants = await allm_variants(openai_client, query, count, model=model, ledger=ledger)
+            if variants:
+                return variants
+        except Exception as exc:
+            logger.warning("query_expansion_llm_failed model=%s error=%s; usando reglas", model, exc)
+    return rule_variants(query, count)
+
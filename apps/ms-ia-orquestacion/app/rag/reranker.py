@@ -1,23 +1,76 @@
 from __future__ import annotations
 
 import json
-import math
 from typing import Any
 
-from openai import OpenAI
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
 
+from app.ai.rate_limiter import approx_tokens, arun_limited, get_rate_limiter, run_limited
+from app.ai.usage_ledger import UsageLedger
 from app.rag.retriever import ChunkCandidate
 
 
-def _cosine_similarity(a: list[float], b: list[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(y * y for y in b))
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return dot / (norm_a * norm_b)
+LLM_RERANK_MAX_CANDIDATES = 12
+
+
+def _embedding_matrix(candidates: list[ChunkCandidate], dim: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Embeddings de los candidatos como una matriz float32 (n x dim) con filas de norma 1.
+    `has_embedding`: el candidato trae vector; `valid`: ademas tiene la dimension y norma != 0.
+    """
+    has_embedding = np.fromiter((bool(c.embedding) for c in candidates), dtype=bool, count=len(candidates))
+    valid = has_embedding & np.fromiter(
+        (len(c.embedding or ()) == dim for c in candidates), dtype=bool, count=len(candidates)
+    )
+    matrix = np.zeros((len(candidates), dim), dtype=np.float32)
+    if dim and valid.any():
+        if valid.all():
+            matrix = np.asarray([c.embedding for c in candidates], dtype=np.float32)
+        else:
+            matrix[valid] = np.asarray([c.embedding for c, ok in zip(candidates, valid) if ok], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        valid &= norms > 0
+        matrix[valid] /= norms[valid, None]
+    return matrix, has_embedding, valid
+
+
+def _top_order(scores: np.ndarray, top_k: int | None) -> np.ndarray:
+    """Indices por score descendente (estable); con `top_k` solo ordena los k mejores (argpartition)."""
+    if top_k is None or top_k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    return top[np.lexsort((top, -scores[top]))]
+
+
+def _cosine_scores(
+    query_embedding: list[float],
+    candidates: list[ChunkCandidate],
+    mongo_weight: float,
+    cosine_weight: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Scores combinados (asignados a `rerank_score`) y la matriz normalizada de embeddings."""
+    mongo_scores = np.fromiter((c.mongo_score for c in candidates), dtype=np.float64, count=len(candidates))
+    if not any(c.embedding for c in candidates):
+        # Camino normal: sin vectores el coseno es el score de retrieval y el ranking queda en el orden de Qdrant.
+        combined = (mongo_weight + cosine_weight) * mongo_scores
+        for candidate, score in zip(candidates, combined.tolist()):
+            candidate.rerank_score = score
+        return combined, np.zeros((len(candidates), 0), dtype=np.float32)
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    matrix, has_embedding, valid = _embedding_matrix(candidates, len(query))
+    query_norm = float(np.linalg.norm(query)) if len(query) else 0.0
+
+    cosine_scores = np.where(has_embedding, 0.0, mongo_scores)
+    if query_norm > 0:
+        cosine_scores[valid] = (matrix[valid] @ (query / query_norm)).astype(np.float64)
+    combined = (mongo_weight * mongo_scores) + (cosine_weight * cosine_scores)
+    for candidate, score in zip(candidates, combined.tolist()):
+        candidate.rerank_score = score
+    return combined, matrix
 
 
 def rerank_cosine(
@@ -25,27 +78,103 @@ def rerank_cosine(
     candidates: list[ChunkCandidate],
     mongo_weight: float = 0.7,
     cosine_weight: float = 0.3,
+    top_k: int | None = None,
 ) -> list[ChunkCandidate]:
-    scored: list[ChunkCandidate] = []
-    for candidate in candidates:
-        cosine_score = _cosine_similarity(query_embedding, candidate.embedding) if candidate.embedding else candidate.mongo_score
-        combined = (mongo_weight * candidate.mongo_score) + (cosine_weight * cosine_score)
-        candidate.rerank_score = float(combined)
-        scored.append(candidate)
+    """
+    `mongo_weight * score de retrieval + cosine_weight * coseno(query, chunk)` con un solo matmul.
+    Sin embedding el coseno es el score de retrieval, que en Qdrant ya es el coseno con la pregunta: el pipeline
+    no baja vectores y el resultado es el mismo. Con dimension distinta o norma 0, 0.
+    Con `top_k` devuelve solo los k mejores.
+    """
+    if not candidates:
+        return []
+    combined, _ = _cosine_scores(query_embedding, candidates, mongo_weight, cosine_weight)
+    return [candidates[int(idx)] for idx in _top_order(combined, top_k)]
 
-    return sorted(scored, key=lambda c: c.rerank_score or 0.0, reverse=True)
 
+def rerank_fused(candidates: list[ChunkCandidate], top_k: int | None = None) -> list[ChunkCandidate]:
+    """Con retrieval hibrido el orden RRF ya es el ranking; rerank_score queda en el coseno denso para el umbral."""
+    selected = candidates if top_k is None else candidates[: max(top_k, 0)]
+    for candidate in selected:
+        candidate.rerank_score = candidate.mongo_score
+    return list(selected)
 
-def rerank_llm(
-    client: OpenAI,
-    query: str,
+
+def _mmr_relevance(candidates: list[ChunkCandidate]) -> np.ndarray:
+    """Relevancia para MMR en [0, 1]: el score RRF (reescalado al maximo) si hubo fusion; si no, el rerank_score."""
+    if candidates[0].fusion_score is not None:
+        fused = np.fromiter((c.fusion_score or 0.0 for c in candidates), dtype=np.float64, count=len(candidates))
+        top = float(fused.max())
+        return fused / top if top > 0 else fused
+    return np.fromiter(
+        (c.rerank_score if c.rerank_score is not None else c.mongo_score for c in candidates),
+        dtype=np.float64,
+        count=len(candidates),
+    )
+
+
+def rerank_mmr(
     candidates: list[ChunkCandidate],
-    model: str,
-    max_candidates: int = 12,
+    top_k: int,
+    mmr_lambda: float,
+    matrix: np.ndarray | None = None,
+) -> list[ChunkCandidate]:
+    """
+    Maximal Marginal Relevance sobre candidatos ya puntuados: en cada paso elige el de mayor
+    `lambda * relevancia - (1 - lambda) * max coseno con los ya elegidos`, asi los chunks casi repetidos
+    (overlap del chunking, misma clausula en otra version) no ocupan varios lugares del top.
+    `mmr_lambda=1` es el ranking por relevancia. `rerank_score` no cambia: el umbral sigue midiendo relevancia.
+    `matrix`: embeddings normalizados en el orden de `candidates`, si ya se calcularon.
+    """
+    k = min(top_k, len(candidates))
+    if k <= 0:
+        return []
+    relevance = _mmr_relevance(candidates)
+    if matrix is None:
+        dims = [len(c.embedding) for c in candidates if c.embedding]
+        if dims:
+            matrix, _, _ = _embedding_matrix(candidates, max(set(dims), key=dims.count))
+    if mmr_lambda >= 1.0 or matrix is None:
+        return [candidates[int(idx)] for idx in _top_order(relevance, k)]
+
+    max_similarity = np.zeros(len(candidates), dtype=np.float64)
+    available = np.ones(len(candidates), dtype=bool)
+    order: list[int] = []
+    for _ in range(k):
+        scores = np.where(available, mmr_lambda * relevance - (1.0 - mmr_lambda) * max_similarity, -np.inf)
+        idx = int(np.argmax(scores))
+        order.append(idx)
+        available[idx] = False
+        # Similitud contra el ultimo elegido: una fila de la matriz por paso, no la matriz n x n completa.
+        max_similarity = np.maximum(max_similarity, matrix @ matrix[idx])
+    return [candidates[idx] for idx in order]
+
+
+def _first_stage_rerank(
+    query_embedding: list[float],
+    candidates: list[ChunkCandidate],
+    top_k: int | None = None,
+    mmr_lambda: float = 1.0,
 ) -> list[ChunkCandidate]:
     if not candidates:
         return []
+    use_mmr = top_k is not None and mmr_lambda < 1.0
+    if candidates[0].fusion_score is not None:
+        if use_mmr:
+            rerank_fused(candidates)
+            return rerank_mmr(candidates, top_k, mmr_lambda)
+        return rerank_fused(candidates, top_k=top_k)
+    if use_mmr:
+        _, matrix = _cosine_scores(query_embedding, candidates, mongo_weight=0.7, cosine_weight=0.3)
+        return rerank_mmr(candidates, top_k, mmr_lambda, matrix=matrix)
+    return rerank_cosine(query_embedding, candidates, top_k=top_k)
+
 
+def _build_llm_rerank_prompt(
+    query: str,
+    candidates: list[ChunkCandidate],
+    max_candidates: int,
+) -> tuple[list[ChunkCandidate], list[dict[str, str]]]:
     clipped = candidates[:max_candidates]
     snippets = []
     for idx, candidate in enumerate(clipped):
@@ -57,16 +186,14 @@ def rerank_llm(
         "Responde SOLO JSON valido: {\"ranking\": [{\"index\": 0, \"score\": 0.93}]}."
     )
     user_prompt = f"Pregunta: {query}\n\nFragmentos:\n" + "\n\n".join(snippets)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    return clipped, messages
 
-    completion = client.with_options(timeout=20, max_retries=1).chat.completions.create(
-        model=model,
-        temperature=0.0,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-    )
-    raw = completion.choices[0].message.content or "{}"
+
+def _apply_llm_ranking(clipped: list[ChunkCandidate], raw: str) -> list[ChunkCandidate]:
     parsed = json.loads(raw.strip().strip("`").replace("json", "", 1).strip())
     ranking = parsed.get("ranking", [])
 
@@ -92,6 +219,62 @@ def rerank_llm(
     return reranked
 
 
+def rerank_llm(
+    client: OpenAI,
+    query: str,
+    candidates: list[ChunkCandidate],
+    model: str,
+    max_candidates: int = LLM_RERANK_MAX_CANDIDATES,
+    ledger: UsageLedger | None = None,
+) -> list[ChunkCandidate]:
+    if not candidates:
+        return []
+
+    clipped, messages = _build_llm_rerank_prompt(query, candidates, max_candidates)
+    limited_client = client.with_options(timeout=20, max_retries=0)
+    completion = run_limited(
+        get_rate_limiter(model),
+        lambda: limited_client.chat.completions.with_raw_response.create(
+            model=model,
+            temperature=0.0,
+            messages=messages,
+        ),
+        estimated_tokens=approx_tokens(*(message["content"] for message in messages)),
+        max_retries=1,
+    )
+    if ledger is not None:
+        ledger.record_completion("rerank", model, completion.usage)
+    return _apply_llm_ranking(clipped, completion.choices[0].message.content or "{}")
+
+
+async def arerank_llm(
+    client: AsyncOpenAI,
+    query: str,
+    candidates: list[ChunkCandidate],
+    model: str,
+    max_candidates: int = LLM_RERANK_MAX_CANDIDATES,
+    ledger: UsageLedger | None = None,
+) -> list[ChunkCandidate]:
+    if not candidates:
+        return []
+
+    clipped, messages = _build_llm_rerank_prompt(query, candidates, max_candidates)
+    limited_client = client.with_options(timeout=20, max_retries=0)
+    completion = await arun_limited(
+        get_rate_limiter(model),
+        lambda: limited_client.chat.completions.with_raw_response.create(
+            model=model,
+            temperature=0.0,
+            messages=messages,
+        ),
+        estimated_tokens=approx_tokens(*(message["content"] for message in messages)),
+        max_retries=1,
+    )
+    if ledger is not None:
+        ledger.record_completion("rerank", model, completion.usage)
+    return _apply_llm_ranking(clipped, completion.choices[0].message.content or "{}")
+
+
 def rerank_candidates(
     mode: str,
     query: str,
@@ -99,14 +282,37 @@ def rerank_candidates(
     candidates: list[ChunkCandidate],
     openai_client: OpenAI | None,
     llm_model: str,
+    ledger: UsageLedger | None = None,
+    top_k: int | None = None,
+    mmr_lambda: float = 1.0,
+) -> list[ChunkCandidate]:
+    selected_mode = (mode or "cosine").lower()
+    if selected_mode == "llm" and openai_client is not None:
+        try:
+            return rerank_llm(openai_client, query, candidates, model=llm_model, ledger=ledger)
+        except Exception:
+            return _first_stage_rerank(query_embedding, candidates, top_k=top_k, mmr_lambda=mmr_lambda)
+    return _first_stage_rerank(query_embedding, candidates, top_k=top_k, mmr_lambda=mmr_lambda)
+
+
+async def arerank_candidates(
+    mode: str,
+    query: str,
+    query_embedding: list[float],
+    candidates: list[ChunkCandidate],
+    openai_client: AsyncOpenAI | None,
+    llm_model: str,
+    ledger: UsageLedger | None = None,
+    top_k: int | None = None,
+    mmr_lambda: float = 1.0,
 ) -> list[ChunkCandidate]:
     selected_mode = (mode or "cosine").lower()
     if selected_mode == "llm" and openai_client is not None:
         try:
-            return rerank_llm(openai_client, query, candidates, model=llm_model)
+            return await arerank_llm(openai_client, query, candidates, model=llm_model, ledger=ledger)
         except Exception:
-            return rerank_cosine(query_embedding, candidates)
-    return rerank_cosine(query_embedding, candidates)
+            return _first_stage_rerank(query_embedding, candidates, top_k=top_k, mmr_lambda=mmr_lambda)
+    return _first_stage_rerank(query_embedding, candidates, top_k=top_k, mmr_lambda=mmr_lambda)
 
 
 def should_reject_by_threshold(best_score: float | None, threshold: float) -> bool:
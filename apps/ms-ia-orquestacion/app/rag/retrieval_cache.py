@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from dataclasses import replace
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Hashable
+
+import numpy as np
+
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.core.logger import get_logger
+from app.rag.retriever import ChunkCandidate
+
+
+logger = get_logger("ms-ia-orquestacion.rag.retrieval-cache")
+
+
+class CollectionGenerations:
+    """
+    Contador de generacion por coleccion: lo incrementan las ingestas al hacer upsert/delete.
+    Se guarda en memoria y en `<dir>/<coleccion>.gen`, asi `ingest_pdf` (otro proceso) invalida
+    el cache del servicio que esta sirviendo en el mismo host. El archivo se revisa a lo sumo cada
+    `refresh_s` (stat, y se relee solo si cambio su mtime): `current` corre varias veces por request,
+    tambien en el event loop, y no debe hacer IO en cada llamada.
+    """
+
+    def __init__(self, root_dir: str | Path, refresh_s: float = 1.0) -> None:
+        self.root = Path(root_dir)
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._local: dict[str, int] = {}
+        # coleccion -> (proxima revision, mtime_ns leido, generacion del archivo)
+        self._file_cache: dict[str, tuple[float, int | None, int]] = {}
+
+    def _path(self, collection_name: str) -> Path:
+        return self.root / f"{collection_name}.gen"
+
+    def _read_file(self, collection_name: str) -> int:
+        try:
+            return int(self._path(collection_name).read_text(encoding="utf-8").strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _file_generation(self, collection_name: str) -> int:
+        now = time.monotonic()
+        cached = self._file_cache.get(collection_name)
+        if cached is not None and now < cached[0]:
+            return cached[2]
+        try:
+            mtime_ns: int | None = self._path(collection_name).stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if mtime_ns is None:
+            generation = 0
+        elif cached is not None and cached[1] == mtime_ns:
+            generation = cached[2]
+        else:
+            generation = self._read_file(collection_name)
+        self._file_cache[collection_name] = (now + self.refresh_s, mtime_ns, generation)
+        return generation
+
+    def current(self, collection_name: str) -> int:
+        return max(self._local.get(collection_name, 0), self._file_generation(collection_name))
+
+    def bump(self, collection_name: str) -> int:
+        with self._lock:
+            # time_ns como piso: dos procesos que incrementan a la vez no repiten generacion.
+            generation = max(self.current(collection_name) + 1, time.time_ns())
+            self._local[collection_name] = generation
+            try:
+                self.root.mkdir(parents=True, exist_ok=True)
+                path = self._path(collection_name)
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                tmp_path.write_text(str(generation), encoding="utf-8")
+                os.replace(tmp_path, path)
+            except OSError as exc:
+                logger.warning("retrieval_generation_write_failed collection=%s error=%s", collection_name, exc)
+            self._file_cache.pop(collection_name, None)
+        logger.info("retrieval_generation_bumped collection=%s generation=%d", collection_name, generation)
+        return generation
+
+
+@lru_cache(maxsize=1)
+def get_collection_generations() -> CollectionGenerations:
+    settings = get_settings()
+    return CollectionGenerations(settings.retrieval_generation_dir, refresh_s=settings.retrieval_generation_refresh_s)
+
+
+def bump_collection_generation(collection_name: str) -> int:
+    return get_collection_generations().bump(collection_name)
+
+
+def _vector_digest(values: Any) -> str:
+    return hashlib.blake2b(np.asarray(values, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+
+
+def _copy_candidates(candidates: list[ChunkCandidate]) -> list[ChunkCandidate]:
+    # Copia por candidato (scores, texto, metadata); el embedding no se modifica en el pipeline y se comparte.
+    return [replace(candidate, metadata=dict(candidate.metadata)) for candidate in candidates]
+
+
+def _filters_key(filters: dict[str, Any] | None) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((str(key), str(value)) for key, value in (filters or {}).items()))
+
+
+def retrieval_cache_key(request: dict[str, Any], search_mode: Hashable = None) -> Hashable:
+    """
+    Clave: hash del embedding, filtros normalizados, topk y todo lo que cambia la forma del resultado.
+    `search_mode` distingue los parametros pedidos (hnsw_ef, exact) para que un barrido no lea resultados de otro.
+    """
+    sparse_query = request.get("sparse_query")
+    payload_fields = request.get("payload_fields")
+    expansion_embeddings = request.get("expansion_embeddings")
+    return (
+        request["collection_name"],
+        _vector_digest(request["query_embedding"]),
+        _filters_key(request.get("filters")),
+        int(request["topk"]),
+        bool(request["include_embedding"]),
+        (tuple(sparse_query.indices), tuple(sparse_query.values)) if sparse_query is not None else None,
+        tuple(payload_fields) if payload_fields is not None else None,
+        _vector_digest(expansion_embeddings) if expansion_embeddings else None,
+        int(request.get("version_group_size") or 0),
+        search_mode,
+    )
+
+
+class RetrievalCache:
+    """
+    Cache de listas de `ChunkCandidate` por request de retrieval. Cada entrada guarda la generacion
+    de la coleccion con la que se armo; si una ingesta la incremento, la entrada se descarta (stale).
+    Guarda y devuelve copias: el rerank y la hidratacion modifican los candidatos en el lugar.
+    """
+
+    def __init__(self, maxsize: int, ttl_s: float, generations: CollectionGenerations) -> None:
+        self._cache: TTLCache[tuple[int, float, list[ChunkCandidate]]] = TTLCache(maxsize=maxsize, ttl_s=ttl_s)
+        self._generations = generations
+        self._lock = threading.Lock()
+        self.stale = 0
+        self._hit_age_total_s = 0.0
+        self._max_hit_age_s = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._cache.enabled
+
+    def get(self, request: dict[str, Any], search_mode: Hashable = None) -> list[ChunkCandidate] | None:
+        if not self.enabled:
+            return None
+        entry = self._cache.get(retrieval_cache_key(request, search_mode))
+        if entry is None:
+            return None
+        generation, stored_at, candidates = entry
+        if generation != self._generations.current(request["collection_name"]):
+            with self._lock:
+                self.stale += 1
+            return None
+        age_s = time.monotonic() - stored_at
+        with self._lock:
+            self._hit_age_total_s += age_s
+            self._max_hit_age_s = max(self._max_hit_age_s, age_s)
+        return _copy_candidates(candidates)
+
+    def set(
+        self,
+        request: dict[str, Any],
+        candidates: list[ChunkCandidate],
+        generation: int,
+        search_mode: Hashable = None,
+    ) -> None:
+        """`generation` se lee antes de consultar Qdrant: si una ingesta corre en el medio, la entrada nace vieja."""
+        if not self.enabled:
+            return
+        self._cache.set(
+            retrieval_cache_key(request, search_mode),
+            (generation, time.monotonic(), _copy_candidates(candidates)),
+        )
+
+    def generation(self, collection_name: str) -> int:
+        return self._generations.current(collection_name)
+
+    def stats(self) -> dict[str, Any]:
+        stats = self._cache.stats()
+        # Los hits del TTLCache incluyen entradas descartadas por generacion vieja.
+        hits = stats["hits"] - self.stale
+        lookups = stats["hits"] + stats["misses"]
+        with self._lock:
+            return {
+                **stats,
+                "hits": hits,
+                "misses": stats["misses"] + self.stale,
+                "stale": self.stale,
+                "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+                "avgHitAgeS": round(self._hit_age_total_s / hits, 3) if hits else 0.0,
+                "maxHitAgeS": round(self._max_hit_age_s, 3),
+            }
+
+
+class FilteredCountCache:
+    """Cantidad de puntos por filtro (para decidir busqueda exacta), invalidada por la generacion de la coleccion."""
+
+    def __init__(self, maxsize: int, ttl_s: float, generations: CollectionGenerations) -> None:
+        self._cache: TTLCache[tuple[int, int]] = TTLCache(maxsize=maxsize, ttl_s=ttl_s)
+        self._generations = generations
+
+    def get(self, collection_name: str, filters: dict[str, Any] | None) -> int | None:
+        entry = self._cache.get((collection_name, _filters_key(filters)))
+        if entry is None or entry[0] != self._generations.current(collection_name):
+            return None
+        return entry[1]
+
+    def set(self, collection_name: str, filters: dict[str, Any] | None, count: int, generation: int) -> None:
+        self._cache.set((collection_name, _filters_key(filters)), (generation, count))
@@ -1,14 +1,31 @@
 from __future__ import annotations
 
+import asyncio
+import re
 from dataclasses import dataclass
+from datetime import datetime, timezone
 from typing import Any
 
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 
+from app.core.config import get_settings
 from app.core.logger import get_logger
+from app.rag.legal_refs import LegalRef
+from app.db.qdrant import (
+    CHUNK_KEY_FIELD,
+    CHUNK_TEXT_FIELDS,
+    FULL_VECTOR_NAME,
+    LEGAL_REFS_FIELD,
+    SHORT_VECTOR_NAME,
+    SPARSE_VECTOR_NAME,
+    TENANT_FIELD,
+    tenant_scope_condition,
+    truncate_embedding,
+)
 
 
 logger = get_logger("ms-ia-orquestacion.rag.retriever")
+_saturation_logged = False
 
 
 @dataclass
@@ -25,45 +42,52 @@ class ChunkCandidate:
     page_start: int | None
     page_end: int | None
     rerank_score: float | None = None
+    fusion_score: float | None = None
+    hydrated: bool = True
 
 
-def retrieve_candidates(
-    client: QdrantClient,
-    collection_name: str,
-    query_embedding: list[float],
-    topk: int,
-    filters: dict[str, Any] | None,
-    include_embedding: bool,
-) -> list[ChunkCandidate]:
-    qdrant_filter: models.Filter | None = None
-    if filters:
-        qdrant_filter = models.Filter(
-            must=[
-                models.FieldCondition(
-                    key=str(key),
-                    match=models.MatchValue(value=value),
-                )
-                for key, value in filters.items()
-                if value is not None
-            ]
-        )
+# Proyeccion minima para rankear; el texto y la metadata se traen despues solo para los chunks finales.
+CANDIDATE_PAYLOAD_FIELDS = ["source", "version", "title", "docName", "chunkIndex", "pageStart", "pageEnd"]
+HYDRATE_PAYLOAD_FIELDS = ["chunkText", "text", "metadata"]
+# Para quedarse con la version mas nueva de cada chunk al colapsar versiones.
+VERSION_GROUP_PAYLOAD_FIELDS = [CHUNK_KEY_FIELD, "updatedAt"]
 
-    response = client.query_points(
-        collection_name=collection_name,
-        query=query_embedding,
-        query_filter=qdrant_filter,
-        limit=topk,
-        with_payload=True,
-        with_vectors=include_embedding,
+
+def _tenant_condition(tenant_id: str) -> models.Condition:
+    """Chunks del tenant y, con `RAG_TENANT_INCLUDE_SHARED`, tambien los compartidos (sin tenantId)."""
+    if not get_settings().rag_tenant_include_shared:
+        return tenant_scope_condition(tenant_id)
+    return models.Filter(should=[tenant_scope_condition(tenant_id), tenant_scope_condition(None)])
+
+
+def _build_filter(filters: dict[str, Any] | None) -> models.Filter | None:
+    if not filters:
+        return None
+    return models.Filter(
+        must=[
+            _tenant_condition(str(value))
+            if key == TENANT_FIELD
+            else models.FieldCondition(
+                key=str(key),
+                match=models.MatchValue(value=value),
+            )
+            for key, value in filters.items()
+            if value is not None
+        ]
     )
-    docs = list(response.points or [])
 
+
+def extract_dense_vector(vector: Any) -> list[float] | None:
+    if isinstance(vector, dict):
+        vector = vector.get(FULL_VECTOR_NAME, vector.get(""))
+    return vector if isinstance(vector, list) else None
+
+
+def points_to_candidates(points: list[Any], include_embedding: bool, hydrated: bool = True) -> list[ChunkCandidate]:
     candidates: list[ChunkCandidate] = []
-    for doc in docs:
+    for doc in points:
         payload = dict(doc.payload or {})
-        vector = doc.vector if include_embedding else None
-        if isinstance(vector, dict):
-            vector = None
+        vector = extract_dense_vector(doc.vector) if include_embedding else None
 
         candidates.append(
             ChunkCandidate(
@@ -74,10 +98,471 @@ def retrieve_candidates(
                 chunk_index=int(payload.get("chunkIndex") or 0),
                 text=str(payload.get("chunkText") or payload.get("text") or ""),
                 metadata=dict(payload.get("metadata") or {}),
-                mongo_score=float(doc.score or 0.0),
-                embedding=vector if isinstance(vector, list) else None,
+                mongo_score=float(getattr(doc, "score", None) or 0.0),
+                embedding=vector,
                 page_start=payload.get("pageStart"),
                 page_end=payload.get("pageEnd"),
+                hydrated=hydrated,
             )
         )
     return candidates
+
+
+def _with_group_fields(payload_fields: list[str] | None) -> list[str] | None:
+    if payload_fields is None:
+        return None
+    return [*payload_fields, *(field for field in VERSION_GROUP_PAYLOAD_FIELDS if field not in payload_fields)]
+
+
+_OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+_VERSION_PART = re.compile(r"(\d+)")
+
+
+def _parse_updated_at(raw: Any) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(str(raw))
+    except ValueError:
+        return _OLDEST
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def _version_key(raw: Any) -> tuple[tuple[int, int | str], ...]:
+    """Orden natural: `v10` despues de `v9`, `2.10` despues de `2.9`."""
+    parts = _VERSION_PART.split(str(raw or "").lower())
+    return tuple((0, int(part)) if part.isdigit() else (1, part) for part in parts if part)
+
+
+def _recency(point: Any) -> tuple[datetime, tuple[tuple[int, int | str], ...]]:
+    payload = point.payload or {}
+    updated_at = payload.get("updatedAt")
+    return (_parse_updated_at(updated_at) if updated_at else _OLDEST, _version_key(payload.get("version")))
+
+
+def collapse_versions(points: list[Any], limit: int) -> list[Any]:
+    """
+    Un punto por `chunkKey`: el mas nuevo (updatedAt como fecha, luego version en orden natural), en la
+    posicion del mejor rankeado de su grupo. Los puntos sin chunkKey (ingestas anteriores) quedan cada uno
+    por su cuenta. Solo ve las versiones que trajo la consulta: `version_group_size` tiene que cubrir todas.
+    """
+    groups: dict[str, list[Any]] = {}
+    for point in points:
+        key = (point.payload or {}).get(CHUNK_KEY_FIELD) or f"id:{point.id}"
+        groups.setdefault(str(key), []).append(point)
+    return [max(group, key=_recency) for group in groups.values()][:limit]
+
+
+def _dense_prefetch(
+    query_embedding: list[float],
+    limit: int,
+    matryoshka_dim: int,
+    prefetch_multiplier: int,
+    search_params: models.SearchParams | None,
+) -> models.Prefetch:
+    if matryoshka_dim > 0:
+        return models.Prefetch(
+            prefetch=models.Prefetch(
+                query=truncate_embedding(query_embedding, matryoshka_dim),
+                using=SHORT_VECTOR_NAME,
+                limit=limit * max(1, prefetch_multiplier),
+                params=search_params,
+            ),
+            query=query_embedding,
+            using=FULL_VECTOR_NAME,
+            limit=limit,
+            params=search_params,
+        )
+    return models.Prefetch(query=query_embedding, limit=limit, params=search_params)
+
+
+def _dense_with_vectors(include_embedding: bool, matryoshka_dim: int) -> bool | list[str]:
+    if not include_embedding:
+        return False
+    return [FULL_VECTOR_NAME] if matryoshka_dim > 0 else True
+
+
+def build_query_request(
+    collection_name: str,
+    query_embedding: list[float],
+    topk: int,
+    filters: dict[str, Any] | None,
+    include_embedding: bool,
+    matryoshka_dim: int = 0,
+    prefetch_multiplier: int = 4,
+    search_params: models.SearchParams | None = None,
+    payload_fields: list[str] | None = None,
+) -> dict[str, Any]:
+    """
+    Argumentos de `query_points` para la busqueda densa. Con `matryoshka_dim > 0` hace dos
+    etapas en una sola llamada: prefetch de `topk * prefetch_multiplier` candidatos sobre el
+    vector corto y re-scoring de esos candidatos con el vector completo.
+    """
+    query_kwargs: dict[str, Any] = {"query": query_embedding}
+    if matryoshka_dim > 0:
+        query_kwargs = {
+            "prefetch": models.Prefetch(
+                query=truncate_embedding(query_embedding, matryoshka_dim),
+                using=SHORT_VECTOR_NAME,
+                limit=topk * max(1, prefetch_multiplier),
+                params=search_params,
+            ),
+            "query": query_embedding,
+            "using": FULL_VECTOR_NAME,
+        }
+
+    return {
+        "collection_name": collection_name,
+        "query_filter": _build_filter(filters),
+        "search_params": search_params,
+        "limit": topk,
+        "with_payload": payload_fields if payload_fields is not None else True,
+        "with_vectors": _dense_with_vectors(include_embedding, matryoshka_dim),
+        **query_kwargs,
+    }
+
+
+def build_group_request(
+    version_group_size: int,
+    payload_fields: list[str] | None = None,
+    **request: Any,
+) -> dict[str, Any]:
+    """Argumentos de `query_points_groups`: `topk` grupos por chunkKey, con hasta `version_group_size` versiones cada uno."""
+    return {
+        **build_query_request(payload_fields=_with_group_fields(payload_fields), **request),
+        "group_by": CHUNK_KEY_FIELD,
+        "group_size": max(1, version_group_size),
+    }
+
+
+def build_fused_requests(
+    query_embedding: list[float],
+    sparse_query: models.SparseVector | None,
+    topk: int,
+    filters: dict[str, Any] | None,
+    include_embedding: bool,
+    matryoshka_dim: int = 0,
+    prefetch_multiplier: int = 4,
+    hybrid_prefetch_multiplier: int = 3,
+    search_params: models.SearchParams | None = None,
+    payload_fields: list[str] | None = None,
+    expansion_embeddings: list[list[float]] | None = None,
+    version_group_size: int = 0,
+) -> list[models.QueryRequest]:
+    """
+    Dos requests para un solo `query_batch_points`: el ranking fusionado con RRF en Qdrant (prefetch
+    denso de la pregunta, de cada reformulacion y BM25 si hay `sparse_query`) y el score coseno denso
+    de la pregunta original sobre esos mismos candidatos, porque el score RRF (~1/(60+rank)) no sirve
+    para el umbral de confianza. Con `version_group_size > 0` trae `topk * version_group_size` para
+    colapsar versiones despues (las consultas de grupos no entran en un batch).
+    """
+    candidate_limit = topk * max(1, hybrid_prefetch_multiplier)
+    prefetch = [
+        _dense_prefetch(embedding, candidate_limit, matryoshka_dim, prefetch_multiplier, search_params)
+        for embedding in [query_embedding, *(expansion_embeddings or [])]
+    ]
+    if sparse_query is not None:
+        prefetch.append(models.Prefetch(query=sparse_query, using=SPARSE_VECTOR_NAME, limit=candidate_limit))
+    query_filter = _build_filter(filters)
+    fused = models.QueryRequest(
+        prefetch=prefetch,
+        query=models.FusionQuery(fusion=models.Fusion.RRF),
+        filter=query_filter,
+        limit=topk * version_group_size if version_group_size > 0 else topk,
+        with_payload=_with_group_fields(payload_fields) if payload_fields is not None else True,
+        with_vector=_dense_with_vectors(include_embedding, matryoshka_dim),
+    )
+    dense_scores = models.QueryRequest(
+        prefetch=prefetch,
+        query=query_embedding,
+        using=FULL_VECTOR_NAME if matryoshka_dim > 0 else None,
+        filter=query_filter,
+        params=search_params,
+        limit=candidate_limit * len(prefetch),
+        with_payload=False,
+        with_vector=False,
+    )
+    return [fused, dense_scores]
+
+
+def _merge_fused(
+    responses: list[Any],
+    include_embedding: bool,
+    hydrated: bool,
+    collapse_limit: int | None = None,
+) -> list[ChunkCandidate]:
+    fused, dense = responses
+    dense_scores = {str(point.id): float(point.score or 0.0) for point in dense.points or []}
+    points = list(fused.points or [])
+    if collapse_limit is not None:
+        points = collapse_versions(points, collapse_limit)
+    candidates = points_to_candidates(points, include_embedding, hydrated)
+    for candidate in candidates:
+        candidate.fusion_score = candidate.mongo_score
+        candidate.mongo_score = dense_scores.get(candidate.chunk_id, 0.0)
+    return candidates
+
+
+def _legacy_request(include_embedding: bool, **request: Any) -> dict[str, Any]:
+    """
+    `query_points` restringido a los puntos sin chunkKey (ingestas anteriores): `query_points_groups`
+    los omite, y en una coleccion a medio migrar se perderian de la busqueda.
+    """
+    query_request = build_query_request(include_embedding=include_embedding, **request)
+    base = query_request["query_filter"]
+    query_request["query_filter"] = models.Filter(
+        must=[
+            *([base] if base is not None else []),
+            models.IsEmptyCondition(is_empty=models.PayloadField(key=CHUNK_KEY_FIELD)),
+        ]
+    )
+    return query_request
+
+
+def _grouped_points(response: Any, legacy_response: Any | None, topk: int, group_size: int) -> list[Any]:
+    groups = response.groups or []
+    global _saturation_logged
+    if not _saturation_logged and group_size > 1 and any(len(group.hits) >= group_size for group in groups):
+        # Qdrant devuelve las `group_size` versiones con mejor score: si hay mas, la mas nueva puede quedar afuera.
+        _saturation_logged = True
+        logger.warning(
+            "version_group_saturated group_size=%d; RAG_VERSION_GROUP_SIZE debe ser >= versiones por chunk",
+            group_size,
+        )
+    hits = [hit for group in groups for hit in group.hits]
+    if legacy_response is not None:
+        hits.extend(legacy_response.points or [])
+    # Por score: cada grupo queda en la posicion de su mejor hit y los puntos sin chunkKey se intercalan.
+    hits.sort(key=lambda hit: hit.score or 0.0, reverse=True)
+    return collapse_versions(hits, topk)
+
+
+def _legacy_filter() -> models.Filter:
+    return models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key=CHUNK_KEY_FIELD))])
+
+
+def has_legacy_points(client: QdrantClient, collection_name: str) -> bool:
+    """Si quedan puntos sin chunkKey (ingestas anteriores) que `query_points_groups` no ve."""
+    response = client.count(collection_name=collection_name, count_filter=_legacy_filter(), exact=True)
+    return int(response.count) > 0
+
+
+async def ahas_legacy_points(client: AsyncQdrantClient, collection_name: str) -> bool:
+    response = await client.count(collection_name=collection_name, count_filter=_legacy_filter(), exact=True)
+    return int(response.count) > 0
+
+
+def retrieve_candidates(
+    client: QdrantClient,
+    include_embedding: bool,
+    sparse_query: models.SparseVector | None = None,
+    hybrid_prefetch_multiplier: int = 3,
+    expansion_embeddings: list[list[float]] | None = None,
+    version_group_size: int = 0,
+    legacy_fallback: bool = True,
+    **request: Any,
+) -> list[ChunkCandidate]:
+    """
+    Busqueda densa, o fusionada con RRF cuando se pasa `sparse_query` (hibrida denso + BM25)
+    y/o `expansion_embeddings` (reformulaciones de la pregunta). Con `version_group_size > 0`
+    devuelve solo la version mas nueva de cada chunk (`query_points_groups` por chunkKey) y, con
+    `legacy_fallback`, suma en otra consulta los puntos sin chunkKey.
+    """
+    hydrated = request.get("payload_fields") is None
+    if sparse_query is not None or expansion_embeddings:
+        collection_name = request.pop("collection_name")
+        responses = client.query_batch_points(
+            collection_name=collection_name,
+            requests=build_fused_requests(
+                sparse_query=sparse_query,
+                include_embedding=include_embedding,
+                hybrid_prefetch_multiplier=hybrid_prefetch_multiplier,
+                expansion_embeddings=expansion_embeddings,
+                version_group_size=version_group_size,
+                **request,
+            ),
+        )
+        collapse_limit = request["topk"] if version_group_size > 0 else None
+        return _merge_fused(responses, include_embedding, hydrated, collapse_limit)
+
+    if version_group_size > 0:
+        grouped = client.query_points_groups(
+            **build_group_request(version_group_size, include_embedding=include_embedding, **request)
+        )
+        legacy = client.query_points(**_legacy_request(include_embedding, **request)) if legacy_fallback else None
+        points = _grouped_points(grouped, legacy, request["topk"], version_group_size)
+        return points_to_candidates(points, include_embedding, hydrated)
+
+    response = client.query_points(**build_query_request(include_embedding=include_embedding, **request))
+    return points_to_candidates(list(response.points or []), include_embedding, hydrated)
+
+
+async def aretrieve_candidates(
+    client: AsyncQdrantClient,
+    include_embedding: bool,
+    sparse_query: models.SparseVector | None = None,
+    hybrid_prefetch_multiplier: int = 3,
+    expansion_embeddings: list[list[float]] | None = None,
+    version_group_size: int = 0,
+    legacy_fallback: bool = True,
+    **request: Any,
+) -> list[ChunkCandidate]:
+    hydrated = request.get("payload_fields") is None
+    if sparse_query is not None or expansion_embeddings:
+        collection_name = request.pop("collection_name")
+        responses = await client.query_batch_points(
+            collection_name=collection_name,
+            requests=build_fused_requests(
+                sparse_query=sparse_query,
+                include_embedding=include_embedding,
+                hybrid_prefetch_multiplier=hybrid_prefetch_multiplier,
+                expansion_embeddings=expansion_embeddings,
+                version_group_size=version_group_size,
+                **request,
+            ),
+        )
+        collapse_limit = request["topk"] if version_group_size > 0 else None
+        return _merge_fused(responses, include_embedding, hydrated, collapse_limit)
+
+    if version_group_size > 0:
+        group_query = client.query_points_groups(
+            **build_group_request(version_group_size, include_embedding=include_embedding, **request)
+        )
+        if legacy_fallback:
+            grouped, legacy = await asyncio.gather(
+                group_query,
+                client.query_points(**_legacy_request(include_embedding, **request)),
+            )
+        else:
+            grouped, legacy = await group_query, None
+        points = _grouped_points(grouped, legacy, request["topk"], version_group_size)
+        return points_to_candidates(points, include_embedding, hydrated)
+
+    response = await client.query_points(**build_query_request(include_embedding=include_embedding, **request))
+    return points_to_candidates(list(response.points or []), include_embedding, hydrated)
+
+
+def _citation_filter(refs: list[LegalRef], filters: dict[str, Any] | None) -> models.Filter:
+    """Cada cita debe aparecer en el chunk: por `legalRefs` o, en chunks sin esa clave, por frase en el texto."""
+    base = _build_filter(filters)
+    conditions: list[Any] = list(base.must or []) if base is not None else []
+    for ref in refs:
+        conditions.append(
+            models.Filter(
+                should=[
+                    models.FieldCondition(key=LEGAL_REFS_FIELD, match=models.MatchAny(any=ref.match_keys)),
+                    *(
+                        models.FieldCondition(key=field_name, match=models.MatchPhrase(phrase=phrase))
+                        for field_name in CHUNK_TEXT_FIELDS
+                        for phrase in ref.phrases
+                    ),
+                ]
+            )
+        )
+    return models.Filter(must=conditions)
+
+
+def _citation_candidates(records: list[Any], refs: list[LegalRef]) -> list[ChunkCandidate]:
+    # Primero los que tienen la cita exacta (con codigo); despues por documento y posicion.
+    exact_keys = {ref.key for ref in refs}
+    ordered = sorted(
+        records,
+        key=lambda record: (
+            not exact_keys.issubset((record.payload or {}).get(LEGAL_REFS_FIELD) or []),
+            str((record.payload or {}).get("title") or (record.payload or {}).get("docName") or ""),
+            int((record.payload or {}).get("chunkIndex") or 0),
+        ),
+    )
+    candidates = points_to_candidates(ordered, include_embedding=False)
+    for candidate in candidates:
+        candidate.rerank_score = 1.0
+    return candidates
+
+
+def lookup_citations(
+    client: QdrantClient,
+    collection_name: str,
+    refs: list[LegalRef],
+    filters: dict[str, Any] | None,
+    limit: int,
+) -> list[ChunkCandidate]:
+    """Chunks que citan `refs`, con un `scroll` filtrado por indice de payload: sin embedding ni busqueda vectorial."""
+    records, _ = client.scroll(
+        collection_name=collection_name,
+        scroll_filter=_citation_filter(refs, filters),
+        limit=limit,
+        with_payload=True,
+        with_vectors=False,
+    )
+    return _citation_candidates(records, refs)
+
+
+async def alookup_citations(
+    client: AsyncQdrantClient,
+    collection_name: str,
+    refs: list[LegalRef],
+    filters: dict[str, Any] | None,
+    limit: int,
+) -> list[ChunkCandidate]:
+    records, _ = await client.scroll(
+        collection_name=collection_name,
+        scroll_filter=_citation_filter(refs, filters),
+        limit=limit,
+        with_payload=True,
+        with_vectors=False,
+    )
+    return _citation_candidates(records, refs)
+
+
+def count_filtered(client: QdrantClient, collection_name: str, filters: dict[str, Any] | None) -> int:
+    """Puntos que cumplen los filtros; con indice de payload es un conteo barato."""
+    return int(client.count(collection_name=collection_name, count_filter=_build_filter(filters), exact=True).count)
+
+
+async def acount_filtered(client: AsyncQdrantClient, collection_name: str, filters: dict[str, Any] | None) -> int:
+    response = await client.count(collection_name=collection_name, count_filter=_build_filter(filters), exact=True)
+    return int(response.count)
+
+
+def _point_id(chunk_id: str) -> int | str:
+    return int(chunk_id) if chunk_id.isdigit() else chunk_id
+
+
+def _pending_hydration(candidates: list[ChunkCandidate]) -> list[ChunkCandidate]:
+    return [candidate for candidate in candidates if not candidate.hydrated]
+
+
+def _apply_hydration(pending: list[ChunkCandidate], records: list[Any]) -> None:
+    payloads = {str(record.id): dict(record.payload or {}) for record in records}
+    for candidate in pending:
+        payload = payloads.get(candidate.chunk_id)
+        if payload is None:
+            continue
+        candidate.text = str(payload.get("chunkText") or payload.get("text") or "")
+        candidate.metadata = dict(payload.get("metadata") or {})
+        candidate.hydrated = True
+
+
+def hydrate_candidates(client: QdrantClient, collection_name: str, candidates: list[ChunkCandidate]) -> None:
+    """Completa texto y metadata de los candidatos que vinieron con la proyeccion minima, en un solo `retrieve`."""
+    pending = _pending_hydration(candidates)
+    if not pending:
+        return
+    records = client.retrieve(
+        collection_name=collection_name,
+        ids=[_point_id(candidate.chunk_id) for candidate in pending],
+        with_payload=HYDRATE_PAYLOAD_FIELDS,
+        with_vectors=False,
+    )
+    _apply_hydration(pending, records)
+
+
+async def ahydrate_candidates(client: AsyncQdrantClient, collection_name: str, candidates: list[ChunkCandidate]) -> None:
+    pending = _pending_hydration(candidates)
+    if not pending:
+        return
+    records = await client.retrieve(
+        collection_name=collection_name,
+        ids=[_point_id(candidate.chunk_id) for candidate in pending],
+        with_payload=HYDRATE_PAYLOAD_FIELDS,
+        with_vectors=False,
+    )
+    _apply_hydration(pending, records)
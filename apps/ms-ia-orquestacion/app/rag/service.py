@@ -1,17 +1,43 @@
 from __future__ import annotations
 
+import asyncio
 import time
 from dataclasses import dataclass
 from typing import Any
 
-from openai import OpenAI
-from qdrant_client import QdrantClient
+from openai import AsyncOpenAI, OpenAI
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 
+from app.ai.embedding_provider import EmbeddingProvider, create_embedding_provider
+from app.ai.query_batcher import AsyncEmbeddingMicroBatcher, EmbeddingMicroBatcher
+from app.ai.rate_limiter import approx_tokens, arun_limited, get_rate_limiter, run_limited
+from app.ai.usage_ledger import UsageLedger, get_usage_aggregator
+from app.core.cache import TTLCache
 from app.core.config import get_settings
 from app.core.logger import get_logger
+from app.core.text import canonical_query
+from app.db.qdrant import TENANT_FIELD, build_search_params
+from app.rag.hot_tier import get_hot_tier
+from app.rag.legal_refs import LegalRef, extract_legal_refs, is_citation_only
 from app.rag.prompting import build_grounded_prompt
-from app.rag.reranker import rerank_candidates, should_reject_by_threshold
-from app.rag.retriever import ChunkCandidate, retrieve_candidates
+from app.rag.query_expansion import aexpand_query, expand_query
+from app.rag.reranker import LLM_RERANK_MAX_CANDIDATES, arerank_candidates, rerank_candidates, should_reject_by_threshold
+from app.rag.retrieval_cache import FilteredCountCache, RetrievalCache, get_collection_generations
+from app.rag.retriever import (
+    CANDIDATE_PAYLOAD_FIELDS,
+    ChunkCandidate,
+    acount_filtered,
+    ahas_legacy_points,
+    ahydrate_candidates,
+    alookup_citations,
+    aretrieve_candidates,
+    count_filtered,
+    has_legacy_points,
+    hydrate_candidates,
+    lookup_citations,
+    retrieve_candidates,
+)
+from app.rag.sparse import sparse_query_vector
 
 
 logger = get_logger("ms-ia-orquestacion.rag.pipeline")
@@ -36,6 +62,34 @@ class PipelineRunConfig:
     source_filter: str | None
     version_filter: str | None
     dry_run: bool
+    hnsw_ef: int = 0
+    # None = automatica: exacta cuando el subconjunto filtrado tiene <= RAG_EXACT_MAX_POINTS puntos (0 = nunca).
+    exact: bool | None = None
+    # Reformulaciones de la pregunta fusionadas con RRF en el mismo query_batch_points (0 = apagado).
+    multi_query: int = 0
+    # Versiones por chunk que se comparan para quedarse con la mas nueva (0 = sin colapsar versiones).
+    version_group_size: int = 0
+    # Preguntas que solo citan una norma ("articulo 64 CST") se resuelven con un scroll por legalRefs.
+    citation_fast_path: bool = False
+    # MMR en el rerank: 1.0 = solo relevancia; menor penaliza chunks casi repetidos en el top final_k.
+    mmr_lambda: float = 1.0
+
+
+def _best_score(top_scores: list[float]) -> float | None:
+    """
+    Mejor similitud del top. Con fusion RRF (hibrido / multi-query) el orden es por rango fusionado y el
+    primer chunk no es necesariamente el de mayor coseno, asi que el umbral no puede leer `top_scores[0]`.
+    """
+    return max(top_scores) if top_scores else None
+
+
+def _parse_exact(value: Any) -> bool | None:
+    if value is None or isinstance(value, bool):
+        return value
+    normalized = str(value).strip().lower()
+    if normalized in {"", "auto"}:
+        return None
+    return normalized in {"1", "true", "yes", "on"}
 
 
 def _build_retrieval_filters(
@@ -47,7 +101,7 @@ def _build_retrieval_filters(
     final_filters: dict[str, Any] = {}
 
     if incoming_filters:
-        for key in ("source", "version", "docId"):
+        for key in ("source", "version", "docId", TENANT_FIELD):
             value = incoming_filters.get(key)
             if value:
                 final_filters[key] = value
@@ -62,21 +116,251 @@ def _build_retrieval_filters(
     return final_filters or None
 
 
+class _StageTimer:
+    def __init__(self) -> None:
+        self._started = time.perf_counter()
+        self._stage_started = self._started
+        self.stages: dict[str, float] = {}
+
+    def start(self) -> None:
+        self._stage_started = time.perf_counter()
+
+    def stop(self, stage: str) -> float:
+        """Acumula: una etapa puede medirse en varios tramos (ej. retrieval + hidratacion de payloads)."""
+        elapsed = (time.perf_counter() - self._stage_started) * 1000
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + elapsed, 2)
+        return self.stages[stage]
+
+    def latency_ms(self) -> dict[str, float]:
+        return {
+            "embed": self.stages.get("embed", 0.0),
+            "retrieval": self.stages.get("retrieval", 0.0),
+            "rerank": self.stages.get("rerank", 0.0),
+            "generate": self.stages.get("generate", 0.0),
+            "total": round((time.perf_counter() - self._started) * 1000, 2),
+        }
+
+
 class RetrievalPipelineService:
-    def __init__(self, qdrant_client: QdrantClient, qdrant_collection: str, openai_client: OpenAI, embedding_model: str, answer_model: str) -> None:
+    def __init__(
+        self,
+        qdrant_client: QdrantClient,
+        qdrant_collection: str,
+        openai_client: OpenAI | None,
+        embedding_model: str,
+        answer_model: str,
+        embedding_provider: EmbeddingProvider | None = None,
+        async_qdrant_client: AsyncQdrantClient | None = None,
+        async_openai_client: AsyncOpenAI | None = None,
+    ) -> None:
         self.qdrant_client = qdrant_client
         self.qdrant_collection = qdrant_collection
         self.openai_client = openai_client
+        self.async_qdrant_client = async_qdrant_client
+        self.async_openai_client = async_openai_client
         self.embedding_model = embedding_model
         self.answer_model = answer_model
-
-    def _embed_query(self, query: str, dimensions: int) -> list[float]:
-        result = self.openai_client.embeddings.create(
-            model=self.embedding_model,
-            input=[query],
-            dimensions=dimensions,
+        self.embedding_provider = embedding_provider or create_embedding_provider(openai_client, async_openai_client)
+        settings = get_settings()
+        self._query_cache: TTLCache[list[float]] = TTLCache(
+            maxsize=settings.query_cache_size,
+            ttl_s=settings.query_cache_ttl_s,
+        )
+        self._expansion_cache: TTLCache[list[str]] = TTLCache(
+            maxsize=settings.query_cache_size,
+            ttl_s=settings.query_cache_ttl_s,
+        )
+        self._retrieval_cache = RetrievalCache(
+            maxsize=settings.retrieval_cache_size,
+            ttl_s=settings.retrieval_cache_ttl_s,
+            generations=get_collection_generations(),
+        )
+        self._count_cache = FilteredCountCache(
+            maxsize=256,
+            ttl_s=settings.retrieval_cache_ttl_s,
+            generations=get_collection_generations(),
+        )
+        # Por coleccion: (generacion, quedan puntos sin chunkKey); evita la consulta extra de grupos tras re-ingestar.
+        self._legacy_points: dict[str, tuple[int, bool]] = {}
+        self._query_batcher: EmbeddingMicroBatcher | None = None
+        self._async_query_batcher: AsyncEmbeddingMicroBatcher | None = None
+        if settings.query_batch_window_ms > 0:
+            self._query_batcher = EmbeddingMicroBatcher(
+                provider=self.embedding_provider,
+                window_ms=settings.query_batch_window_ms,
+                max_batch=settings.query_batch_max_size,
+                max_retries=settings.openai_max_retries,
+                max_in_flight=settings.query_batch_max_in_flight,
+            )
+            self._async_query_batcher = AsyncEmbeddingMicroBatcher(
+                provider=self.embedding_provider,
+                window_ms=settings.query_batch_window_ms,
+                max_batch=settings.query_batch_max_size,
+                max_retries=settings.openai_max_retries,
+            )
+        # Los reintentos los maneja run_limited para que los 429 respeten el cooldown compartido.
+        self._limited_openai = openai_client.with_options(max_retries=0) if openai_client is not None else None
+        self._async_limited_openai = (
+            async_openai_client.with_options(max_retries=0) if async_openai_client is not None else None
         )
-        return result.data[0].embedding
+        self._hot_tier = get_hot_tier()
+
+    def _query_cache_key(self, query: str) -> tuple[str, int, str]:
+        return (self.embedding_provider.model, self.embedding_provider.dimensions, canonical_query(query))
+
+    def _store_query_embedding(
+        self,
+        cache_key: tuple[str, int, str],
+        vector: list[float],
+        prompt_tokens: int,
+        ledger: UsageLedger | None,
+    ) -> None:
+        if ledger is not None:
+            ledger.record("embed", self.embedding_provider.model, prompt_tokens=prompt_tokens)
+        self._query_cache.set(cache_key, vector)
+
+    def _embed_query(self, query: str, ledger: UsageLedger | None = None) -> tuple[list[float], bool]:
+        cache_key = self._query_cache_key(query)
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+
+        if self._query_batcher is not None:
+            vector, prompt_tokens = self._query_batcher.embed(query)
+        else:
+            vectors, prompt_tokens = self.embedding_provider.embed_with_usage(
+                [query],
+                max_retries=get_settings().openai_max_retries,
+            )
+            vector = vectors[0]
+        self._store_query_embedding(cache_key, vector, prompt_tokens, ledger)
+        return vector, False
+
+    async def _aembed_query(self, query: str, ledger: UsageLedger | None = None) -> tuple[list[float], bool]:
+        cache_key = self._query_cache_key(query)
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+
+        if self._async_query_batcher is not None:
+            vector, prompt_tokens = await self._async_query_batcher.embed(query)
+        else:
+            vectors, prompt_tokens = await self.embedding_provider.aembed_with_usage(
+                [query],
+                max_retries=get_settings().openai_max_retries,
+            )
+            vector = vectors[0]
+        self._store_query_embedding(cache_key, vector, prompt_tokens, ledger)
+        return vector, False
+
+    def _expansion_cache_key(self, query: str, run_config: PipelineRunConfig) -> tuple[str, int, str]:
+        return (get_settings().multi_query_mode, run_config.multi_query, canonical_query(query))
+
+    def _expansion_model(self) -> str:
+        return get_settings().multi_query_model or self.answer_model
+
+    def _cached_variant_embeddings(self, variants: list[str]) -> tuple[list[Any], list[Any], list[int]]:
+        # peek: los hits de variantes se reportan en multiQuery.embedCacheHits, no en queryEmbedCache,
+        # que mide solo la pregunta original.
+        keys = [self._query_cache_key(variant) for variant in variants]
+        vectors = [self._query_cache.peek(key) for key in keys]
+        return keys, vectors, [idx for idx, vector in enumerate(vectors) if vector is None]
+
+    def _store_variant_embeddings(
+        self,
+        keys: list[Any],
+        vectors: list[Any],
+        missing: list[int],
+        embedded: list[list[float]],
+        prompt_tokens: int,
+        ledger: UsageLedger | None,
+    ) -> None:
+        if ledger is not None:
+            ledger.record("embed", self.embedding_provider.model, prompt_tokens=prompt_tokens)
+        for idx, vector in zip(missing, embedded):
+            vectors[idx] = vector
+            self._query_cache.set(keys[idx], vector)
+
+    def _expansion_metrics(self, variants: list[str], missing: list[int]) -> dict[str, Any]:
+        return {
+            "mode": get_settings().multi_query_mode,
+            "variants": variants,
+            "embedCacheHits": len(variants) - len(missing),
+        }
+
+    def _expand_query(
+        self,
+        query: str,
+        run_config: PipelineRunConfig,
+        ledger: UsageLedger | None = None,
+    ) -> tuple[list[list[float]] | None, dict[str, Any] | None]:
+        """Reformulaciones de la pregunta y sus embeddings, en una sola llamada batch para las que no estan en cache."""
+        if run_config.multi_query <= 0:
+            return None, None
+        settings = get_settings()
+        cache_key = self._expansion_cache_key(query, run_config)
+        variants = self._expansion_cache.get(cache_key)
+        if variants is None:
+            variants = expand_query(
+                settings.multi_query_mode,
+                query,
+                run_config.multi_query,
+                openai_client=self.openai_client,
+                model=self._expansion_model(),
+                ledger=ledger,
+            )
+            self._expansion_cache.set(cache_key, variants)
+
+        keys, vectors, missing = self._cached_variant_embeddings(variants)
+        if missing:
+            embedded, prompt_tokens = self.embedding_provider.embed_with_usage(
+                [variants[idx] for idx in missing],
+                max_retries=settings.openai_max_retries,
+            )
+            self._store_variant_embeddings(keys, vectors, missing, embedded, prompt_tokens, ledger)
+        return vectors or None, self._expansion_metrics(variants, missing)
+
+    async def _aexpand_query(
+        self,
+        query: str,
+        run_config: PipelineRunConfig,
+        ledger: UsageLedger | None = None,
+    ) -> tuple[list[list[float]] | None, dict[str, Any] | None]:
+        if run_config.multi_query <= 0:
+            return None, None
+        settings = get_settings()
+        cache_key = self._expansion_cache_key(query, run_config)
+        variants = self._expansion_cache.get(cache_key)
+        if variants is None:
+            variants = await aexpand_query(
+                settings.multi_query_mode,
+                query,
+                run_config.multi_query,
+                openai_client=self.async_openai_client,
+                model=self._expansion_model(),
+                ledger=ledger,
+            )
+            self._expansion_cache.set(cache_key, variants)
+
+        keys, vectors, missing = self._cached_variant_embeddings(variants)
+        if missing:
+            embedded, prompt_tokens = await self.embedding_provider.aembed_with_usage(
+                [variants[idx] for idx in missing],
+                max_retries=settings.openai_max_retries,
+            )
+            self._store_variant_embeddings(keys, vectors, missing, embedded, prompt_tokens, ledger)
+        return vectors or None, self._expansion_metrics(variants, missing)
+
+    def runtime_stats(self) -> dict[str, Any]:
+        return {
+            "queryEmbedCache": self._query_cache.stats(),
+            "retrievalCache": self._retrieval_cache.stats(),
+            "queryEmbedBatcher": self._query_batcher.stats() if self._query_batcher is not None else None,
+            "asyncQueryEmbedBatcher": (
+                self._async_query_batcher.stats() if self._async_query_batcher is not None else None
+            ),
+            "hotTier": self._hot_tier.stats() if self._hot_tier is not None else None,
+        }
 
     def _build_output(self, chunks: list[ChunkCandidate], answer: str) -> dict[str, Any]:
         citations = [{"source": c.source, "chunkIndex": c.chunk_index} for c in chunks]
@@ -104,6 +388,12 @@ class RetrievalPipelineService:
             source_filter=settings.rag_filter_source,
             version_filter=settings.rag_filter_version,
             dry_run=dry_run,
+            hnsw_ef=settings.rag_hnsw_ef,
+            exact=True if settings.rag_exact_search else None,
+            multi_query=settings.multi_query_count,
+            version_group_size=settings.rag_version_group_size,
+            citation_fast_path=settings.rag_citation_fast_path,
+            mmr_lambda=settings.rag_mmr_lambda,
         )
 
     def _merge_run_config(self, overrides: dict[str, Any] | None, dry_run: bool = False) -> PipelineRunConfig:
@@ -121,96 +411,244 @@ class RetrievalPipelineService:
             source_filter=overrides.get("source_filter", base.source_filter),
             version_filter=overrides.get("version_filter", base.version_filter),
             dry_run=bool(overrides.get("dry_run", base.dry_run)),
+            hnsw_ef=int(overrides.get("hnsw_ef", base.hnsw_ef)),
+            exact=_parse_exact(overrides.get("exact", base.exact)),
+            multi_query=int(overrides.get("multi_query", base.multi_query)),
+            version_group_size=int(overrides.get("version_group_size", base.version_group_size)),
+            citation_fast_path=bool(overrides.get("citation_fast_path", base.citation_fast_path)),
+            mmr_lambda=float(overrides.get("mmr_lambda", base.mmr_lambda)),
         )
 
-    def evaluate(
+    def _collection_for(self, filters: dict[str, Any] | None) -> str:
+        tenant_id = (filters or {}).get(TENANT_FIELD)
+        if not tenant_id:
+            return self.qdrant_collection
+        return get_settings().qdrant_tenant_collections.get(tenant_id, self.qdrant_collection)
+
+    def _scoped_filters(
+        self,
+        incoming_filters: dict[str, Any] | None,
+        run_config: PipelineRunConfig,
+    ) -> tuple[str, dict[str, Any] | None]:
+        filters = _build_retrieval_filters(
+            incoming_filters,
+            source_filter=run_config.source_filter,
+            version_filter=run_config.version_filter,
+        )
+        collection_name = self._collection_for(filters)
+        if collection_name != self.qdrant_collection and filters:
+            # La coleccion dedicada ya es del tenant: sin filtro, la busqueda usa el HNSW completo.
+            filters = {key: value for key, value in filters.items() if key != TENANT_FIELD} or None
+        return collection_name, filters
+
+    def _retrieval_request(
         self,
         query: str,
+        query_embedding: list[float],
         incoming_filters: dict[str, Any] | None,
-        overrides: dict[str, Any] | None = None,
-        dry_run: bool = False,
+        run_config: PipelineRunConfig,
+        expansion_embeddings: list[list[float]] | None = None,
     ) -> dict[str, Any]:
         settings = get_settings()
-        run_config = self._merge_run_config(overrides=overrides, dry_run=dry_run)
-        overall_started = time.perf_counter()
+        sparse_query = sparse_query_vector(query) if settings.hybrid_enabled else None
+        collection_name, filters = self._scoped_filters(incoming_filters, run_config)
+        return {
+            "collection_name": collection_name,
+            "query_embedding": query_embedding,
+            "topk": run_config.candidate_topk,
+            "filters": filters,
+            # El score de Qdrant ya es el coseno con la pregunta: solo MMR, que compara los candidatos entre si,
+            # necesita bajar los vectores.
+            "include_embedding": (
+                run_config.rerank_enabled and run_config.rerank_mode == "cosine" and run_config.mmr_lambda < 1.0
+            ),
+            "matryoshka_dim": settings.matryoshka_dim,
+            "prefetch_multiplier": settings.matryoshka_prefetch_multiplier,
+            "sparse_query": sparse_query,
+            "hybrid_prefetch_multiplier": settings.hybrid_prefetch_multiplier,
+            "expansion_embeddings": expansion_embeddings,
+            # Con filtro de version ya hay una sola por chunk: no hace falta agrupar.
+            "version_group_size": run_config.version_group_size if "version" not in (filters or {}) else 0,
+            "payload_fields": CANDIDATE_PAYLOAD_FIELDS if settings.two_phase_retrieval else None,
+        }
 
-        embed_started = time.perf_counter()
-        query_embedding = self._embed_query(query, settings.embedding_dimensions)
-        embed_ms = round((time.perf_counter() - embed_started) * 1000, 2)
+    def _citation_refs(self, query: str, run_config: PipelineRunConfig) -> list[LegalRef]:
+        if not run_config.citation_fast_path or not is_citation_only(query):
+            return []
+        return extract_legal_refs(query)
 
-        filters = _build_retrieval_filters(
-            incoming_filters,
-            source_filter=run_config.source_filter,
-            version_filter=run_config.version_filter,
+    def _citation_hit(
+        self,
+        refs: list[LegalRef],
+        chunks: list[ChunkCandidate],
+        run_config: PipelineRunConfig,
+        stage_metrics: dict[str, Any],
+        lookup_ms: float,
+    ) -> list[ChunkCandidate] | None:
+        """Atajo solo si la cita es exacta: entre 1 y final_k chunks. Con mas, hace falta rankear; sin ninguno, buscar."""
+        hit = 0 < len(chunks) <= run_config.final_k
+        stage_metrics["citation"] = {
+            "refs": [ref.key for ref in refs],
+            "matches": len(chunks),
+            "fastPath": hit,
+            "lookupMs": lookup_ms,
+        }
+        logger.info(
+            "rag_pipeline citation refs=%s matches=%d fast_path=%s duration_ms=%.2f",
+            [ref.key for ref in refs],
+            len(chunks),
+            hit,
+            lookup_ms,
         )
-        retrieval_started = time.perf_counter()
-
-        include_embedding = run_config.rerank_enabled and run_config.rerank_mode == "cosine"
-        candidates = retrieve_candidates(
-            client=self.qdrant_client,
-            collection_name=self.qdrant_collection,
-            query_embedding=query_embedding,
-            topk=run_config.candidate_topk,
-            filters=filters,
-            include_embedding=include_embedding,
+        if not hit:
+            return None
+        stage_metrics["retrievalBackend"] = "citation"
+        return chunks
+
+    def _hot_tier_search(self, request: dict[str, Any]) -> list[ChunkCandidate] | None:
+        """
+        Busqueda exacta en memoria; None cuando hay que ir a Qdrant (sin bundle, fusion RRF, colapso de
+        versiones, otra coleccion o filtro no indexado).
+        """
+        if self._hot_tier is None or request["sparse_query"] is not None or request["expansion_embeddings"]:
+            return None
+        if request["version_group_size"] > 0:
+            return None
+        index = self._hot_tier.get()
+        if index is None or index.collection != request["collection_name"] or not index.supports(request["filters"]):
+            return None
+        return index.search(
+            request["query_embedding"],
+            topk=request["topk"],
+            filters=request["filters"],
+            include_embedding=request["include_embedding"],
         )
-        retrieval_ms = round((time.perf_counter() - retrieval_started) * 1000, 2)
 
+    def _cached_retrieval(
+        self,
+        request: dict[str, Any],
+        run_config: PipelineRunConfig,
+        stage_metrics: dict[str, Any],
+    ) -> tuple[list[ChunkCandidate] | None, int]:
+        """Busca en el cache y luego en el hot tier; devuelve la generacion leida antes de ir a Qdrant."""
+        generation = self._retrieval_cache.generation(request["collection_name"])
+        candidates = self._retrieval_cache.get(request, self._search_mode(run_config))
+        stage_metrics["retrievalCache"] = {"hit": candidates is not None, **self._retrieval_cache.stats()}
+        if candidates is not None:
+            stage_metrics["retrievalBackend"] = "cache"
+            return candidates, generation
+        candidates = self._hot_tier_search(request)
+        stage_metrics["retrievalBackend"] = "hot_tier" if candidates is not None else "qdrant"
+        return candidates, generation
+
+    def _store_retrieval(
+        self,
+        request: dict[str, Any],
+        run_config: PipelineRunConfig,
+        candidates: list[ChunkCandidate],
+        generation: int,
+        stage_metrics: dict[str, Any],
+    ) -> None:
+        # Se guarda despues de hidratar: los chunks finales quedan con texto y un hit no repite el `retrieve`.
+        if stage_metrics["retrievalBackend"] != "cache":
+            self._retrieval_cache.set(request, candidates, generation, self._search_mode(run_config))
+
+    def _cached_legacy_fallback(self, request: dict[str, Any], generation: int) -> bool | None:
+        """Si la consulta de grupos necesita sumar los puntos sin chunkKey; None cuando hay que contarlos."""
+        if request["version_group_size"] <= 0 or request["sparse_query"] is not None or request["expansion_embeddings"]:
+            return False
+        if not get_settings().rag_version_legacy_fallback:
+            return False
+        cached = self._legacy_points.get(request["collection_name"])
+        if cached is None or cached[0] != generation:
+            return None
+        return cached[1]
+
+    def _store_legacy_fallback(self, request: dict[str, Any], generation: int, has_legacy: bool) -> bool:
+        self._legacy_points[request["collection_name"]] = (generation, has_legacy)
+        if not has_legacy:
+            logger.info("rag_pipeline legacy_fallback_off collection=%s", request["collection_name"])
+        return has_legacy
+
+    def _search_mode(self, run_config: PipelineRunConfig) -> tuple[int, bool | None]:
+        return (run_config.hnsw_ef, run_config.exact)
+
+    def _needs_filtered_count(self, run_config: PipelineRunConfig) -> bool:
+        return run_config.exact is None and get_settings().rag_exact_max_points > 0
+
+    def _search_params(
+        self,
+        run_config: PipelineRunConfig,
+        filtered_count: int | None,
+        stage_metrics: dict[str, Any],
+    ) -> models.SearchParams | None:
+        """hnsw_ef/exact del request; en modo automatico, exacta si el subconjunto filtrado es chico."""
+        exact = run_config.exact
+        reason = "forced" if exact else None
+        if exact is None:
+            exact = filtered_count is not None and filtered_count <= get_settings().rag_exact_max_points
+            reason = "small_subset" if exact else None
+        stage_metrics["searchParams"] = {
+            "hnswEf": run_config.hnsw_ef or None,
+            "exact": exact,
+            "exactReason": reason,
+            "filteredCount": filtered_count,
+        }
+        return build_search_params(hnsw_ef=run_config.hnsw_ef, exact=exact)
+
+    def _log_retrieval(
+        self,
+        query: str,
+        run_config: PipelineRunConfig,
+        request: dict[str, Any],
+        candidates: list[ChunkCandidate],
+        backend: str,
+        retrieval_ms: float,
+    ) -> None:
         sample_scores = [round(c.mongo_score, 4) for c in candidates[:5]]
         logger.info(
-            "rag_pipeline retrieval query_len=%d candidate_topk=%d returned=%d filters=%s top_mongo_scores=%s duration_ms=%.2f",
+            "rag_pipeline retrieval backend=%s query_len=%d candidate_topk=%d returned=%d filters=%s top_mongo_scores=%s duration_ms=%.2f",
+            backend,
             len(query),
             run_config.candidate_topk,
             len(candidates),
-            filters,
+            request["filters"],
             sample_scores,
             retrieval_ms,
         )
 
-        if not candidates:
-            total_ms = round((time.perf_counter() - overall_started) * 1000, 2)
-            return {
-                "response": {"answer": NO_SUPPORT_MESSAGE, "citations": [], "usedChunks": []},
-                "metrics": {
-                    "answerable": False,
-                    "thresholdTriggered": True,
-                    "top1Score": None,
-                    "top5Scores": [],
-                    "usedChunkIds": [],
-                    "usedChunksCount": 0,
-                    "latencyMs": {
-                        "embed": embed_ms,
-                        "retrieval": retrieval_ms,
-                        "rerank": 0.0,
-                        "generate": 0.0,
-                        "total": total_ms,
-                    },
-                    "config": {
-                        "candidateTopK": run_config.candidate_topk,
-                        "finalK": run_config.final_k,
-                        "threshold": run_config.score_threshold,
-                        "rerankMode": run_config.rerank_mode,
-                        "rerankEnabled": run_config.rerank_enabled,
-                        "temperature": run_config.temperature,
-                        "sourceFilter": run_config.source_filter,
-                        "versionFilter": run_config.version_filter,
-                        "dryRun": run_config.dry_run,
-                    },
-                },
-            }
+    def _rerank_request(
+        self,
+        query: str,
+        query_embedding: list[float],
+        candidates: list[ChunkCandidate],
+        run_config: PipelineRunConfig,
+        ledger: UsageLedger,
+    ) -> dict[str, Any]:
+        return {
+            "mode": run_config.rerank_mode if run_config.rerank_enabled else "cosine",
+            "query": query,
+            "query_embedding": query_embedding,
+            "candidates": candidates,
+            "llm_model": self.answer_model,
+            "ledger": ledger,
+            "top_k": run_config.final_k,
+            "mmr_lambda": run_config.mmr_lambda if run_config.rerank_enabled else 1.0,
+        }
 
-        rerank_started = time.perf_counter()
-        ranked = rerank_candidates(
-            mode=run_config.rerank_mode if run_config.rerank_enabled else "cosine",
-            query=query,
-            query_embedding=query_embedding,
-            candidates=candidates,
-            openai_client=self.openai_client if run_config.rerank_enabled and run_config.rerank_mode == "llm" else None,
-            llm_model=self.answer_model,
-        )
-        top_chunks = ranked[: run_config.final_k]
-        rerank_ms = round((time.perf_counter() - rerank_started) * 1000, 2)
+    def _uses_llm_rerank(self, run_config: PipelineRunConfig) -> bool:
+        return run_config.rerank_enabled and run_config.rerank_mode == "llm"
 
+    def _needs_text_for_rerank(self, run_config: PipelineRunConfig, openai_client: Any) -> bool:
+        return self._uses_llm_rerank(run_config) and openai_client is not None
+
+    def _select_top(
+        self,
+        ranked: list[ChunkCandidate],
+        run_config: PipelineRunConfig,
+        rerank_ms: float,
+    ) -> tuple[list[ChunkCandidate], list[float], bool]:
+        top_chunks = ranked[: run_config.final_k]
         top_scores = [round(float(c.rerank_score if c.rerank_score is not None else c.mongo_score), 4) for c in top_chunks]
         logger.info(
             "rag_pipeline rerank mode=%s enabled=%s final_k=%d top_scores=%s duration_ms=%.2f",
@@ -221,7 +659,7 @@ class RetrievalPipelineService:
             rerank_ms,
         )
 
-        best_score = top_scores[0] if top_scores else None
+        best_score = _best_score(top_scores)
         threshold_triggered = should_reject_by_threshold(best_score, run_config.score_threshold)
         if threshold_triggered:
             logger.info(
@@ -229,78 +667,55 @@ class RetrievalPipelineService:
                 best_score,
                 run_config.score_threshold,
             )
+        return top_chunks, top_scores, threshold_triggered
 
-        if run_config.dry_run:
-            total_ms = round((time.perf_counter() - overall_started) * 1000, 2)
-            response = self._build_output(top_chunks, answer="DRY_RUN: generation skipped")
-            return {
-                "response": response,
-                "metrics": {
-                    "answerable": True,
-                    "thresholdTriggered": False,
-                    "top1Score": best_score,
-                    "top5Scores": top_scores,
-                    "usedChunkIds": [chunk.chunk_id for chunk in top_chunks],
-                    "usedChunksCount": len(top_chunks),
-                    "latencyMs": {
-                        "embed": embed_ms,
-                        "retrieval": retrieval_ms,
-                        "rerank": rerank_ms,
-                        "generate": 0.0,
-                        "total": total_ms,
-                    },
-                    "config": {
-                        "candidateTopK": run_config.candidate_topk,
-                        "finalK": run_config.final_k,
-                        "threshold": run_config.score_threshold,
-                        "rerankMode": run_config.rerank_mode,
-                        "rerankEnabled": run_config.rerank_enabled,
-                        "temperature": run_config.temperature,
-                        "sourceFilter": run_config.source_filter,
-                        "versionFilter": run_config.version_filter,
-                        "dryRun": run_config.dry_run,
-                    },
-                },
-            }
-
-        generation_started = time.perf_counter()
+    def _generation_request(
+        self,
+        query: str,
+        top_chunks: list[ChunkCandidate],
+        run_config: PipelineRunConfig,
+    ) -> tuple[dict[str, Any], int]:
         system_prompt, user_prompt = build_grounded_prompt(query, top_chunks)
-        completion = self.openai_client.chat.completions.create(
-            model=self.answer_model,
-            temperature=run_config.temperature,
-            messages=[
+        request = {
+            "model": self.answer_model,
+            "temperature": run_config.temperature,
+            "messages": [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ],
-        )
-        answer = (completion.choices[0].message.content or "").strip()
-        generation_ms = round((time.perf_counter() - generation_started) * 1000, 2)
-        total_ms = round((time.perf_counter() - overall_started) * 1000, 2)
-        logger.info("rag_pipeline generate answer_len=%d duration_ms=%.2f total_ms=%.2f", len(answer), generation_ms, total_ms)
-
-        if not answer:
-            answer = NO_INFO_MESSAGE
+        }
+        return request, approx_tokens(system_prompt, user_prompt)
 
-        answerable = not _is_no_info_answer(answer)
+    def _read_answer(self, completion: Any, ledger: UsageLedger) -> str:
+        ledger.record_completion("generate", self.answer_model, completion.usage)
+        return (completion.choices[0].message.content or "").strip()
 
-        response = self._build_output(top_chunks, answer)
-        return {
-            "response": response,
-            "metrics": {
-                "answerable": answerable,
-                "thresholdTriggered": threshold_triggered,
-                "top1Score": best_score,
-                "top5Scores": top_scores,
-                "usedChunkIds": [chunk.chunk_id for chunk in top_chunks],
-                "usedChunksCount": len(top_chunks),
-                "answerLength": len(answer),
-                "latencyMs": {
-                    "embed": embed_ms,
-                    "retrieval": retrieval_ms,
-                    "rerank": rerank_ms,
-                    "generate": generation_ms,
-                    "total": total_ms,
-                },
+    def _result(
+        self,
+        response: dict[str, Any],
+        run_config: PipelineRunConfig,
+        timer: _StageTimer,
+        stage_metrics: dict[str, Any],
+        top_chunks: list[ChunkCandidate],
+        top_scores: list[float],
+        answerable: bool,
+        threshold_triggered: bool,
+        answer_length: int | None = None,
+    ) -> dict[str, Any]:
+        metrics: dict[str, Any] = {
+            "answerable": answerable,
+            "thresholdTriggered": threshold_triggered,
+            "top1Score": _best_score(top_scores),
+            "top5Scores": top_scores,
+            "usedChunkIds": [chunk.chunk_id for chunk in top_chunks],
+            "usedChunksCount": len(top_chunks),
+        }
+        if answer_length is not None:
+            metrics["answerLength"] = answer_length
+        metrics.update(
+            {
+                "latencyMs": timer.latency_ms(),
+                **stage_metrics,
                 "config": {
                     "candidateTopK": run_config.candidate_topk,
                     "finalK": run_config.final_k,
@@ -311,9 +726,357 @@ class RetrievalPipelineService:
                     "sourceFilter": run_config.source_filter,
                     "versionFilter": run_config.version_filter,
                     "dryRun": run_config.dry_run,
+                    "hnswEf": run_config.hnsw_ef or None,
+                    "exact": run_config.exact,
+                    "multiQuery": run_config.multi_query,
+                    "versionGroupSize": run_config.version_group_size,
+                    "citationFastPath": run_config.citation_fast_path,
+                    "mmrLambda": run_config.mmr_lambda,
                 },
-            },
-        }
+            }
+        )
+        return {"response": response, "metrics": metrics}
+
+    def _no_candidates_result(
+        self,
+        run_config: PipelineRunConfig,
+        timer: _StageTimer,
+        stage_metrics: dict[str, Any],
+    ) -> dict[str, Any]:
+        return self._result(
+            {"answer": NO_SUPPORT_MESSAGE, "citations": [], "usedChunks": []},
+            run_config,
+            timer,
+            stage_metrics,
+            top_chunks=[],
+            top_scores=[],
+            answerable=False,
+            threshold_triggered=True,
+        )
+
+    def _dry_run_result(
+        self,
+        run_config: PipelineRunConfig,
+        timer: _StageTimer,
+        stage_metrics: dict[str, Any],
+        top_chunks: list[ChunkCandidate],
+        top_scores: list[float],
+    ) -> dict[str, Any]:
+        return self._result(
+            self._build_output(top_chunks, answer="DRY_RUN: generation skipped"),
+            run_config,
+            timer,
+            stage_metrics,
+            top_chunks=top_chunks,
+            top_scores=top_scores,
+            answerable=True,
+            threshold_triggered=False,
+        )
+
+    def _answer_result(
+        self,
+        answer: str,
+        run_config: PipelineRunConfig,
+        timer: _StageTimer,
+        stage_metrics: dict[str, Any],
+        top_chunks: list[ChunkCandidate],
+        top_scores: list[float],
+        threshold_triggered: bool,
+    ) -> dict[str, Any]:
+        latency = timer.latency_ms()
+        logger.info(
+            "rag_pipeline generate answer_len=%d duration_ms=%.2f total_ms=%.2f",
+            len(answer),
+            latency["generate"],
+            latency["total"],
+        )
+        if not answer:
+            answer = NO_INFO_MESSAGE
+
+        return self._result(
+            self._build_output(top_chunks, answer),
+            run_config,
+            timer,
+            stage_metrics,
+            top_chunks=top_chunks,
+            top_scores=top_scores,
+            answerable=not _is_no_info_answer(answer),
+            threshold_triggered=threshold_triggered,
+            answer_length=len(answer),
+        )
+
+    def _new_ledger(self, incoming_filters: dict[str, Any] | None, correlation_id: str | None) -> UsageLedger:
+        request_filters = incoming_filters or {}
+        return UsageLedger(
+            correlation_id=correlation_id,
+            source=request_filters.get("source"),
+            tenant_id=request_filters.get("tenantId"),
+        )
+
+    def _attach_usage(self, result: dict[str, Any], ledger: UsageLedger) -> dict[str, Any]:
+        metrics = result["metrics"]
+        ledger.record_latency(metrics["latencyMs"])
+        metrics["usage"] = ledger.to_dict()
+        totals = metrics["usage"]["totals"]
+        logger.info(
+            "rag_usage corr=%s source=%s tenant=%s prompt_tokens=%d completion_tokens=%d cached_tokens=%d cost_usd=%.6f",
+            ledger.correlation_id,
+            ledger.source,
+            ledger.tenant_id,
+            totals["promptTokens"],
+            totals["completionTokens"],
+            totals["cachedTokens"],
+            totals["estimatedCostUsd"],
+        )
+        return result
+
+    def evaluate(
+        self,
+        query: str,
+        incoming_filters: dict[str, Any] | None,
+        overrides: dict[str, Any] | None = None,
+        dry_run: bool = False,
+        correlation_id: str | None = None,
+    ) -> dict[str, Any]:
+        ledger = self._new_ledger(incoming_filters, correlation_id)
+        try:
+            result = self._run_evaluation(query, incoming_filters, overrides, dry_run, ledger)
+            return self._attach_usage(result, ledger)
+        finally:
+            # Tambien se acumulan los requests que fallan a mitad: los tokens ya se pagaron.
+            get_usage_aggregator().add(ledger)
+
+    async def aevaluate(
+        self,
+        query: str,
+        incoming_filters: dict[str, Any] | None,
+        overrides: dict[str, Any] | None = None,
+        dry_run: bool = False,
+        correlation_id: str | None = None,
+    ) -> dict[str, Any]:
+        """Misma evaluacion que `evaluate`, sin bloquear el event loop (AsyncQdrantClient + AsyncOpenAI)."""
+        if self.async_qdrant_client is None:
+            raise ValueError("AsyncQdrantClient no configurado. Usa evaluate() o inyecta async_qdrant_client.")
+
+        ledger = self._new_ledger(incoming_filters, correlation_id)
+        try:
+            result = await self._arun_evaluation(query, incoming_filters, overrides, dry_run, ledger)
+            return self._attach_usage(result, ledger)
+        finally:
+            get_usage_aggregator().add(ledger)
+
+    def _run_evaluation(
+        self,
+        query: str,
+        incoming_filters: dict[str, Any] | None,
+        overrides: dict[str, Any] | None,
+        dry_run: bool,
+        ledger: UsageLedger,
+    ) -> dict[str, Any]:
+        run_config = self._merge_run_config(overrides=overrides, dry_run=dry_run)
+        timer = _StageTimer()
+        stage_metrics: dict[str, Any] = {}
+
+        refs = self._citation_refs(query, run_config)
+        if refs:
+            collection_name, filters = self._scoped_filters(incoming_filters, run_config)
+            chunks = lookup_citations(self.qdrant_client, collection_name, refs, filters, limit=run_config.final_k + 1)
+            cited = self._citation_hit(refs, chunks, run_config, stage_metrics, timer.stop("retrieval"))
+            if cited is not None:
+                return self._complete(query, run_config, timer, stage_metrics, cited, [1.0] * len(cited), False, ledger)
+            timer.start()
+
+        query_embedding, embed_cache_hit = self._embed_query(query, ledger)
+        stage_metrics["embedCache"] = {"hit": embed_cache_hit, **self._query_cache.stats()}
+        expansion_embeddings, expansion_metrics = self._expand_query(query, run_config, ledger)
+        timer.stop("embed")
+        if expansion_metrics is not None:
+            stage_metrics["multiQuery"] = expansion_metrics
+
+        request = self._retrieval_request(query, query_embedding, incoming_filters, run_config, expansion_embeddings)
+        timer.start()
+        candidates, generation = self._cached_retrieval(request, run_config, stage_metrics)
+        if candidates is None:
+            filtered_count = None
+            if self._needs_filtered_count(run_config):
+                filtered_count = self._count_cache.get(request["collection_name"], request["filters"])
+                if filtered_count is None:
+                    filtered_count = count_filtered(self.qdrant_client, request["collection_name"], request["filters"])
+                    self._count_cache.set(request["collection_name"], request["filters"], filtered_count, generation)
+            legacy_fallback = self._cached_legacy_fallback(request, generation)
+            if legacy_fallback is None:
+                legacy_fallback = self._store_legacy_fallback(
+                    request,
+                    generation,
+                    has_legacy_points(self.qdrant_client, request["collection_name"]),
+                )
+            candidates = retrieve_candidates(
+                client=self.qdrant_client,
+                search_params=self._search_params(run_config, filtered_count, stage_metrics),
+                legacy_fallback=legacy_fallback,
+                **request,
+            )
+        self._log_retrieval(query, run_config, request, candidates, stage_metrics["retrievalBackend"], timer.stop("retrieval"))
+        if not candidates:
+            self._store_retrieval(request, run_config, candidates, generation, stage_metrics)
+            return self._no_candidates_result(run_config, timer, stage_metrics)
+
+        timer.start()
+        if self._needs_text_for_rerank(run_config, self.openai_client):
+            hydrate_candidates(self.qdrant_client, request["collection_name"], candidates[:LLM_RERANK_MAX_CANDIDATES])
+        ranked = rerank_candidates(
+            openai_client=self.openai_client if self._uses_llm_rerank(run_config) else None,
+            **self._rerank_request(query, query_embedding, candidates, run_config, ledger),
+        )
+        top_chunks, top_scores, threshold_triggered = self._select_top(ranked, run_config, timer.stop("rerank"))
+        timer.start()
+        hydrate_candidates(self.qdrant_client, request["collection_name"], top_chunks)
+        timer.stop("retrieval")
+        self._store_retrieval(request, run_config, candidates, generation, stage_metrics)
+        return self._complete(query, run_config, timer, stage_metrics, top_chunks, top_scores, threshold_triggered, ledger)
+
+    def _complete(
+        self,
+        query: str,
+        run_config: PipelineRunConfig,
+        timer: _StageTimer,
+        stage_metrics: dict[str, Any],
+        top_chunks: list[ChunkCandidate],
+        top_scores: list[float],
+        threshold_triggered: bool,
+        ledger: UsageLedger,
+    ) -> dict[str, Any]:
+        if run_config.dry_run:
+            return self._dry_run_result(run_config, timer, stage_metrics, top_chunks, top_scores)
+
+        if self._limited_openai is None:
+            raise ValueError("OPENAI_API_KEY no configurada. La generacion de respuestas requiere OpenAI.")
+
+        timer.start()
+        generation, estimated_tokens = self._generation_request(query, top_chunks, run_config)
+        limited_openai = self._limited_openai
+        completion = run_limited(
+            get_rate_limiter(self.answer_model),
+            lambda: limited_openai.chat.completions.with_raw_response.create(**generation),
+            estimated_tokens=estimated_tokens,
+            max_retries=get_settings().openai_max_retries,
+        )
+        answer = self._read_answer(completion, ledger)
+        timer.stop("generate")
+        return self._answer_result(answer, run_config, timer, stage_metrics, top_chunks, top_scores, threshold_triggered)
+
+    async def _arun_evaluation(
+        self,
+        query: str,
+        incoming_filters: dict[str, Any] | None,
+        overrides: dict[str, Any] | None,
+        dry_run: bool,
+        ledger: UsageLedger,
+    ) -> dict[str, Any]:
+        run_config = self._merge_run_config(overrides=overrides, dry_run=dry_run)
+        timer = _StageTimer()
+        stage_metrics: dict[str, Any] = {}
+
+        refs = self._citation_refs(query, run_config)
+        if refs:
+            collection_name, filters = self._scoped_filters(incoming_filters, run_config)
+            chunks = await alookup_citations(
+                self.async_qdrant_client,
+                collection_name,
+                refs,
+                filters,
+                limit=run_config.final_k + 1,
+            )
+            cited = self._citation_hit(refs, chunks, run_config, stage_metrics, timer.stop("retrieval"))
+            if cited is not None:
+                return await self._acomplete(query, run_config, timer, stage_metrics, cited, [1.0] * len(cited), False, ledger)
+            timer.start()
+
+        # La expansion (con su llamada al modelo en modo llm) corre en paralelo con el embedding de la pregunta.
+        (query_embedding, embed_cache_hit), (expansion_embeddings, expansion_metrics) = await asyncio.gather(
+            self._aembed_query(query, ledger),
+            self._aexpand_query(query, run_config, ledger),
+        )
+        timer.stop("embed")
+        stage_metrics["embedCache"] = {"hit": embed_cache_hit, **self._query_cache.stats()}
+        if expansion_metrics is not None:
+            stage_metrics["multiQuery"] = expansion_metrics
+
+        request = self._retrieval_request(query, query_embedding, incoming_filters, run_config, expansion_embeddings)
+        timer.start()
+        candidates, generation = self._cached_retrieval(request, run_config, stage_metrics)
+        if candidates is None:
+            filtered_count = None
+            if self._needs_filtered_count(run_config):
+                filtered_count = self._count_cache.get(request["collection_name"], request["filters"])
+                if filtered_count is None:
+                    filtered_count = await acount_filtered(
+                        self.async_qdrant_client,
+                        request["collection_name"],
+                        request["filters"],
+                    )
+                    self._count_cache.set(request["collection_name"], request["filters"], filtered_count, generation)
+            legacy_fallback = self._cached_legacy_fallback(request, generation)
+            if legacy_fallback is None:
+                legacy_fallback = self._store_legacy_fallback(
+                    request,
+                    generation,
+                    await ahas_legacy_points(self.async_qdrant_client, request["collection_name"]),
+                )
+            candidates = await aretrieve_candidates(
+                client=self.async_qdrant_client,
+                search_params=self._search_params(run_config, filtered_count, stage_metrics),
+                legacy_fallback=legacy_fallback,
+                **request,
+            )
+        self._log_retrieval(query, run_config, request, candidates, stage_metrics["retrievalBackend"], timer.stop("retrieval"))
+        if not candidates:
+            self._store_retrieval(request, run_config, candidates, generation, stage_metrics)
+            return self._no_candidates_result(run_config, timer, stage_metrics)
+
+        timer.start()
+        if self._needs_text_for_rerank(run_config, self.async_openai_client):
+            await ahydrate_candidates(self.async_qdrant_client, request["collection_name"], candidates[:LLM_RERANK_MAX_CANDIDATES])
+        ranked = await arerank_candidates(
+            openai_client=self.async_openai_client if self._uses_llm_rerank(run_config) else None,
+            **self._rerank_request(query, query_embedding, candidates, run_config, ledger),
+        )
+        top_chunks, top_scores, threshold_triggered = self._select_top(ranked, run_config, timer.stop("rerank"))
+        timer.start()
+        await ahydrate_candidates(self.async_qdrant_client, request["collection_name"], top_chunks)
+        timer.stop("retrieval")
+        self._store_retrieval(request, run_config, candidates, generation, stage_metrics)
+        return await self._acomplete(query, run_config, timer, stage_metrics, top_chunks, top_scores, threshold_triggered, ledger)
+
+    async def _acomplete(
+        self,
+        query: str,
+        run_config: PipelineRunConfig,
+        timer: _StageTimer,
+        stage_metrics: dict[str, Any],
+        top_chunks: list[ChunkCandidate],
+        top_scores: list[float],
+        threshold_triggered: bool,
+        ledger: UsageLedger,
+    ) -> dict[str, Any]:
+        if run_config.dry_run:
+            return self._dry_run_result(run_config, timer, stage_metrics, top_chunks, top_scores)
+
+        if self._async_limited_openai is None:
+            raise ValueError("OPENAI_API_KEY no configurada. La generacion de respuestas requiere OpenAI.")
+
+        timer.start()
+        generation, estimated_tokens = self._generation_request(query, top_chunks, run_config)
+        limited_openai = self._async_limited_openai
+        completion = await arun_limited(
+            get_rate_limiter(self.answer_model),
+            lambda: limited_openai.chat.completions.with_raw_response.create(**generation),
+            estimated_tokens=estimated_tokens,
+            max_retries=get_settings().openai_max_retries,
+        )
+        answer = self._read_answer(completion, ledger)
+        timer.stop("generate")
+        return self._answer_result(answer, run_config, timer, stage_metrics, top_chunks, top_scores, threshold_triggered)
 
     def answer(self, query: str, incoming_filters: dict[str, Any] | None) -> dict[str, Any]:
         result = self.evaluate(query=query, incoming_filters=incoming_filters, dry_run=False)
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import hashlib
+from collections import Counter
+
+from qdrant_client import models
+
+from app.core.text import word_tokens
+
+
+# Stopwords del espanol (sin tildes: el analizador pliega acentos antes de filtrar).
+STOPWORDS = frozenset(
+    """
+    a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuales cuando de del desde
+    donde durante e el ella ellas ello ellos en entre era eran es esa esas ese eso esos esta estaba estan estar
+    este esto estos fue fueron ha habia han hasta hay la las le les lo los mas me mi mis muy nada ni no nos o
+    otra otras otro otros para pero poco por porque que quien quienes se sea ser si sin sobre son su sus tambien
+    tan te tiene tienen todo todos tu tus un una unas uno unos y ya yo cada cual mismo misma dicho dicha segun
+    puede pueden debe deben sera seran asi aun
+    """.split()
+)
+
+# Sufijos derivacionales, del mas largo al mas corto.
+_SUFFIXES = (
+    "amientos",
+    "imientos",
+    "amiento",
+    "imiento",
+    "aciones",
+    "uciones",
+    "adoras",
+    "adores",
+    "idades",
+    "mente",
+    "acion",
+    "ucion",
+    "adora",
+    "ador",
+    "idad",
+    "ables",
+    "ibles",
+    "able",
+    "ible",
+    "istas",
+    "ista",
+    "ivas",
+    "ivos",
+    "osas",
+    "osos",
+    "iva",
+    "ivo",
+    "osa",
+    "oso",
+)
+
+
+def stem_es(token: str) -> str:
+    """Stemmer ligero para espanol: plural, sufijos derivacionales y vocal final."""
+    if len(token) <= 4 or token.isdigit():
+        return token
+    if token.endswith("es") and len(token) > 5 and token[-3] not in "aeiou":
+        token = token[:-2]
+    elif token.endswith("s"):
+        token = token[:-1]
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            token = token[: -len(suffix)]
+            break
+    if len(token) > 4 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+def analyze(text: str) -> list[str]:
+    """Terminos para BM25: sin tildes, minuscula, sin stopwords, con stemming."""
+    return [stem_es(token) for token in word_tokens(text) if token not in STOPWORDS and len(token) > 1]
+
+
+def term_id(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def _to_sparse(weights: dict[int, float]) -> models.SparseVector:
+    indices = sorted(weights)
+    return models.SparseVector(indices=indices, values=[weights[index] for index in indices])
+
+
+def sparse_document_vector(text: str, avgdl: float, k1: float = 1.2, b: float = 0.75) -> models.SparseVector | None:
+    """
+    Parte TF de BM25 por chunk; el IDF lo aplica Qdrant (`Modifier.IDF`) sobre toda la coleccion,
+    asi que no hay que recalcular pesos al ingerir documentos nuevos.
+    """
+    terms = analyze(text)
+    if not terms:
+        return None
+    length_norm = 1.0 - b + b * (len(terms) / max(avgdl, 1.0))
+    weights: dict[int, float] = {}
+    for term, tf in Counter(terms).items():
+        index = term_id(term)
+        weights[index] = weights.get(index, 0.0) + (tf * (k1 + 1.0)) / (tf + k1 * length_norm)
+    return _to_sparse(weights)
+
+
+def sparse_query_vector(text: str) -> models.SparseVector | None:
+    terms = analyze(text)
+    if not terms:
+        return None
+    return _to_sparse({term_id(term): 1.0 for term in terms})
@@ -1,13 +1,14 @@
 """
 Router para endpoints RAG (Retrieval Augmented Generation).
-Endpoints bajo /v1/ai: rag-ingest, rag-answer.
+Endpoints bajo /v1/ai: rag-ingest, rag-answer, usage.
 """
 import asyncio
 import logging
 import os
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request
 
+from app.ai.usage_ledger import get_usage_aggregator
 from app.schemas.rag_schemas import (
     RagAnswerRequest,
     RagAnswerResponse,
@@ -72,7 +73,13 @@ async def rag_ingest(body: RagIngestRequest, request: Request) -> RagIngestRespo
     """
     request_id = getattr(request.state, "request_id", "unknown")
     correlation_id = getattr(request.state, "correlation_id", request_id)
-    logger.info("[%s][corr:%s] rag_ingest source='%s'", request_id, correlation_id, body.source)
+    logger.info(
+        "[%s][corr:%s] rag_ingest source='%s' tenant='%s'",
+        request_id,
+        correlation_id,
+        body.source,
+        body.tenantId or "",
+    )
 
     try:
         service = get_rag_service()
@@ -81,6 +88,7 @@ async def rag_ingest(body: RagIngestRequest, request: Request) -> RagIngestRespo
             text=body.text,
             title=body.title,
             metadata=body.metadata,
+            tenant_id=body.tenantId,
         )
         return RagIngestResponse(**result)
 
@@ -151,6 +159,22 @@ async def env_check(request: Request):
             "sameSingleton": False,
         }
 
+
+@router.get("/usage")
+async def usage_summary(
+    request: Request,
+    tenant_id: str | None = Query(default=None, alias="tenantId"),
+    source: str | None = Query(default=None),
+    stage: str | None = Query(default=None),
+):
+    """Tokens y costo estimado acumulados en memoria desde el arranque, por tenant/source/etapa/modelo."""
+    request_id = getattr(request.state, "request_id", "unknown")
+    return {
+        "requestId": request_id,
+        **get_usage_aggregator().summary(tenant_id=tenant_id, source=source, stage=stage),
+    }
+
+
 @router.post("/rag-answer", response_model=RagAnswerResponse)
 async def rag_answer(body: RagAnswerRequest, request: Request) -> RagAnswerResponse:
     """
@@ -183,7 +207,12 @@ async def rag_answer(body: RagAnswerRequest, request: Request) -> RagAnswerRespo
     try:
         service = get_rag_service()
         evaluation = await asyncio.wait_for(
-            asyncio.to_thread(service.rag_evaluate, query=resolved_query, filters=(request_filters or None), dry_run=False),
+            service.arag_evaluate(
+                query=resolved_query,
+                filters=(request_filters or None),
+                dry_run=False,
+                correlation_id=str(correlation_id),
+            ),
             timeout=REQUEST_TIMEOUT_SECONDS,
         )
         response_payload = dict(evaluation.get("response", {}))
@@ -16,6 +16,7 @@ class RagIngestRequest(BaseModel):
     title: Optional[str] = Field(default=None, description="Titulo opcional del documento")
     text: str = Field(..., min_length=1, description="Texto completo del documento")
     metadata: Optional[dict[str, Any]] = Field(default=None, description="Metadata adicional")
+    tenantId: Optional[str] = Field(default=None, min_length=1, description="Consultorio dueno; sin tenant es compartido")
 
     model_config = ConfigDict(extra="forbid")
 
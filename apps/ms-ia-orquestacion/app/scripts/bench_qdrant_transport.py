@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import uuid
+from pathlib import Path
+from statistics import mean
+from typing import Any
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+from qdrant_client.conversions.conversion import RestToGrpc
+
+from app.core.config import get_settings
+from app.core.logger import configure_logging, get_logger
+from app.db.qdrant import qdrant_client_options
+
+
+logger = get_logger("ms-ia-orquestacion.bench-qdrant")
+
+_FILLER_TEXT = (
+    "El consultorio juridico atiende asuntos laborales, civiles y de familia dentro de la cuantia "
+    "y competencia fijadas por la ley; los estudiantes actuan bajo supervision de un docente. "
+)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Compara latencia y tamano de payload REST vs gRPC en Qdrant")
+    parser.add_argument("--points", type=int, default=2000, help="Puntos sinteticos a insertar")
+    parser.add_argument("--dim", type=int, default=settings.embedding_dimensions, help="Dimension de los vectores")
+    parser.add_argument("--batch-size", type=int, default=128, help="Puntos por upsert")
+    parser.add_argument("--queries", type=int, default=200, help="Cantidad de query_points por transporte")
+    parser.add_argument("--topk", type=int, default=settings.rag_candidate_topk, help="limit de query_points")
+    parser.add_argument("--with-vectors", action="store_true", help="Pedir vectores en la respuesta (como el rerank MMR)")
+    parser.add_argument("--output", help="Ruta opcional para guardar el resultado en JSON")
+    return parser
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _latency_summary(values_ms: list[float]) -> dict[str, float]:
+    return {
+        "p50Ms": round(_percentile(values_ms, 50), 2),
+        "p95Ms": round(_percentile(values_ms, 95), 2),
+        "p99Ms": round(_percentile(values_ms, 99), 2),
+        "meanMs": round(mean(values_ms), 2) if values_ms else 0.0,
+    }
+
+
+def _random_vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _build_points(vectors: np.ndarray) -> list[models.PointStruct]:
+    return [
+        models.PointStruct(
+            id=idx,
+            vector=vector.tolist(),
+            payload={"source": "bench", "chunkIndex": idx, "chunkText": _FILLER_TEXT * 4},
+        )
+        for idx, vector in enumerate(vectors)
+    ]
+
+
+def _rest_bytes(items: list[Any]) -> int:
+    return sum(len(item.model_dump_json(exclude_none=True)) for item in items)
+
+
+def _bench_transport(
+    name: str,
+    client: QdrantClient,
+    collection_name: str,
+    points: list[models.PointStruct],
+    queries: np.ndarray,
+    batch_size: int,
+    topk: int,
+    with_vectors: bool,
+) -> dict[str, Any]:
+    upsert_ms: list[float] = []
+    for start in range(0, len(points), batch_size):
+        batch = points[start : start + batch_size]
+        started = time.perf_counter()
+        client.upsert(collection_name=collection_name, points=batch, wait=True)
+        upsert_ms.append((time.perf_counter() - started) * 1000)
+
+    for query in queries[:5]:
+        client.query_points(collection_name=collection_name, query=query.tolist(), limit=topk)
+
+    query_ms: list[float] = []
+    for query in queries:
+        started = time.perf_counter()
+        client.query_points(
+            collection_name=collection_name,
+            query=query.tolist(),
+            limit=topk,
+            with_payload=True,
+            with_vectors=with_vectors,
+        )
+        query_ms.append((time.perf_counter() - started) * 1000)
+
+    logger.info("bench_transport_done transport=%s upserts=%d queries=%d", name, len(upsert_ms), len(query_ms))
+    return {
+        "upsert": {"batches": len(upsert_ms), **_latency_summary(upsert_ms)},
+        "queryPoints": {"requests": len(query_ms), **_latency_summary(query_ms)},
+    }
+
+
+def _payload_sizes(
+    client: QdrantClient,
+    collection_name: str,
+    points: list[models.PointStruct],
+    query: np.ndarray,
+    batch_size: int,
+    topk: int,
+    with_vectors: bool,
+) -> dict[str, Any]:
+    """Tamano serializado (JSON vs protobuf) de un batch de upsert y de una respuesta de query_points."""
+    batch = points[:batch_size]
+    response = client.query_points(
+        collection_name=collection_name,
+        query=query.tolist(),
+        limit=topk,
+        with_payload=True,
+        with_vectors=with_vectors,
+    )
+    scored = list(response.points or [])
+    return {
+        "upsertBatchBytes": {
+            "rest": _rest_bytes(batch),
+            "grpc": sum(RestToGrpc.convert_point_struct(point).ByteSize() for point in batch),
+        },
+        "queryResponseBytes": {
+            "rest": _rest_bytes(scored),
+            "grpc": sum(RestToGrpc.convert_scored_point(point).ByteSize() for point in scored),
+        },
+    }
+
+
+def main() -> int:
+    configure_logging()
+    args = _build_parser().parse_args()
+
+    vectors = _random_vectors(args.points, args.dim, seed=7)
+    queries = _random_vectors(args.queries, args.dim, seed=11)
+    points = _build_points(vectors)
+    collection_name = f"bench_transport_{uuid.uuid4().hex[:8]}"
+
+    clients = {
+        "rest": QdrantClient(**qdrant_client_options(prefer_grpc=False)),
+        "grpc": QdrantClient(**qdrant_client_options(prefer_grpc=True)),
+    }
+    admin = clients["rest"]
+    admin.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(size=args.dim, distance=models.Distance.COSINE),
+    )
+    try:
+        report: dict[str, Any] = {
+            "collection": collection_name,
+            "points": args.points,
+            "dim": args.dim,
+            "topk": args.topk,
+            "withVectors": args.with_vectors,
+            "grpcCompression": get_settings().qdrant_grpc_compression,
+            "transports": {},
+        }
+        for name, client in clients.items():
+            report["transports"][name] = _bench_transport(
+                name,
+                client,
+                collection_name,
+                points,
+                queries,
+                batch_size=args.batch_size,
+                topk=args.topk,
+                with_vectors=args.with_vectors,
+            )
+        report["payload"] = _payload_sizes(
+            admin,
+            collection_name,
+            points,
+            queries[0],
+            batch_size=args.batch_size,
+            topk=args.topk,
+            with_vectors=args.with_vectors,
+        )
+    finally:
+        admin.delete_collection(collection_name=collection_name)
+        for client in clients.values():
+            client.close()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,6 +3,7 @@ from __future__ import annotations
 import argparse
 import csv
 import json
+import os
 from datetime import datetime
 from pathlib import Path
 from statistics import mean
@@ -31,6 +32,33 @@ def _parse_thresholds(raw: str) -> list[float]:
     return values
 
 
+def _parse_hnsw_efs(raw: str) -> list[int]:
+    values = [int(part.strip()) for part in raw.split(",") if part.strip()]
+    return values or [0]
+
+
+def _parse_exact_modes(raw: str) -> list[bool | None]:
+    modes: list[bool | None] = []
+    for part in raw.split(","):
+        item = part.strip().lower()
+        if not item:
+            continue
+        if item not in {"auto", "true", "false"}:
+            raise ValueError(f"--exact solo acepta auto,true,false (recibido: '{item}')")
+        modes.append(None if item == "auto" else item == "true")
+    return modes or [None]
+
+
+def _exact_label(exact: bool | None) -> str:
+    return "auto" if exact is None else str(exact).lower()
+
+
+def _recall_vs_exact(used_ids: list[str], exact_ids: list[str] | None) -> float | None:
+    if not exact_ids:
+        return None
+    return round(len(set(used_ids) & set(exact_ids)) / len(exact_ids), 4)
+
+
 def _load_questions(path: Path) -> list[str]:
     data = json.loads(path.read_text(encoding="utf-8"))
     if not isinstance(data, list):
@@ -73,6 +101,8 @@ def _recommend_threshold(summary: list[dict[str, Any]]) -> dict[str, Any]:
     recommendation = float(best["threshold"])
     return {
         "recommendedThreshold": recommendation,
+        "hnswEf": best.get("hnswEf"),
+        "exact": best.get("exact"),
         "reason": (
             "Balance entre mayor tasa de respuestas aceptables y menor tasa de casos sospechosos "
             f"(answerableRate={best['answerableRate']}, suspiciousRate={best['suspiciousRate']}, avgTop1={best['avgTop1Score']})"
@@ -91,6 +121,13 @@ def _build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--dry-run", default="true")
     parser.add_argument("--out-dir", default="app/data/evals")
     parser.add_argument("--questions", default="app/data/evals/questions.json")
+    parser.add_argument("--hnsw-ef", default="0", help="Barrido de hnsw_ef por request, ej. 0,32,64,128 (0 = default del indice)")
+    parser.add_argument("--exact", default="auto", help="Barrido de busqueda exacta: auto,true,false")
+    parser.add_argument(
+        "--retrieval-cache",
+        default="false",
+        help="Usar el cache de retrieval (por defecto no, para medir la latencia real de Qdrant)",
+    )
     return parser
 
 
@@ -101,6 +138,11 @@ def main() -> int:
 
     thresholds = _parse_thresholds(args.thresholds)
     dry_run = _str_to_bool(str(args.dry_run))
+    hnsw_efs = _parse_hnsw_efs(args.hnsw_ef)
+    exact_modes = _parse_exact_modes(args.exact)
+    search_combos = [(hnsw_ef, exact) for hnsw_ef in hnsw_efs for exact in exact_modes]
+    if not _str_to_bool(str(args.retrieval_cache)):
+        os.environ["RAG_RETRIEVAL_CACHE_SIZE"] = "0"
 
     questions_path = Path(args.questions)
     questions = _load_questions(questions_path)
@@ -110,12 +152,24 @@ def main() -> int:
 
     service = get_rag_service()
     rows: list[dict[str, Any]] = []
-    threshold_buckets: dict[float, list[dict[str, Any]]] = {threshold: [] for threshold in thresholds}
+    buckets: dict[tuple[float, int, bool | None], list[dict[str, Any]]] = {
+        (threshold, hnsw_ef, exact): [] for threshold in thresholds for hnsw_ef, exact in search_combos
+    }
+    base_overrides = {
+        "candidate_topk": args.topk,
+        "final_k": args.final_k,
+        "rerank_mode": args.mode,
+        "rerank_enabled": True,
+        "source_filter": args.source if args.source else None,
+        "version_filter": args.version if args.version else None,
+    }
 
     logger.info(
-        "eval_rag start questions=%d thresholds=%s mode=%s topk=%d final_k=%d dry_run=%s source=%s",
+        "eval_rag start questions=%d thresholds=%s hnsw_ef=%s exact=%s mode=%s topk=%d final_k=%d dry_run=%s source=%s",
         len(questions),
         thresholds,
+        hnsw_efs,
+        [_exact_label(exact) for exact in exact_modes],
         args.mode,
         args.topk,
         args.final_k,
@@ -123,20 +177,32 @@ def main() -> int:
         args.source,
     )
 
-    for threshold in thresholds:
+    # Referencia para el recall: los chunks que elige la busqueda exacta (sin generacion).
+    exact_ids: dict[str, list[str] | None] = {}
+    for query in questions:
+        try:
+            baseline = service.rag_evaluate(
+                query=query,
+                filters=None,
+                overrides={**base_overrides, "exact": True, "hnsw_ef": 0, "dry_run": True},
+                dry_run=True,
+            )
+            exact_ids[query] = list(baseline.get("metrics", {}).get("usedChunkIds", []))
+        except Exception as exc:  # pragma: no cover
+            logger.warning("eval_rag exact_baseline_failed query=%s error=%s", query, exc)
+            exact_ids[query] = None
+
+    for (threshold, hnsw_ef, exact), bucket in buckets.items():
         for query in questions:
             try:
                 result = service.rag_evaluate(
                     query=query,
                     filters=None,
                     overrides={
-                        "candidate_topk": args.topk,
-                        "final_k": args.final_k,
+                        **base_overrides,
                         "score_threshold": threshold,
-                        "rerank_mode": args.mode,
-                        "rerank_enabled": True,
-                        "source_filter": args.source if args.source else None,
-                        "version_filter": args.version if args.version else None,
+                        "hnsw_ef": hnsw_ef,
+                        "exact": exact,
                         "dry_run": dry_run,
                     },
                     dry_run=dry_run,
@@ -149,10 +215,16 @@ def main() -> int:
                 answer = str(response.get("answer") or "")
                 answer_length = None if dry_run else len(answer)
                 suspicious = _evaluate_suspicious(answerable, used_chunks_count, answer_length)
+                used_chunk_ids = metrics.get("usedChunkIds", [])
+                search_params = metrics.get("searchParams") or {}
 
                 row = {
                     "query": query,
                     "threshold": threshold,
+                    "hnswEf": hnsw_ef,
+                    "exact": _exact_label(exact),
+                    "exactApplied": search_params.get("exact"),
+                    "recallVsExact": _recall_vs_exact(used_chunk_ids, exact_ids.get(query)),
                     "rerankMode": args.mode,
                     "candidateTopK": args.topk,
                     "finalK": args.final_k,
@@ -167,7 +239,7 @@ def main() -> int:
                     "latencyRerankMs": metrics.get("latencyMs", {}).get("rerank"),
                     "latencyGenerateMs": metrics.get("latencyMs", {}).get("generate"),
                     "usedChunksCount": used_chunks_count,
-                    "usedChunkIds": metrics.get("usedChunkIds", []),
+                    "usedChunkIds": used_chunk_ids,
                     "answerLength": answer_length,
                     "suspicious": suspicious,
                     "error": None,
@@ -176,6 +248,10 @@ def main() -> int:
                 row = {
                     "query": query,
                     "threshold": threshold,
+                    "hnswEf": hnsw_ef,
+                    "exact": _exact_label(exact),
+                    "exactApplied": None,
+                    "recallVsExact": None,
                     "rerankMode": args.mode,
                     "candidateTopK": args.topk,
                     "finalK": args.final_k,
@@ -197,11 +273,10 @@ def main() -> int:
                 }
 
             rows.append(row)
-            threshold_buckets[threshold].append(row)
+            bucket.append(row)
 
     summary: list[dict[str, Any]] = []
-    for threshold in thresholds:
-        bucket = threshold_buckets[threshold]
+    for (threshold, hnsw_ef, exact), bucket in buckets.items():
         total = len(bucket)
         answerable_count = sum(1 for row in bucket if row["answerable"])
         rejected_count = sum(1 for row in bucket if row["thresholdTriggered"])
@@ -209,16 +284,22 @@ def main() -> int:
 
         top1_values = [float(row["top1Score"]) for row in bucket if row["top1Score"] is not None]
         latency_values = [float(row["latencyTotalMs"]) for row in bucket if row["latencyTotalMs"] is not None]
+        retrieval_values = [float(row["latencyRetrievalMs"]) for row in bucket if row["latencyRetrievalMs"] is not None]
+        recall_values = [float(row["recallVsExact"]) for row in bucket if row["recallVsExact"] is not None]
 
         summary.append(
             {
                 "threshold": threshold,
+                "hnswEf": hnsw_ef,
+                "exact": _exact_label(exact),
                 "queries": total,
                 "answerableRate": round(answerable_count / total, 4) if total else 0.0,
                 "rejectedCount": rejected_count,
                 "suspiciousRate": round(suspicious_count / total, 4) if total else 0.0,
                 "avgTop1Score": round(mean(top1_values), 4) if top1_values else None,
                 "avgLatencyMs": round(mean(latency_values), 2) if latency_values else None,
+                "avgRetrievalMs": round(mean(retrieval_values), 2) if retrieval_values else None,
+                "avgRecallVsExact": round(mean(recall_values), 4) if recall_values else None,
             }
         )
 
@@ -231,6 +312,8 @@ def main() -> int:
         "generatedAt": datetime.now().isoformat(),
         "config": {
             "thresholds": thresholds,
+            "hnswEf": hnsw_efs,
+            "exact": [_exact_label(exact) for exact in exact_modes],
             "mode": args.mode,
             "topk": args.topk,
             "finalK": args.final_k,
@@ -248,6 +331,10 @@ def main() -> int:
     csv_columns = [
         "query",
         "threshold",
+        "hnswEf",
+        "exact",
+        "exactApplied",
+        "recallVsExact",
         "rerankMode",
         "candidateTopK",
         "finalK",
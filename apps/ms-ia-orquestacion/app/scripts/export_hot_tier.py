@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+
+from app.core.config import get_settings
+from app.core.logger import configure_logging, get_logger
+from app.db.qdrant import get_qdrant_client
+from app.rag.hot_tier import export_hot_tier
+
+
+logger = get_logger("ms-ia-orquestacion.hot-tier.cli")
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Exporta la coleccion Qdrant a un bundle memmap para el hot tier")
+    parser.add_argument("--collection", type=str, default=settings.qdrant_collection, help="Coleccion a exportar")
+    parser.add_argument("--out", type=str, default=settings.hot_tier_dir, help="Directorio raiz de bundles")
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default=settings.hot_tier_dtype,
+        choices=["float16", "float32"],
+        help="Precision de la matriz de vectores",
+    )
+    return parser
+
+
+def main() -> int:
+    configure_logging()
+    args = _build_parser().parse_args()
+
+    try:
+        manifest = export_hot_tier(
+            client=get_qdrant_client(),
+            collection_name=args.collection,
+            root_dir=args.out,
+            dtype=args.dtype,
+        )
+        print(json.dumps(manifest, ensure_ascii=True, indent=2))
+        return 0
+
+    except Exception as exc:
+        logger.exception("hot_tier_export_failed: %s", exc)
+        print(json.dumps({"error": str(exc)}, ensure_ascii=True, indent=2))
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
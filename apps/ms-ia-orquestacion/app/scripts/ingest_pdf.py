@@ -34,9 +34,11 @@ def _build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--chunk-size", type=int, default=None, help="Tamano de chunk en caracteres")
     parser.add_argument("--overlap", type=int, default=None, help="Overlap de chunk en caracteres")
     parser.add_argument("--batch-size", type=int, default=None, help="Tamano de batch para embeddings")
+    parser.add_argument("--concurrency", type=int, default=None, help="Batches de embeddings en vuelo en paralelo")
     parser.add_argument("--version", type=str, default=None, help="Version logica del documento")
     parser.add_argument("--dry-run", action="store_true", help="No inserta en Qdrant, solo calcula reporte")
     parser.add_argument("--replace-source", action="store_true", help="Elimina docs previos del mismo source antes de ingestar")
+    parser.add_argument("--tenant-id", type=str, default=None, help="Consultorio dueno del documento (sin tenant: compartido)")
     return parser
 
 
@@ -58,16 +60,20 @@ def main() -> int:
             dry_run=args.dry_run,
             version=args.version,
             replace_source=args.replace_source,
+            concurrency=args.concurrency,
+            tenant_id=args.tenant_id,
         )
 
         logger.info(
-            "ingest_cli env=%s file=%s source=%s chunk_size=%d overlap=%d batch_size=%d dry_run=%s replace_source=%s",
+            "ingest_cli env=%s file=%s source=%s tenant=%s chunk_size=%d overlap=%d batch_size=%d concurrency=%d dry_run=%s replace_source=%s",
             settings.env_path,
             options.file_path,
             options.source,
+            options.tenant_id,
             options.chunk_size,
             options.overlap,
             options.batch_size,
+            options.concurrency,
             options.dry_run,
             options.replace_source,
         )
@@ -1,5 +1,69 @@
-from app.rag.reranker import rerank_cosine, should_reject_by_threshold
-from app.rag.retriever import ChunkCandidate
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from array import array
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import replace
+from pathlib import Path
+
+import grpc
+import httpx
+from openai import RateLimitError
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from app.ai import embeddings as embeddings_module
+from app.ai.embedding_provider import HashingEmbeddingProvider, get_embedding_provider
+from app.ai.embedding_store import EmbeddingStore, hash_text
+from app.ai.embeddings import _pack_batches
+from app.ai.query_batcher import AsyncEmbeddingMicroBatcher, EmbeddingMicroBatcher
+from app.ai.rate_limiter import AdaptiveRateLimiter, run_limited
+from app.ai.usage_ledger import UsageAggregator, UsageLedger, estimate_cost_usd
+from app.core.cache import TTLCache
+from app.core.config import get_settings
+from app.db.embedded import bootstrap_embedded_storage, open_embedded_client
+from app.db import qdrant as qdrant_module
+from app.db.qdrant import _ensure_collection, _migrate_storage_profile, collection_for_tenant, qdrant_client_options
+from app.ingest import ingest_service as ingest_module
+from app.db.replicas import Replica, ReplicaPool, ReplicatedQdrantClient
+from app.rag.hot_tier import HotTierIndex, HotTierStore, export_hot_tier
+from app.rag.legal_refs import extract_legal_refs, is_citation_only, legal_ref_keys
+from app.rag.query_expansion import rule_variants
+from app.rag.reranker import rerank_cosine, rerank_mmr, should_reject_by_threshold
+from app.rag.service import PipelineRunConfig, RetrievalPipelineService, _parse_exact
+from app.rag.retrieval_cache import CollectionGenerations, RetrievalCache, get_collection_generations
+from app.rag.retriever import (
+    CANDIDATE_PAYLOAD_FIELDS,
+    ChunkCandidate,
+    build_fused_requests,
+    build_query_request,
+    collapse_versions,
+    has_legacy_points,
+    hydrate_candidates,
+    points_to_candidates,
+    retrieve_candidates,
+)
+from app.rag.sparse import analyze, sparse_document_vector, sparse_query_vector, stem_es, term_id
+
+
+@contextmanager
+def _settings_env(**values: str) -> Iterator[None]:
+    """Variables de entorno solo durante el bloque; `get_settings` se relee al entrar y al salir."""
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    get_settings.cache_clear()
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        get_settings.cache_clear()
 
 
 def test_rerank_cosine_order() -> None:
@@ -36,14 +100,956 @@ def test_rerank_cosine_order() -> None:
     assert ranked[0].chunk_id == "a", "rerank_cosine no priorizo la similitud esperada"
 
 
+def test_cosine_rerank_without_vectors_matches() -> None:
+    query = [0.6, 0.8, 0.0]
+    vectors = {"a": [0.6, 0.8, 0.0], "b": [0.0, 0.6, 0.8], "c": [1.0, 0.0, 0.0], "d": [0.8, 0.6, 0.0]}
+
+    def candidates(with_vectors: bool) -> list[ChunkCandidate]:
+        # Como en Qdrant: el score de retrieval ya es el coseno con la pregunta.
+        return [
+            ChunkCandidate(
+                chunk_id=chunk_id,
+                source="s",
+                version="v1",
+                title="",
+                chunk_index=0,
+                text=chunk_id,
+                metadata={},
+                mongo_score=sum(x * y for x, y in zip(query, vector)),
+                embedding=vector if with_vectors else None,
+                page_start=None,
+                page_end=None,
+            )
+            for chunk_id, vector in vectors.items()
+        ]
+
+    with_vectors = rerank_cosine(query, candidates(True), top_k=3)
+    without_vectors = rerank_cosine(query, candidates(False), top_k=3)
+    assert [c.chunk_id for c in with_vectors] == [c.chunk_id for c in without_vectors] == ["a", "d", "c"]
+    assert all(abs(x.rerank_score - y.rerank_score) < 1e-6 for x, y in zip(with_vectors, without_vectors))
+
+
+def test_mmr_skips_near_duplicates() -> None:
+    def candidate(chunk_id: str, score: float, embedding: list[float]) -> ChunkCandidate:
+        return ChunkCandidate(
+            chunk_id=chunk_id,
+            source="s",
+            version="v1",
+            title="",
+            chunk_index=0,
+            text=chunk_id,
+            metadata={},
+            mongo_score=score,
+            embedding=embedding,
+            page_start=None,
+            page_end=None,
+        )
+
+    query = [1.0, 0.0, 0.0]
+    candidates = [
+        candidate("a", 0.90, [0.9, 0.1, 0.0]),
+        candidate("a_overlap", 0.89, [0.9, 0.11, 0.0]),
+        candidate("b", 0.80, [0.5, 0.0, 0.866]),
+        candidate("c", 0.40, [0.0, 1.0, 0.0]),
+    ]
+    by_relevance = rerank_cosine(query, candidates, top_k=3)
+    assert [c.chunk_id for c in by_relevance] == ["a", "a_overlap", "b"]
+    diverse = rerank_mmr(by_relevance + [candidates[3]], top_k=3, mmr_lambda=0.6)
+    assert [c.chunk_id for c in diverse][:2] == ["a", "b"], "MMR no debe repetir el chunk casi identico"
+    # El score para el umbral sigue siendo la relevancia, no el score MMR.
+    assert diverse[0].rerank_score == by_relevance[0].rerank_score
+    assert [c.chunk_id for c in rerank_mmr(by_relevance, top_k=2, mmr_lambda=1.0)] == ["a", "a_overlap"]
+
+
 def test_threshold_gate() -> None:
     assert should_reject_by_threshold(0.5, 0.72) is True
     assert should_reject_by_threshold(0.9, 0.72) is False
 
 
+def _pipeline(
+    client: QdrantClient,
+    collection_name: str = "docs",
+    async_client: AsyncQdrantClient | None = None,
+) -> RetrievalPipelineService:
+    return RetrievalPipelineService(
+        qdrant_client=client,
+        qdrant_collection=collection_name,
+        openai_client=None,
+        embedding_model="hashing",
+        answer_model="gpt-4.1-mini",
+        embedding_provider=HashingEmbeddingProvider(dimensions=16),
+        async_qdrant_client=async_client,
+    )
+
+
+def test_threshold_uses_best_score_under_fused_order() -> None:
+    def candidate(chunk_id: str, cosine: float, fused: float) -> ChunkCandidate:
+        return ChunkCandidate(
+            chunk_id=chunk_id,
+            source="s",
+            version="v1",
+            title="t",
+            chunk_index=0,
+            text=chunk_id,
+            metadata={},
+            mongo_score=cosine,
+            embedding=None,
+            page_start=None,
+            page_end=None,
+            rerank_score=cosine,
+            fusion_score=fused,
+        )
+
+    # Orden RRF: el primero tiene menos coseno que el segundo.
+    ranked = [candidate("a", 0.0607, 0.033), candidate("b", 0.1565, 0.032)]
+    run_config = PipelineRunConfig(
+        candidate_topk=10,
+        final_k=2,
+        score_threshold=0.1,
+        rerank_mode="cosine",
+        rerank_enabled=True,
+        temperature=0.0,
+        source_filter=None,
+        version_filter=None,
+        dry_run=True,
+    )
+    with _settings_env(RAG_QUERY_BATCH_WINDOW_MS="0"):
+        pipeline = _pipeline(QdrantClient(":memory:"))
+    top_chunks, top_scores, threshold_triggered = pipeline._select_top(ranked, run_config, 0.0)
+    assert [chunk.chunk_id for chunk in top_chunks] == ["a", "b"], "El orden fusionado se conserva"
+    assert top_scores == [0.0607, 0.1565]
+    assert not threshold_triggered, "El umbral debe evaluarse sobre el mejor coseno, no sobre el primero"
+    assert should_reject_by_threshold(0.0607, run_config.score_threshold), "Con top_scores[0] se habria rechazado"
+
+
+def test_async_evaluate_matches_sync() -> None:
+    provider = HashingEmbeddingProvider(dimensions=16)
+    texts = [
+        "la liquidacion del contrato de trabajo incluye cesantias y prima",
+        "el fuero de maternidad protege a la trabajadora en embarazo",
+        "la jornada maxima legal es de cuarenta y siete horas semanales",
+        "la conciliacion extrajudicial en derecho es requisito de procedibilidad",
+    ]
+    points = [
+        models.PointStruct(
+            id=idx,
+            vector=vector,
+            payload={"source": "consultorio", "version": "v1", "title": "Guia", "chunkIndex": idx, "chunkText": text},
+        )
+        for idx, (text, vector) in enumerate(zip(texts, provider.embed(texts)))
+    ]
+    vectors_config = models.VectorParams(size=16, distance=models.Distance.COSINE)
+    client = QdrantClient(":memory:")
+    client.create_collection("docs", vectors_config=vectors_config)
+    client.upsert("docs", points=points)
+    async_client = AsyncQdrantClient(":memory:")
+
+    async def _aevaluate(pipeline: RetrievalPipelineService, queries: list[str]) -> list[dict]:
+        await async_client.create_collection("docs", vectors_config=vectors_config)
+        await async_client.upsert("docs", points=points)
+        return await asyncio.gather(*[pipeline.aevaluate(query, None, overrides, dry_run=True) for query in queries])
+
+    queries = ["liquidacion del contrato", "fuero de maternidad", "jornada maxima"]
+    overrides = {"score_threshold": 0.0, "final_k": 2, "rerank_mode": "cosine"}
+    with _settings_env(RAG_QUERY_BATCH_WINDOW_MS="2"):
+        # Pipelines separados: el segundo no debe resolver nada desde los caches del primero.
+        sync_results = [_pipeline(client).evaluate(query, None, overrides, dry_run=True) for query in queries]
+        async_pipeline = _pipeline(QdrantClient(":memory:"), async_client=async_client)
+        async_results = asyncio.run(_aevaluate(async_pipeline, queries))
+
+    for sync_result, async_result in zip(sync_results, async_results):
+        assert async_result["response"] == sync_result["response"]
+        assert async_result["metrics"]["top5Scores"] == sync_result["metrics"]["top5Scores"]
+    assert async_pipeline.runtime_stats()["asyncQueryEmbedBatcher"]["requests"] == len(queries)
+
+
+def test_exact_search_resolution() -> None:
+    assert [_parse_exact(value) for value in ("auto", "", None, "true", "false", True)] == [
+        None,
+        None,
+        None,
+        True,
+        False,
+        True,
+    ]
+    pipeline = _pipeline(QdrantClient(":memory:"))
+    auto = replace(pipeline._default_run_config(dry_run=True), exact=None)
+
+    # Por defecto el modo automatico esta apagado: ni count extra ni busqueda exacta.
+    metrics: dict = {}
+    assert not pipeline._needs_filtered_count(auto)
+    pipeline._search_params(auto, None, metrics)
+    assert metrics["searchParams"]["exact"] is False
+
+    with _settings_env(RAG_EXACT_MAX_POINTS="100"):
+        assert pipeline._needs_filtered_count(auto)
+        pipeline._search_params(auto, 40, metrics)
+        assert (metrics["searchParams"]["exact"], metrics["searchParams"]["exactReason"]) == (True, "small_subset")
+        pipeline._search_params(auto, 400, metrics)
+        assert metrics["searchParams"]["exact"] is False
+
+        forced = replace(auto, exact=True)
+        assert not pipeline._needs_filtered_count(forced)
+        params = pipeline._search_params(forced, None, metrics)
+        assert params is not None and params.exact and metrics["searchParams"]["exactReason"] == "forced"
+
+        disabled = replace(auto, exact=False)
+        assert not pipeline._needs_filtered_count(disabled)
+        pipeline._search_params(disabled, 40, metrics)
+        assert metrics["searchParams"]["exact"] is False
+
+
+def test_embedding_batches_respect_token_budget() -> None:
+    batches = _pack_batches([400, 400, 300, 900, 10, 10, 10], max_items=2, max_tokens=1000)
+    assert batches == [[0, 1], [2], [3, 4], [5, 6]], "_pack_batches no respeto el presupuesto de tokens/items"
+
+
+def test_parallel_embedding_batches_keep_order_and_persist() -> None:
+    class SlowFirstProvider(HashingEmbeddingProvider):
+        def __init__(self) -> None:
+            super().__init__(dimensions=16)
+            self.threads: set[str] = set()
+
+        def embed_with_usage(self, texts, estimated_tokens=None, max_retries=0):
+            self.threads.add(threading.current_thread().name)
+            # Los primeros batches terminan ultimos: el orden de salida no puede depender de quien termina antes.
+            time.sleep(0.05 if texts[0].endswith(" 0") else 0.0)
+            return super().embed_with_usage(texts)
+
+    provider = SlowFirstProvider()
+    texts = [f"inciso {idx % 7} numeral {idx}" for idx in range(50)]
+    persisted: list[tuple[list[str], list[list[float]]]] = []
+    lock = threading.Lock()
+
+    def on_batch(batch: list[str], vectors: list[list[float]]) -> None:
+        with lock:
+            persisted.append((batch, vectors))
+
+    vectors = embeddings_module._embed_uncached(
+        provider, texts, batch_size=8, retries=0, concurrency=4, on_batch=on_batch
+    )
+    expected = HashingEmbeddingProvider(dimensions=16).embed(texts)
+    assert vectors == expected
+    assert len(provider.threads) > 1, "Con concurrency=4 los batches deben repartirse entre hilos"
+    assert len(persisted) == 7 and sorted(len(batch) for batch, _ in persisted) == [2] + [8] * 6
+    by_text = dict(zip(texts, expected))
+    for batch, batch_vectors in persisted:
+        assert batch_vectors == [by_text[text] for text in batch], "on_batch recibe cada texto con su vector"
+
+
+def test_embedding_store_roundtrip_and_dedup() -> None:
+    class CountingProvider(HashingEmbeddingProvider):
+        def __init__(self) -> None:
+            super().__init__(dimensions=16)
+            self.embedded: list[str] = []
+
+        def embed_with_usage(self, texts, estimated_tokens=None, max_retries=0):
+            self.embedded.extend(texts)
+            return super().embed_with_usage(texts)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = EmbeddingStore(Path(tmp), "hashing/test", 4)
+        store.put_many({hash_text("a"): [0.1, -2.5, 1e-8, 3.0]})
+        # float32: 0.1 vuelve con el redondeo de 4 bytes, no como el float64 original.
+        assert store.get_many([hash_text("a")])[hash_text("a")] == array("f", [0.1, -2.5, 1e-8, 3.0]).tolist()
+        store.put_many({hash_text("corto"): [1.0, 2.0]})
+        assert store.get_many([hash_text("corto")]) == {}, "Un blob con otra dimension no debe devolverse"
+
+        provider = CountingProvider()
+        texts = [f"articulo {idx} del codigo sustantivo" for idx in range(620)]
+        requested = texts + texts[:40]
+        original_provider, original_store = embeddings_module.get_embedding_provider, embeddings_module.get_embedding_store
+        embeddings_module.get_embedding_provider = lambda: provider
+        embeddings_module.get_embedding_store = lambda model, dimensions: EmbeddingStore(Path(tmp), model, dimensions)
+        try:
+            first = embeddings_module.embed_texts(requested, batch_size=128, concurrency=1)
+            assert sorted(provider.embedded) == sorted(texts), "Los textos repetidos se embeben una sola vez"
+            assert first[620:] == first[:40]
+
+            provider.embedded.clear()
+            second = embeddings_module.embed_texts(requested, batch_size=128, concurrency=1)
+            # 620 hashes > 500: la lectura va en varios IN (...) y aun asi todo sale del store.
+            assert provider.embedded == [], "La segunda pasada debe salir completa del store"
+            assert second == first
+        finally:
+            embeddings_module.get_embedding_provider = original_provider
+            embeddings_module.get_embedding_store = original_store
+
+
+def test_rate_limiter_backs_off_on_429_and_recovers() -> None:
+    class RawResponse:
+        headers: dict[str, str] = {}
+
+        def parse(self) -> str:
+            return "ok"
+
+    def rate_limited() -> RawResponse:
+        request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+        response = httpx.Response(429, headers={"retry-after-ms": "150"}, request=request)
+        raise RateLimitError("rate limited", response=response, body=None)
+
+    limiter = AdaptiveRateLimiter("test", rpm_limit=0, tpm_limit=0, max_concurrency=8)
+    try:
+        run_limited(limiter, rate_limited, estimated_tokens=10, max_retries=0)
+    except RateLimitError:
+        pass
+    else:
+        raise AssertionError("Sin reintentos el 429 debe propagarse")
+    snapshot = limiter.snapshot()
+    assert snapshot["rateLimited"] == 1 and snapshot["inFlight"] == 0
+    assert snapshot["concurrency"] == 4.0, "Un 429 debe bajar la concurrencia a la mitad"
+    assert 0.1 < snapshot["cooldownS"] <= 0.15, "El cooldown debe salir del header Retry-After"
+
+    started = time.perf_counter()
+    assert run_limited(limiter, RawResponse, estimated_tokens=10, max_retries=0) == "ok"
+    assert time.perf_counter() - started >= 0.1, "La siguiente llamada debe esperar el cooldown"
+    assert limiter.snapshot()["concurrency"] == 4.25, "Cada exito suma 1/concurrencia"
+    for _ in range(40):
+        run_limited(limiter, RawResponse, estimated_tokens=10, max_retries=0)
+    assert limiter.snapshot()["concurrency"] == 8.0, "La recuperacion aditiva no debe pasar del maximo"
+
+
+def test_hashing_provider_is_deterministic() -> None:
+    provider = HashingEmbeddingProvider(dimensions=64)
+    first, similar, other = provider.embed(
+        ["Liquidación de prestaciones sociales", "liquidacion de prestaciones", "fuero de maternidad"]
+    )
+    assert len(first) == 64
+    assert first == HashingEmbeddingProvider(dimensions=64).embed(["Liquidación de prestaciones sociales"])[0]
+
+    def _dot(a: list[float], b: list[float]) -> float:
+        return sum(x * y for x, y in zip(a, b))
+
+    assert _dot(first, similar) > _dot(first, other), "HashingEmbeddingProvider no preserva similitud lexica"
+
+
+def test_query_batcher_coalesces_concurrent_requests() -> None:
+    class CountingProvider(HashingEmbeddingProvider):
+        def __init__(self) -> None:
+            super().__init__(dimensions=16)
+            self.calls: list[list[str]] = []
+
+        def embed_with_usage(self, texts, estimated_tokens=None, max_retries=0):
+            self.calls.append(list(texts))
+            return super().embed_with_usage(texts)[0], 60
+
+    provider = CountingProvider()
+    batcher = EmbeddingMicroBatcher(provider, window_ms=50, max_batch=8, max_retries=0)
+    texts = ["aa", "bbbb", "aa", "cccccc", "bbbb"]
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        results = list(pool.map(batcher.embed, texts))
+
+    assert len(provider.calls) == 1, "Los textos de la ventana deben salir en una sola llamada"
+    assert sorted(provider.calls[0]) == ["aa", "bbbb", "cccccc"], "Los repetidos se embeben una sola vez"
+    expected = dict(zip(["aa", "bbbb", "cccccc"], HashingEmbeddingProvider(dimensions=16).embed(["aa", "bbbb", "cccccc"])))
+    assert [vector for vector, _ in results] == [expected[text] for text in texts], "Cada espera recibe su vector"
+    # 60 tokens por largo (2/4/6 de 12 caracteres) y, entre repetidos, en partes iguales.
+    assert [tokens for _, tokens in results] == [5, 10, 5, 30, 10] and sum(t for _, t in results) == 60
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["inputs"] == 3
+
+
+def test_async_query_batcher_flushes_on_event_loop() -> None:
+    class AsyncCountingProvider(HashingEmbeddingProvider):
+        def __init__(self) -> None:
+            super().__init__(dimensions=16)
+            self.async_calls: list[list[str]] = []
+
+        def embed_with_usage(self, texts, estimated_tokens=None, max_retries=0):
+            raise AssertionError("El batcher async no debe usar el cliente bloqueante")
+
+        async def aembed_with_usage(self, texts, estimated_tokens=None, max_retries=0):
+            self.async_calls.append(list(texts))
+            return HashingEmbeddingProvider.embed_with_usage(self, texts)[0], 30
+
+    provider = AsyncCountingProvider()
+    batcher = AsyncEmbeddingMicroBatcher(provider, window_ms=20, max_batch=8, max_retries=0)
+
+    async def run() -> list[tuple[list[float], int]]:
+        return await asyncio.gather(*(batcher.embed(text) for text in ["cesantias", "prima", "cesantias"]))
+
+    results = asyncio.run(run())
+    assert provider.async_calls == [["cesantias", "prima"]], provider.async_calls
+    assert results[0][0] == results[2][0] == HashingEmbeddingProvider(dimensions=16).embed(["cesantias"])[0]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["requests"] == 3
+    # Un asyncio.run nuevo (otro loop) sigue funcionando.
+    assert len(asyncio.run(run())) == 3 and len(provider.async_calls) == 2
+
+
+def test_usage_ledger_aggregates_by_stage() -> None:
+    ledger = UsageLedger(correlation_id="corr-1", source="ley-100", tenant_id="t1")
+    ledger.record("embed", "text-embedding-3-small", prompt_tokens=12)
+    ledger.record("generate", "gpt-4.1-mini", prompt_tokens=1000, completion_tokens=200, cached_tokens=400)
+    ledger.record_latency({"embed": 5.0, "retrieval": 12.0, "generate": 800.0, "total": 817.0})
+
+    report = ledger.to_dict()
+    assert report["totals"]["promptTokens"] == 1012
+    assert report["stages"]["retrieval"]["calls"] == 0
+    assert report["stages"]["generate"]["estimatedCostUsd"] == estimate_cost_usd("gpt-4.1-mini", 1000, 200, 400)
+
+    aggregator = UsageAggregator()
+    aggregator.add(ledger)
+    aggregator.add(ledger)
+    summary = aggregator.summary(tenant_id="t1", stage="generate")
+    assert summary["requests"] == 2
+    assert len(summary["rows"]) == 1
+    assert summary["rows"][0]["completionTokens"] == 400
+
+
+def test_spanish_sparse_analyzer() -> None:
+    assert analyze("Las cesantías del trabajador") == analyze("cesantias trabajadores")
+    assert "de" not in analyze("fuero de maternidad")
+
+    document = sparse_document_vector("preaviso preaviso fuero", avgdl=120.0)
+    query = sparse_query_vector("¿Qué es el preaviso?")
+    assert document is not None and query is not None
+    assert query.indices == [term_id(stem_es("preaviso"))]
+    assert set(query.indices) <= set(document.indices)
+    weights = dict(zip(document.indices, document.values))
+    assert weights[query.indices[0]] > weights[term_id(stem_es("fuero"))], "BM25 TF no satura por frecuencia"
+
+
+def test_hot_tier_exact_search_with_filters() -> None:
+    client = QdrantClient(":memory:")
+    client.create_collection("hot", vectors_config=models.VectorParams(size=3, distance=models.Distance.COSINE))
+    client.upsert(
+        "hot",
+        points=[
+            models.PointStruct(id=1, vector=[1.0, 0.0, 0.0], payload={"source": "a", "chunkText": "uno", "chunkIndex": 0}),
+            models.PointStruct(id=2, vector=[0.9, 0.1, 0.0], payload={"source": "b", "chunkText": "dos", "chunkIndex": 1}),
+            models.PointStruct(id=3, vector=[0.0, 1.0, 0.0], payload={"source": "a", "chunkText": "tres", "chunkIndex": 2}),
+        ],
+    )
+    with tempfile.TemporaryDirectory() as root:
+        manifest = export_hot_tier(client, "hot", root, dtype="float32")
+        index = HotTierIndex(Path(root) / manifest["bundle"])
+
+        ranked = index.search([1.0, 0.0, 0.0], topk=2, filters=None, include_embedding=False)
+        assert [c.chunk_id for c in ranked] == ["1", "2"]
+        filtered = index.search([1.0, 0.0, 0.0], topk=2, filters={"source": "a"}, include_embedding=True)
+        assert [c.text for c in filtered] == ["uno", "tres"]
+        assert filtered[0].embedding == [1.0, 0.0, 0.0]
+        assert not index.supports({"docName": "d1"})
+
+
+def test_hot_tier_skips_stale_or_foreign_bundles() -> None:
+    client = QdrantClient(":memory:")
+    client.create_collection("hot", vectors_config=models.VectorParams(size=3, distance=models.Distance.COSINE))
+    client.upsert("hot", points=[models.PointStruct(id=1, vector=[1.0, 0.0, 0.0], payload={"chunkText": "uno"})])
+    with (
+        tempfile.TemporaryDirectory() as root,
+        tempfile.TemporaryDirectory() as gen_root,
+        _settings_env(RAG_EMBED_PROVIDER="hashing", RAG_EMBED_DIM="3"),
+    ):
+        generations = CollectionGenerations(gen_root, refresh_s=0)
+        exported_at = generations.bump("hot")
+        manifest = export_hot_tier(client, "hot", root, dtype="float32", generations=generations)
+        model = HashingEmbeddingProvider(dimensions=3).model
+        assert manifest["embeddingModel"] == model and manifest["generation"] == exported_at
+
+        store = HotTierStore(root, reload_s=0, expected_dim=3, expected_model=model, generations=generations)
+        assert store.get() is not None and not store.stats()["stale"]
+
+        # Una ingesta posterior sube la generacion: el bundle queda viejo y se vuelve a Qdrant.
+        ingested_at = generations.bump("hot")
+        assert store.get() is None and store.stats()["stale"]
+        export_hot_tier(client, "hot", root, dtype="float32", generations=generations)
+        index = store.get()
+        assert index is not None and index.generation == ingested_at
+
+        # Un bundle exportado con otro modelo de embeddings no se sirve aunque coincida la dimension.
+        other = HotTierStore(root, reload_s=0, expected_dim=3, expected_model="text-embedding-3-large")
+        assert other.get() is None
+
+
+def test_ttl_cache_hit_expiry_and_lru() -> None:
+    cache: TTLCache[int] = TTLCache(maxsize=2, ttl_s=0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # "a" se uso hace poco: sale "b", el menos reciente
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.peek("a") == 1 and cache.peek("zz") is None
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 1 and stats["size"] == 2
+
+    expiring: TTLCache[int] = TTLCache(maxsize=4, ttl_s=0.05)
+    expiring.set("a", 1)
+    assert expiring.get("a") == 1
+    time.sleep(0.1)
+    assert expiring.peek("a") is None and expiring.stats()["size"] == 0
+
+    # Las variantes de multi-query no cuentan en el hit rate de la pregunta original.
+    pipeline = _pipeline(QdrantClient(":memory:"))
+    pipeline._embed_query("que es una tutela")
+    before = pipeline.runtime_stats()["queryEmbedCache"]
+    _, vectors, missing = pipeline._cached_variant_embeddings(["que es una tutela", "tutela definicion"])
+    assert vectors[0] is not None and missing == [1]
+    after = pipeline.runtime_stats()["queryEmbedCache"]
+    assert (after["hits"], after["misses"]) == (before["hits"], before["misses"])
+
+
+def test_two_phase_hydration_keeps_order_and_scores() -> None:
+    class CountingClient(QdrantClient):
+        def __init__(self) -> None:
+            super().__init__(":memory:")
+            self.retrieved: list[list] = []
+
+        def retrieve(self, collection_name, ids, **kwargs):
+            self.retrieved.append(list(ids))
+            return super().retrieve(collection_name, ids, **kwargs)
+
+    provider = HashingEmbeddingProvider(dimensions=16)
+    texts = ["despido sin justa causa", "indemnizacion por despido", "periodo de prueba", "vacaciones anuales"]
+    client = CountingClient()
+    client.create_collection("docs", vectors_config=models.VectorParams(size=16, distance=models.Distance.COSINE))
+    client.upsert(
+        "docs",
+        points=[
+            models.PointStruct(
+                id=idx,
+                vector=vector,
+                payload={"source": "cst", "chunkIndex": idx, "chunkText": text, "metadata": {"articulo": 60 + idx}},
+            )
+            for idx, (text, vector) in enumerate(zip(texts, provider.embed(texts)))
+        ],
+    )
+    points = client.query_points(
+        "docs", query=provider.embed(["despido"])[0], limit=4, with_payload=CANDIDATE_PAYLOAD_FIELDS
+    ).points
+    candidates = points_to_candidates(points, include_embedding=False, hydrated=False)
+    assert all(candidate.text == "" and not candidate.hydrated for candidate in candidates)
+
+    # El rerank reordena y puntua antes de hidratar; solo los finales piden texto.
+    final = list(reversed(candidates))[:3]
+    for rank, candidate in enumerate(final):
+        candidate.rerank_score = 0.9 - rank * 0.1
+    final[1].hydrated = True
+    expected = [(candidate.chunk_id, candidate.mongo_score, candidate.rerank_score) for candidate in final]
+
+    hydrate_candidates(client, "docs", final)
+    assert [(candidate.chunk_id, candidate.mongo_score, candidate.rerank_score) for candidate in final] == expected
+    assert len(client.retrieved) == 1 and len(client.retrieved[0]) == 2, "Un solo retrieve, sin los ya hidratados"
+    for candidate in (final[0], final[2]):
+        idx = int(candidate.chunk_id)
+        assert candidate.hydrated and candidate.text == texts[idx] and candidate.metadata == {"articulo": 60 + idx}
+    assert final[1].text == ""
+
+    hydrate_candidates(client, "docs", final)
+    assert len(client.retrieved) == 1, "Con todo hidratado no hay otra llamada"
+
+
+def test_retrieval_cache_invalidated_by_generation() -> None:
+    with tempfile.TemporaryDirectory() as root:
+        generations = CollectionGenerations(root, refresh_s=0)
+        cache = RetrievalCache(maxsize=8, ttl_s=0, generations=generations)
+        request = {
+            "collection_name": "docs",
+            "query_embedding": [0.1, 0.2, 0.3],
+            "topk": 5,
+            "filters": {"version": "v1", "source": "s"},
+            "include_embedding": False,
+        }
+        candidate = ChunkCandidate(
+            chunk_id="a",
+            source="s",
+            version="v1",
+            title="",
+            chunk_index=0,
+            text="uno",
+            metadata={},
+            mongo_score=0.5,
+            embedding=None,
+            page_start=None,
+            page_end=None,
+        )
+        cache.set(request, [candidate], cache.generation("docs"))
+
+        hit = cache.get({**request, "filters": {"source": "s", "version": "v1"}})
+        assert hit is not None and hit[0].text == "uno"
+        hit[0].rerank_score = 0.9
+        assert cache.get(request)[0].rerank_score is None, "El cache debe devolver copias"
+
+        # Otro proceso (ingest_pdf) incrementa la generacion a traves del archivo.
+        CollectionGenerations(root).bump("docs")
+        assert cache.get(request) is None
+        stats = cache.stats()
+        assert stats["hits"] == 2 and stats["stale"] == 1 and stats["misses"] == 1
+
+        # Con refresh_s el archivo no se relee en cada llamada; el bump propio se ve enseguida.
+        cached = CollectionGenerations(root, refresh_s=60)
+        reads: list[str] = []
+        read_file = cached._read_file
+        cached._read_file = lambda name: reads.append(name) or read_file(name)
+        seen = cached.current("docs")
+        assert [cached.current("docs") for _ in range(3)] == [seen] * 3 and reads == ["docs"]
+        external = CollectionGenerations(root).bump("docs")
+        assert cached.current("docs") == seen, "Dentro de refresh_s no hay IO"
+        assert cached.bump("docs") > external and reads == ["docs"]
+        assert generations.current("docs") == cached.current("docs")
+
+
+def test_multi_query_rule_variants_and_fused_request() -> None:
+    variants = rule_variants("¿Qué hago si me echaron del trabajo?", 3)
+    assert variants[0] == "despido sin justa causa trabajo"
+    assert len(variants) == len(set(variants)) == 3
+    assert rule_variants("¿Qué es?", 3) == []
+    assert rule_variants("trabajo", 3) == [], "Sin sinonimos ni palabras de relleno no hay variantes nuevas"
+
+    fused, dense = build_fused_requests(
+        query_embedding=[1.0, 0.0],
+        sparse_query=None,
+        topk=5,
+        filters=None,
+        include_embedding=False,
+        expansion_embeddings=[[0.0, 1.0], [0.5, 0.5]],
+    )
+    assert isinstance(fused.query, models.FusionQuery) and len(fused.prefetch) == 3
+    # El score para el umbral sigue siendo el coseno de la pregunta original.
+    assert dense.query == [1.0, 0.0] and dense.limit == 5 * 3 * 3
+
+
+def test_collapse_versions_keeps_newest() -> None:
+    def point(point_id: str, score: float, chunk_key: str | None, version: str, updated_at: str) -> models.ScoredPoint:
+        payload = {"version": version, "updatedAt": updated_at}
+        if chunk_key is not None:
+            payload["chunkKey"] = chunk_key
+        return models.ScoredPoint(id=point_id, version=0, score=score, payload=payload)
+
+    points = [
+        point("a1", 0.9, "doc:0", "v1", "2026-01-01T00:00:00+00:00"),
+        point("b2", 0.8, "doc:1", "v2", "2026-02-01T00:00:00+00:00"),
+        point("a2", 0.7, "doc:0", "v2", "2026-02-01T00:00:00+00:00"),
+        point("legacy", 0.6, None, "v1", ""),
+        point("b1", 0.5, "doc:1", "v1", "2026-01-01T00:00:00+00:00"),
+    ]
+    collapsed = collapse_versions(points, limit=5)
+    # Una version por chunk, la mas nueva, en la posicion del mejor rankeado del grupo.
+    assert [str(item.id) for item in collapsed] == ["a2", "b2", "legacy"]
+    assert [str(item.id) for item in collapse_versions(points, limit=2)] == ["a2", "b2"]
+    # updatedAt se compara como fecha (con o sin zona) y manda sobre version; version en orden natural.
+    same_day = [
+        point("v9", 0.9, "doc:2", "v9", "2026-03-01T00:00:00Z"),
+        point("v10", 0.8, "doc:2", "v10", "2026-03-01T00:00:00+00:00"),
+        point("old", 0.9, "doc:3", "v12", "2026-01-01T00:00:00"),
+        point("new", 0.8, "doc:3", "v11", "2026-02-01T05:00:00+05:00"),
+    ]
+    assert [str(item.id) for item in collapse_versions(same_day, limit=5)] == ["v10", "new"]
+
+    # Coleccion a medio migrar: el chunk viejo (sin chunkKey) no debe desaparecer al agrupar.
+    client = QdrantClient(":memory:")
+    client.create_collection("docs", vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    client.upsert(
+        "docs",
+        points=[
+            models.PointStruct(id=1, vector=[1.0, 0.0], payload={"text": "viejo", "version": "v1"}),
+            models.PointStruct(id=2, vector=[0.8, 0.6], payload={"text": "nuevo", "chunkKey": "doc:0", "version": "v1"}),
+            models.PointStruct(id=3, vector=[0.6, 0.8], payload={"text": "nuevo v2", "chunkKey": "doc:0", "version": "v2"}),
+        ],
+    )
+    request = {"collection_name": "docs", "query_embedding": [1.0, 0.0], "topk": 5, "filters": None}
+    grouped = retrieve_candidates(client, include_embedding=False, version_group_size=2, **request)
+    assert [c.chunk_id for c in grouped] == ["1", "3"]
+    assert has_legacy_points(client, "docs")
+    # Sin puntos viejos (tras re-ingestar) el servicio apaga la consulta extra.
+    client.delete("docs", points_selector=models.PointIdsList(points=[1]))
+    assert not has_legacy_points(client, "docs")
+    grouped = retrieve_candidates(client, include_embedding=False, version_group_size=2, legacy_fallback=False, **request)
+    assert [c.chunk_id for c in grouped] == ["3"]
+
+
+def test_legal_refs_extraction() -> None:
+    assert [ref.key for ref in extract_legal_refs("Art. 249 CST")] == ["art:249:cst"]
+    assert [ref.key for ref in extract_legal_refs("arts. 64 y 65 del C.S.T.")] == ["art:64:cst", "art:65:cst"]
+    assert [ref.key for ref in extract_legal_refs("Ley 1.010 de 2006 y Decreto 1072")] == ["ley:1010", "decreto:1072"]
+    # El chunk del codigo guarda tambien la clave generica, que es la que usa una pregunta sin sigla.
+    assert legal_ref_keys("Artículo 64 del Código Sustantivo del Trabajo.") == ["art:64", "art:64:cst"]
+
+    assert is_citation_only("¿Qué dice el artículo 64?")
+    assert is_citation_only("Ley 1010")
+    assert not is_citation_only("¿me pueden despedir según el artículo 64?")
+    assert not is_citation_only("vacaciones")
+
+
+def test_embedded_bootstrap_copies_missing_collections() -> None:
+    with tempfile.TemporaryDirectory() as prebuilt, tempfile.TemporaryDirectory() as serve:
+        builder = QdrantClient(path=prebuilt)
+        builder.create_collection("docs", vectors_config=models.VectorParams(size=3, distance=models.Distance.COSINE))
+        builder.upsert("docs", points=[models.PointStruct(id=1, vector=[1.0, 0.0, 0.0], payload={"text": "uno"})])
+        builder.close()
+
+        assert bootstrap_embedded_storage(serve, prebuilt, ["docs", "otra"], lock_timeout_s=1) == ["docs"]
+        # Segundo arranque: la coleccion ya esta, no se vuelve a copiar.
+        assert bootstrap_embedded_storage(serve, prebuilt, ["docs"], lock_timeout_s=1) == []
+
+        client = open_embedded_client(serve, lock_timeout_s=1)
+        try:
+            assert client.count("docs").count == 1
+            try:
+                open_embedded_client(serve, lock_timeout_s=0)
+            except RuntimeError as exc:
+                assert "workers 1" in str(exc)
+            else:
+                raise AssertionError("Un segundo cliente sobre el mismo QDRANT_PATH debe fallar")
+        finally:
+            client.close()
+
+
+def test_replica_pool_routing_failover_and_hedge() -> None:
+    class FakeClient:
+        def __init__(self, name: str, delay_s: float = 0.0, down: bool = False) -> None:
+            self.name, self.delay_s, self.down, self.writes = name, delay_s, down, 0
+
+        def count(self, collection_name: str) -> str:
+            time.sleep(self.delay_s)
+            if self.down:
+                raise ConnectionError(f"{self.name} caido")
+            return self.name
+
+        def upsert(self, collection_name: str, points: list) -> None:
+            self.writes += 1
+
+    primary, fast, broken = FakeClient("primary"), FakeClient("fast"), FakeClient("broken", down=True)
+    pool = ReplicaPool(
+        [Replica("http://primary", primary), Replica("http://fast", fast), Replica("http://broken", broken)],
+        eject_failures=2,
+        ping=lambda replica: replica.client.count("docs"),
+    )
+    pool.replicas[0].ewma_ms, pool.replicas[1].ewma_ms, pool.replicas[2].ewma_ms = 8.0, 2.0, 1.0
+    client = ReplicatedQdrantClient(pool)
+
+    # La mas rapida esta caida: failover a la siguiente y, tras dos errores seguidos, sale de la rotacion.
+    assert client.count("docs") == "fast"
+    assert client.count("docs") == "fast"
+    assert not pool.replicas[2].healthy and pool.failovers == 2
+    client.upsert("docs", points=[])
+    assert primary.writes == 1 and fast.writes == 0
+
+    broken.down = False
+    assert pool.check_health() == 3 and pool.replicas[2].healthy
+
+    slow, quick = FakeClient("slow", delay_s=0.3), FakeClient("quick", delay_s=0.01)
+    hedged = ReplicaPool([Replica("http://slow", slow), Replica("http://quick", quick)], hedge_after_ms=20)
+    hedged.replicas[1].ewma_ms = 50.0
+    assert ReplicatedQdrantClient(hedged).count("docs") == "quick" and hedged.hedged == 1
+
+
+def test_qdrant_client_options_grpc_and_keepalive() -> None:
+    with _settings_env(
+        QDRANT_URL="http://qdrant:6333",
+        QDRANT_PREFER_GRPC="true",
+        QDRANT_GRPC_PORT="7334",
+        QDRANT_GRPC_COMPRESSION="gzip",
+        QDRANT_POOL_SIZE="3",
+        QDRANT_KEEPALIVE_S="45",
+    ):
+        options = qdrant_client_options()
+        assert options["prefer_grpc"] and options["grpc_port"] == 7334 and options["pool_size"] == 3
+        assert options["grpc_compression"] == grpc.Compression.Gzip
+        assert options["grpc_options"]["grpc.keepalive_time_ms"] == 45_000
+        assert options["grpc_options"]["grpc.keepalive_timeout_ms"] == 10_000
+        assert "limits" not in options
+
+        rest = qdrant_client_options(prefer_grpc=False, url="http://replica:6333")
+        assert rest["url"] == "http://replica:6333" and "prefer_grpc" not in rest
+        assert rest["limits"].max_connections == 3 and rest["limits"].keepalive_expiry == 45.0
+
+    with _settings_env(QDRANT_URL="http://qdrant:6333", QDRANT_PREFER_GRPC="true", QDRANT_GRPC_COMPRESSION="brotli"):
+        try:
+            qdrant_client_options()
+        except ValueError as exc:
+            assert "QDRANT_GRPC_COMPRESSION" in str(exc)
+        else:
+            raise AssertionError("Una compresion desconocida debe fallar")
+
+
+def test_storage_profile_migration() -> None:
+    class RecordingClient(QdrantClient):
+        # El modo local ignora cuantizacion y on_disk: se registra lo que se le pediria al servidor.
+        def __init__(self) -> None:
+            super().__init__(":memory:")
+            self.updates: list[dict] = []
+
+        def update_collection(self, collection_name, **kwargs):
+            self.updates.append(kwargs)
+            return True
+
+    client = RecordingClient()
+    client.create_collection("docs", vectors_config=models.VectorParams(size=8, distance=models.Distance.COSINE))
+    info = client.get_collection("docs")
+
+    with _settings_env(RAG_EMBED_DIM="8", RAG_MATRYOSHKA_DIM="0", QDRANT_STORAGE_PROFILE="default"):
+        _migrate_storage_profile(client, "docs", info)
+        assert client.updates == [], "Sin cambios de perfil no hay update_collection"
+
+    with _settings_env(
+        RAG_EMBED_DIM="8",
+        RAG_MATRYOSHKA_DIM="0",
+        QDRANT_STORAGE_PROFILE="scalar",
+        QDRANT_ON_DISK_VECTORS="true",
+    ):
+        _migrate_storage_profile(client, "docs", info)
+        update = client.updates.pop()
+        assert update["vectors_config"][""].on_disk is True
+        assert update["quantization_config"].scalar.type == models.ScalarType.INT8
+
+        migrated = info.model_copy(deep=True)
+        migrated.config.quantization_config = update["quantization_config"]
+        migrated.config.params.vectors.on_disk = True
+        _migrate_storage_profile(client, "docs", migrated)
+        assert client.updates == [], "Un perfil ya aplicado no se vuelve a migrar"
+
+    with _settings_env(RAG_EMBED_DIM="8", RAG_MATRYOSHKA_DIM="0", QDRANT_STORAGE_PROFILE="default"):
+        _migrate_storage_profile(client, "docs", migrated)
+        update = client.updates.pop()
+        assert update["quantization_config"] == models.Disabled.DISABLED
+        assert update["vectors_config"][""].on_disk is False
+
+    with _settings_env(QDRANT_STORAGE_PROFILE="pq"):
+        try:
+            _migrate_storage_profile(client, "docs", info)
+        except ValueError as exc:
+            assert "QDRANT_STORAGE_PROFILE" in str(exc)
+        else:
+            raise AssertionError("Un perfil desconocido debe fallar")
+
+
+def test_layout_mismatch_requires_explicit_migration() -> None:
+    provider = HashingEmbeddingProvider(dimensions=8)
+    texts = ["fuero de maternidad", "liquidacion de cesantias", "jornada maxima legal"]
+    client = QdrantClient(":memory:")
+    client.create_collection("docs", vectors_config=models.VectorParams(size=8, distance=models.Distance.COSINE))
+    client.upsert(
+        "docs",
+        points=[
+            models.PointStruct(id=idx, vector=vector, payload={"chunkText": text})
+            for idx, (text, vector) in enumerate(zip(texts, provider.embed(texts)))
+        ],
+    )
+
+    with _settings_env(RAG_EMBED_DIM="8", RAG_MATRYOSHKA_DIM="4", QDRANT_LAYOUT_MIGRATION="error"):
+        try:
+            _ensure_collection(client, "docs")
+        except RuntimeError as exc:
+            assert "QDRANT_LAYOUT_MIGRATION" in str(exc) and "'short': 4" in str(exc)
+        else:
+            raise AssertionError("Un layout distinto no debe recrear la coleccion sin opt-in")
+        assert client.count("docs").count == 3
+
+    with _settings_env(RAG_EMBED_DIM="8", RAG_MATRYOSHKA_DIM="4", QDRANT_LAYOUT_MIGRATION="migrate"):
+        _ensure_collection(client, "docs")
+        vectors = client.get_collection("docs").config.params.vectors
+        assert {name: cfg.size for name, cfg in vectors.items()} == {"full": 8, "short": 4}
+        assert client.count("docs").count == 3 and not client.collection_exists("docs__layout_migration")
+
+        request = build_query_request(
+            "docs",
+            provider.embed(["cesantias"])[0],
+            topk=2,
+            filters=None,
+            include_embedding=False,
+            matryoshka_dim=4,
+            prefetch_multiplier=3,
+        )
+        prefetch = request["prefetch"]
+        assert (prefetch.using, prefetch.limit, len(prefetch.query)) == ("short", 6, 4)
+        assert request["using"] == "full" and len(request["query"]) == 8
+        top = client.query_points(**request).points[0]
+        assert top.payload["chunkText"] == "liquidacion de cesantias", "El corto migrado debe seguir encontrando el chunk"
+
+
+def test_tenant_scoped_ingest_and_filters() -> None:
+    pdf_path = str(Path(__file__).resolve().parents[2] / "data" / "docs" / "SOF-IA CHATBOT CONSULTORIO JURIDICO V2.0.docx.pdf")
+    client = QdrantClient(":memory:")
+
+    def tenants(collection_name: str, filters: dict | None = None) -> list[str | None]:
+        request = build_query_request(collection_name, [1.0] * 16, topk=1000, filters=filters, include_embedding=False)
+        return sorted({point.payload.get("tenantId") for point in client.query_points(**request).points}, key=str)
+
+    def ingest(tenant_id: str | None, replace_source: bool = False) -> ingest_module.IngestReport:
+        options = ingest_module.build_ingest_options(
+            pdf_path,
+            doc_id="reglamento",
+            source="consultorio",
+            chunk_size=None,
+            overlap=None,
+            batch_size=None,
+            dry_run=False,
+            version="v1",
+            replace_source=replace_source,
+            tenant_id=tenant_id,
+        )
+        return ingest_module.PDFIngestService().ingest_pdf(options)
+
+    originals = (qdrant_module.get_qdrant_client, ingest_module.get_qdrant_client)
+    with tempfile.TemporaryDirectory() as tmp, _settings_env(
+        RAG_EMBED_PROVIDER="hashing",
+        RAG_EMBED_DIM="16",
+        RAG_EMBED_CACHE_ENABLED="false",
+        RAG_RETRIEVAL_GENERATION_DIR=tmp,
+        QDRANT_COLLECTION="docs",
+        QDRANT_TENANT_COLLECTIONS="t2=docs_t2",
+        RAG_TENANT_INCLUDE_SHARED="true",
+    ):
+        qdrant_module.get_qdrant_client = ingest_module.get_qdrant_client = lambda: client
+        get_embedding_provider.cache_clear()
+        get_collection_generations.cache_clear()
+        try:
+            assert (collection_for_tenant("t2"), collection_for_tenant("t1"), collection_for_tenant(None)) == (
+                "docs_t2",
+                "docs",
+                "docs",
+            )
+            chunks = ingest(None).inserted
+            assert ingest("t1").inserted == chunks and ingest("t2").inserted == chunks
+            assert client.count("docs").count == 2 * chunks and client.count("docs_t2").count == chunks
+
+            # Lectura: el tenant ve lo suyo mas lo compartido (should), o solo lo suyo sin RAG_TENANT_INCLUDE_SHARED.
+            assert tenants("docs", {"tenantId": "t1"}) == [None, "t1"]
+            assert tenants("docs_t2", {"tenantId": "t2"}) == ["t2"]
+            with _settings_env(RAG_TENANT_INCLUDE_SHARED="false"):
+                assert tenants("docs", {"tenantId": "t1"}) == ["t1"]
+
+            # replace_source borra (y cuenta por scroll) solo el alcance del tenant; el compartido usa IsEmpty.
+            assert ingest("t1", replace_source=True).sourceDocsDeleted == chunks
+            assert ingest(None, replace_source=True).sourceDocsDeleted == chunks
+            assert client.count("docs").count == 2 * chunks and tenants("docs") == [None, "t1"]
+        finally:
+            qdrant_module.get_qdrant_client, ingest_module.get_qdrant_client = originals
+            get_embedding_provider.cache_clear()
+            get_collection_generations.cache_clear()
+
+
 def main() -> None:
     test_rerank_cosine_order()
+    test_cosine_rerank_without_vectors_matches()
+    test_mmr_skips_near_duplicates()
     test_threshold_gate()
+    test_threshold_uses_best_score_under_fused_order()
+    test_async_evaluate_matches_sync()
+    test_exact_search_resolution()
+    test_embedding_batches_respect_token_budget()
+    test_embedding_store_roundtrip_and_dedup()
+    test_parallel_embedding_batches_keep_order_and_persist()
+    test_rate_limiter_backs_off_on_429_and_recovers()
+    test_hashing_provider_is_deterministic()
+    test_query_batcher_coalesces_concurrent_requests()
+    test_async_query_batcher_flushes_on_event_loop()
+    test_usage_ledger_aggregates_by_stage()
+    test_spanish_sparse_analyzer()
+    test_hot_tier_exact_search_with_filters()
+    test_hot_tier_skips_stale_or_foreign_bundles()
+    test_ttl_cache_hit_expiry_and_lru()
+    test_two_phase_hydration_keeps_order_and_scores()
+    test_retrieval_cache_invalidated_by_generation()
+    test_multi_query_rule_variants_and_fused_request()
+    test_collapse_versions_keeps_newest()
+    test_legal_refs_extraction()
+    test_tenant_scoped_ingest_and_filters()
+    test_embedded_bootstrap_copies_missing_collections()
+    test_replica_pool_routing_failover_and_hedge()
+    test_qdrant_client_options_grpc_and_keepalive()
+    test_storage_profile_migration()
+    test_layout_mismatch_requires_explicit_migration()
     print("OK: test_rag passed")
 
 
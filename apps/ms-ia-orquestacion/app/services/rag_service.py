@@ -11,11 +11,28 @@ from typing import Any
 
 import httpx
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from qdrant_client import models
 
+from app.ai.embedding_provider import create_embedding_provider
+from app.ai.rate_limiter import get_rate_limiter_summary
 from app.core.config import get_settings
-from app.db.qdrant import ensure_rag_collection, get_qdrant_client, get_qdrant_runtime_summary, qdrant_ping
+from app.db.qdrant import (
+    CHUNK_KEY_FIELD,
+    LEGAL_REFS_FIELD,
+    TENANT_FIELD,
+    chunk_group_key,
+    collection_for_tenant,
+    ensure_rag_collection,
+    get_async_qdrant_client,
+    get_qdrant_client,
+    get_qdrant_runtime_summary,
+    qdrant_ping,
+    tenant_scope_condition,
+)
+from app.rag.legal_refs import legal_ref_keys
+from app.rag.point_vectors import build_point_vector
+from app.rag.retrieval_cache import bump_collection_generation
 from app.rag.service import RetrievalPipelineService
 
 
@@ -25,10 +42,10 @@ logger = logging.getLogger("ms-ia-orquestacion")
 class RAGService:
     def __init__(self) -> None:
         settings = get_settings()
-        if not settings.openai_api_key:
+        if not settings.openai_api_key and settings.embedding_provider == "openai":
             raise ValueError("OPENAI_API_KEY no configurada. El servicio RAG requiere OpenAI.")
-        if not settings.qdrant_url:
-            raise ValueError("QDRANT_URL no configurada. El servicio RAG requiere Qdrant.")
+        if not settings.qdrant_url and not settings.qdrant_path:
+            raise ValueError("QDRANT_URL (o QDRANT_PATH) no configurada. El servicio RAG requiere Qdrant.")
 
         timeout = httpx.Timeout(
             timeout=float(os.getenv("RAG_OPENAI_TIMEOUT_S", "30")),
@@ -37,12 +54,27 @@ class RAGService:
             write=float(os.getenv("RAG_OPENAI_WRITE_TIMEOUT_S", "25")),
             pool=float(os.getenv("RAG_OPENAI_POOL_TIMEOUT_S", "5")),
         )
-        self._openai = OpenAI(
-            api_key=settings.openai_api_key,
-            max_retries=int(os.getenv("RAG_OPENAI_MAX_RETRIES", "2")),
-            timeout=timeout,
+        self._openai = (
+            OpenAI(
+                api_key=settings.openai_api_key,
+                max_retries=settings.openai_max_retries,
+                timeout=timeout,
+            )
+            if settings.openai_api_key
+            else None
+        )
+        self._async_openai = (
+            AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                max_retries=settings.openai_max_retries,
+                timeout=timeout,
+            )
+            if settings.openai_api_key
+            else None
         )
+        self._embedding_provider = create_embedding_provider(self._openai, self._async_openai)
         self._qdrant = get_qdrant_client()
+        self._async_qdrant = get_async_qdrant_client()
         self._qdrant_collection = settings.qdrant_collection
         ensure_rag_collection()
 
@@ -56,10 +88,11 @@ class RAGService:
         )
 
         logger.info(
-            "RAGService inicializado (qdrant=%s collection=%s embed_model=%s dims=%d)",
-            settings.qdrant_url,
+            "RAGService inicializado (qdrant=%s collection=%s embed_provider=%s embed_model=%s dims=%d)",
+            settings.qdrant_path or settings.qdrant_url,
             settings.qdrant_collection,
-            settings.embedding_model,
+            settings.embedding_provider,
+            self._embedding_provider.model,
             settings.embedding_dimensions,
         )
 
@@ -69,20 +102,20 @@ class RAGService:
             openai_client=self._openai,
             embedding_model=settings.embedding_model,
             answer_model=settings.openai_model,
+            embedding_provider=self._embedding_provider,
+            async_qdrant_client=self._async_qdrant,
+            async_openai_client=self._async_openai,
         )
 
     def diagnostics(self) -> dict[str, Any]:
         info = get_runtime_env_summary()
         info["ping"] = qdrant_ping()
+        info["rateLimiters"] = get_rate_limiter_summary()
+        info.update(self._pipeline.runtime_stats())
         return info
 
-    def _embed_texts(self, texts: list[str], dimensions: int) -> list[list[float]]:
-        response = self._openai.embeddings.create(
-            model=get_settings().embedding_model,
-            input=texts,
-            dimensions=dimensions,
-        )
-        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    def _embed_texts(self, texts: list[str]) -> list[list[float]]:
+        return self._embedding_provider.embed(texts, max_retries=get_settings().openai_max_retries)
 
     def ingest(
         self,
@@ -90,9 +123,11 @@ class RAGService:
         text: str,
         title: str | None = None,
         metadata: dict[str, Any] | None = None,
+        tenant_id: str | None = None,
     ) -> dict[str, Any]:
         settings = get_settings()
         metadata = metadata or {}
+        collection_name = collection_for_tenant(tenant_id)
         chunks = self._splitter.split_text(text)
         if not chunks:
             return {
@@ -102,11 +137,15 @@ class RAGService:
                 "chunks_inserted": 0,
             }
 
+        # El reemplazo por source queda acotado al tenant: otro consultorio puede usar el mismo source.
         source_filter = models.Filter(
-            must=[models.FieldCondition(key="source", match=models.MatchValue(value=source))]
+            must=[
+                models.FieldCondition(key="source", match=models.MatchValue(value=source)),
+                tenant_scope_condition(tenant_id),
+            ]
         )
         existing, _ = self._qdrant.scroll(
-            collection_name=self._qdrant_collection,
+            collection_name=collection_name,
             scroll_filter=source_filter,
             with_payload=False,
             with_vectors=False,
@@ -115,36 +154,42 @@ class RAGService:
         chunks_deleted = len(existing)
         if chunks_deleted:
             self._qdrant.delete(
-                collection_name=self._qdrant_collection,
+                collection_name=collection_name,
                 points_selector=models.FilterSelector(filter=source_filter),
             )
+            bump_collection_generation(collection_name)
 
-        vectors = self._embed_texts(chunks, settings.embedding_dimensions)
+        vectors = self._embed_texts(chunks)
         now = datetime.now(timezone.utc).isoformat()
         points: list[models.PointStruct] = []
         for idx, (chunk_text, vector) in enumerate(zip(chunks, vectors)):
-            hash_id = hashlib.sha256(f"{source}|{idx}|{chunk_text}".encode("utf-8")).hexdigest()
+            hash_key = f"{source}|{idx}|{chunk_text}" if not tenant_id else f"{tenant_id}|{source}|{idx}|{chunk_text}"
+            hash_id = hashlib.sha256(hash_key.encode("utf-8")).hexdigest()
             point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, hash_id))
             points.append(
                 models.PointStruct(
                     id=point_id,
-                    vector=vector,
+                    vector=build_point_vector(vector, chunk_text),
                     payload={
                         "source": source,
-                        "version": str(metadata.get("version", get_settings().version_default)),
+                        "version": str(metadata.get("version", settings.version_default)),
                         "title": title or "",
                         "chunkText": chunk_text,
                         "chunkIndex": idx,
+                        CHUNK_KEY_FIELD: chunk_group_key(source, idx, tenant_id),
                         "metadata": metadata,
+                        LEGAL_REFS_FIELD: legal_ref_keys(chunk_text),
                         "pageStart": metadata.get("pageStart"),
                         "pageEnd": metadata.get("pageEnd"),
+                        TENANT_FIELD: tenant_id,
                         "createdAt": now,
                         "updatedAt": now,
                     },
                 )
             )
 
-        self._qdrant.upsert(collection_name=self._qdrant_collection, points=points)
+        self._qdrant.upsert(collection_name=collection_name, points=points)
+        bump_collection_generation(collection_name)
         return {
             "source": source,
             "title": title,
@@ -161,12 +206,30 @@ class RAGService:
         filters: dict[str, Any] | None = None,
         overrides: dict[str, Any] | None = None,
         dry_run: bool = True,
+        correlation_id: str | None = None,
     ) -> dict[str, Any]:
         return self._pipeline.evaluate(
             query=query,
             incoming_filters=filters,
             overrides=overrides,
             dry_run=dry_run,
+            correlation_id=correlation_id,
+        )
+
+    async def arag_evaluate(
+        self,
+        query: str,
+        filters: dict[str, Any] | None = None,
+        overrides: dict[str, Any] | None = None,
+        dry_run: bool = True,
+        correlation_id: str | None = None,
+    ) -> dict[str, Any]:
+        return await self._pipeline.aevaluate(
+            query=query,
+            incoming_filters=filters,
+            overrides=overrides,
+            dry_run=dry_run,
+            correlation_id=correlation_id,
         )
 
 